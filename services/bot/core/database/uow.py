@@ -8,6 +8,8 @@ from modules.subscriptions.repositories import (
     SubscriptionAccessRepository,
     SubscriptionRepository,
 )
+from modules.stats.repositories import StatsRepository
+from modules.campaign.repositories import CampaignRepository, SegmentRepository
 from core.interface.message.repositories import MessageRepository
 from core.interface.button.repositories import ButtonRepository
 from core.interface.menu.repositories import MenuRepository
@@ -34,6 +36,9 @@ class RepositoriesMixin:
         self.admin_repo = AdminRepository(session)
         self.subscription_repo = SubscriptionRepository(session)
         self.subscription_access_repo = SubscriptionAccessRepository(session)
+        self.stats_repo = StatsRepository(session)
+        self.campaign_repo = CampaignRepository(session)
+        self.segment_repo = SegmentRepository(session)
 
 
 class UoW(IUnitOfWork, RepositoriesMixin):
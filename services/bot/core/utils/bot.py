@@ -0,0 +1,31 @@
+import os
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from core.constants.config import TOKEN
+
+
+_bot: Bot | None = None
+
+
+def get_bot() -> Bot:
+    """
+    Общий Bot для фоновых обработчиков (consumer'ы NATS): один пул HTTP-соединений
+    на процесс вместо нового клиента на каждое сообщение.
+
+    TELEGRAM_API_URL позволяет направить запросы на локальный Bot API или заглушку,
+    TELEGRAM_POOL_SIZE — размер пула (у HTTPXRequest по умолчанию 1 соединение,
+    и параллельные обработчики выстраивались бы в очередь).
+    """
+    global _bot
+    if _bot is None:
+        api_url = (os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org").rstrip("/")
+        pool_size = int(os.getenv("TELEGRAM_POOL_SIZE") or "16")
+        _bot = Bot(
+            token=TOKEN,
+            base_url=f"{api_url}/bot",
+            base_file_url=f"{api_url}/file/bot",
+            request=HTTPXRequest(connection_pool_size=pool_size, pool_timeout=10),
+        )
+    return _bot
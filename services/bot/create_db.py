@@ -1,5 +1,6 @@
 import asyncio
 
+from sqlalchemy import text
 from werkzeug.security import generate_password_hash
 
 from core.database.database import async_session_maker, engine
@@ -9,16 +10,93 @@ from core.interface.message.repositories import MessageRepository
 from core.interface.settings.repositories import SettingsRepository
 from common.models.models import *
 from common.models.base import Base
+from common.models.campaigns_models import CampaignDelivery, CampaignSegment, CampaignShard
 from common.models.interface_models import Button, Menu, Message
-from common.models.payments_models import Payment
+from common.models.payments_models import Payment, PaymentCallback, PaymentLatency
+from common.models.stats_models import *
 from common.models.subscriptions_models import Subscription, SubscriptionAccess
 from common.models.users_models import User
 from modules.users.repositories import AdminRepository
 
 
+# create_all() создаёт только отсутствующие таблицы, поэтому новые колонки/индексы
+# для уже существующих таблиц докатываем идемпотентными DDL.
+SCHEMA_UPDATES = [
+    "ALTER TABLE payments ADD COLUMN IF NOT EXISTS payment_url VARCHAR(1024)",
+    "ALTER TABLE payments ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE",
+    # Перед уникальным индексом закрываем дубли открытых счетов (оставляем самый свежий).
+    """
+    UPDATE payments SET status = 'canceled'
+    WHERE status = 'pending' AND id NOT IN (
+        SELECT max(id) FROM payments WHERE status = 'pending'
+        GROUP BY user_id, provider, amount
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_open_invoice
+    ON payments (user_id, provider, amount) WHERE status = 'pending'
+    """,
+    # raw_callback переезжает в append-only таблицу payment_callbacks.
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'payments' AND column_name = 'raw_callback'
+        ) THEN
+            INSERT INTO payment_callbacks (payment_id, source, payload, created_at)
+            SELECT id, 'legacy', raw_callback::jsonb, updated_at
+            FROM payments WHERE raw_callback IS NOT NULL;
+            ALTER TABLE payments DROP COLUMN raw_callback;
+        END IF;
+    END $$
+    """,
+    # Одиночные индексы на низкокардинальные/неиспользуемые колонки заменены составным и частичными.
+    "DROP INDEX IF EXISTS ix_payments_provider",
+    "DROP INDEX IF EXISTS ix_payments_status",
+    "DROP INDEX IF EXISTS ix_payments_provider_payment_id",
+    "DROP INDEX IF EXISTS ix_payments_provider_invoice_id",
+    "DROP INDEX IF EXISTS ix_payments_provider_payload",
+    "DROP INDEX IF EXISTS ix_payments_processed_at",
+    """
+    CREATE INDEX IF NOT EXISTS ix_payments_provider_status_created
+    ON payments (provider, status, created_at)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_payments_provider_invoice_id_partial
+    ON payments (provider_invoice_id) WHERE provider_invoice_id IS NOT NULL
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_payments_provider_payload_partial
+    ON payments (provider_payload) WHERE provider_payload IS NOT NULL
+    """,
+    # Индексы для инкрементального пересчёта роллапов статистики.
+    "CREATE INDEX IF NOT EXISTS ix_payments_created_at ON payments (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_updated_at ON payments (updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_paid_at ON payments (paid_at)",
+    "CREATE INDEX IF NOT EXISTS ix_subscriptions_created_at ON subscriptions (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_subscriptions_updated_at ON subscriptions (updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_subscriptions_revoked_at ON subscriptions (revoked_at)",
+    "CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)",
+    "ALTER TABLE send_message_campaign ADD COLUMN IF NOT EXISTS file_ids VARCHAR",
+    "ALTER TABLE campaign_shards ADD COLUMN IF NOT EXISTS retry BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE campaign_shards ADD COLUMN IF NOT EXISTS checkpoint_at TIMESTAMP WITH TIME ZONE",
+    """
+    ALTER TABLE send_message_campaign ADD COLUMN IF NOT EXISTS segment_id INTEGER
+    REFERENCES campaign_segments (id) ON DELETE SET NULL
+    """,
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE send_message_campaign ADD COLUMN IF NOT EXISTS post_message_ids VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_users_blocked ON users (user_id) WHERE blocked_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_users_reachable ON users (user_id) WHERE blocked_at IS NULL",
+]
+
+
 async def create_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPDATES:
+            await conn.execute(text(statement))
 
     async with async_session_maker() as session:
         button_repo = ButtonRepository(session)
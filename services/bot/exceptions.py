@@ -1,3 +1,7 @@
 
 class UserNotFoundError(Exception):
     pass
+
+
+class PaymentsUnavailableError(Exception):
+    """Сервис создания платежей не ответил в отведённое время."""
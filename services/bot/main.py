@@ -2,6 +2,7 @@ import asyncio
 import logging
 import os
 import pytz
+import signal
 import sys
 
 from telegram import Update
@@ -26,6 +27,8 @@ aps_logger.setLevel(logging.WARNING)
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+logger = logging.getLogger(__name__)
+
 
 async def get_handlers():
     async with async_session_maker() as session:
@@ -48,8 +51,25 @@ async def restart(update: Update, context) -> None:
     await context.application.stop()
 
 
+async def stop_listener(listener: asyncio.Task) -> None:
+    """Отменяет NATS listener и ждёт дренажа: полученные события успевают обработаться."""
+    listener.cancel()
+    try:
+        await listener
+    except asyncio.CancelledError:
+        pass
+    except Exception as exc:
+        logger.error("NATS listener stopped with error: %s", exc)
+
+
 async def main():
-    asyncio.create_task(nats_listener())
+    # Ссылка на задачу нужна, чтобы при остановке дождаться дренажа (и чтобы задачу не собрал GC).
+    listener = asyncio.create_task(nats_listener())
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
 
     defaults = Defaults(
         tzinfo=pytz.timezone('Europe/Moscow'),
@@ -82,14 +102,19 @@ async def main():
         await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
 
         try:
-            while True:
+            while not stopping.is_set() and not app.bot_data["restart"]:
                 await asyncio.sleep(0.01)
-                if app.bot_data["restart"]:
-                    os.execl(sys.executable, sys.executable, *sys.argv)
-
-        except Exception:
-            await app.updater.stop()
-            await app.stop()
+        finally:
+            await stop_listener(listener)
+            # /r уже остановил Application, updater остаётся запущенным.
+            if app.updater.running:
+                await app.updater.stop()
+            if app.running:
+                await app.stop()
+
+    if app.bot_data["restart"]:
+        # execl не выполняет finally и не ждёт задач — перезапуск только после дренажа.
+        os.execl(sys.executable, sys.executable, *sys.argv)
 
 
 if __name__ == '__main__':
@@ -3,6 +3,9 @@ import datetime as dt
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from common import dlq
+from common.event_codec import decode_event, describe_event
+from common.nats_client import nats_manager
 from core.constants.config import CHANNEL_ID
 from core.message_manager import MessageManager
 
@@ -116,15 +119,105 @@ async def admin_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Ок. Подписка отозвана, пользователь удалён из канала (если был).")
 
 
+def _format_amount(amount) -> str:
+    return f"{amount.normalize():f}" if amount is not None else "0"
+
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async with MessageManager(update, context) as mm:
-        stats = await mm.uow.subscription_repo.count_by_status(channel_id=CHANNEL_ID)
-        if not stats:
+        # Читаем только дневные роллапы (их обновляет задача stats_rollups_refresh),
+        # поэтому время ответа не зависит от объёма истории.
+        repo = mm.uow.stats_repo
+        watermark = await repo.get_watermark("payments")
+        if not watermark:
             await update.message.reply_text("Статистики пока нет.")
             return
 
-        lines = ["Статистика подписок:"]
-        for status, cnt in sorted(stats.items()):
-            lines.append(f"- {status}: {cnt}")
+        today = dt.datetime.now(dt.timezone.utc).date()
+        updated = watermark.refreshed_at.astimezone(dt.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+        lines = [f"Статистика (обновлено {updated}):"]
+
+        for title, days in (("сегодня", 1), ("7 дней", 7), ("30 дней", 30)):
+            since_day = today - dt.timedelta(days=days - 1)
+            revenue = [
+                f"{_format_amount(amount)} {currency} ({provider}, {cnt} шт.)"
+                for provider, currency, status, cnt, amount in await repo.payments_summary(since_day)
+                if status == "success"
+            ]
+            subs = await repo.subscriptions_summary(channel_id=CHANNEL_ID, since_day=since_day)
+            lines.append("")
+            lines.append(f"За {title}:")
+            lines.append("- выручка: " + ("; ".join(revenue) if revenue else "0"))
+            lines.append(
+                f"- подписки: новые {subs['new']}, продления {subs['renewed']}, "
+                f"истекли {subs['expired']}, отозваны {subs['revoked']}"
+            )
+
+        sources = await repo.users_by_source(since_day=today - dt.timedelta(days=29))
+        if sources:
+            lines.append("")
+            lines.append("Новые пользователи за 30 дней по источникам:")
+            for source, cnt in sources:
+                lines.append(f"- {source or 'без источника'}: {cnt}")
+
         await update.message.reply_text("\n".join(lines))
 
+
+def _parse_seq(context: ContextTypes.DEFAULT_TYPE) -> int | None:
+    try:
+        return int(context.args[0])
+    except (IndexError, ValueError):
+        return None
+
+
+async def admin_dlq(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/dlq [limit] — последние записи dead-letter очереди."""
+    try:
+        limit = min(50, int(context.args[0])) if context.args else 10
+    except ValueError:
+        limit = 10
+
+    total, entries = await dlq.list_entries(nats_manager, limit=limit)
+    if not entries:
+        await update.message.reply_text("DLQ пуста.")
+        return
+
+    lines = [f"DLQ: {total} сообщений, последние {len(entries)}:"]
+    for entry in entries:
+        try:
+            # Упакованные события (campaign.send) в сыром виде нечитаемы.
+            payload = describe_event(decode_event(entry.subject, entry.data, entry.headers))
+        except ValueError:
+            payload = entry.data[:200].decode("utf-8", errors="replace")
+        lines.append(
+            f"\n#{entry.seq} {entry.failed_at[:19]} {entry.subject} "
+            f"(доставок: {entry.deliveries})\n"
+            f"ошибка: {entry.error}\n"
+            f"payload: {payload}"
+        )
+    lines.append("\n/dlq_replay <seq> — отправить заново, /dlq_drop <seq> — удалить")
+    # Без HTML: в ошибках и payload бывают угловые скобки.
+    await update.message.reply_text("\n".join(lines)[:4000], parse_mode=None)
+
+
+async def admin_dlq_replay(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    seq = _parse_seq(context)
+    if seq is None:
+        await update.message.reply_text("Использование: /dlq_replay <seq>")
+        return
+    entry = await dlq.replay(nats_manager, seq)
+    if entry is None:
+        await update.message.reply_text(f"Запись #{seq} не найдена.")
+        return
+    await update.message.reply_text(f"Ок. #{seq} отправлено заново в {entry.subject}.")
+
+
+async def admin_dlq_drop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    seq = _parse_seq(context)
+    if seq is None:
+        await update.message.reply_text("Использование: /dlq_drop <seq>")
+        return
+    if await dlq.drop(nats_manager, seq):
+        await update.message.reply_text(f"Ок. #{seq} удалено из DLQ.")
+    else:
+        await update.message.reply_text(f"Запись #{seq} не найдена.")
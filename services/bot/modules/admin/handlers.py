@@ -3,7 +3,16 @@ from telegram.ext import filters
 from core.constants.config import TG_ADMIN_LIST
 from core.handlers.base import BaseHandler, CommandHandler
 
-from .callbacks import admin_add, admin_extend, admin_remove, admin_stats, admin_users
+from .callbacks import (
+    admin_add,
+    admin_dlq,
+    admin_dlq_drop,
+    admin_dlq_replay,
+    admin_extend,
+    admin_remove,
+    admin_stats,
+    admin_users,
+)
 
 
 class AdminHandler(BaseHandler):
@@ -19,4 +28,7 @@ class AdminHandler(BaseHandler):
         yield CommandHandler("extend", admin_extend, filters=admin_filter, order=1)
         yield CommandHandler("remove", admin_remove, filters=admin_filter, order=1)
         yield CommandHandler("stats", admin_stats, filters=admin_filter, order=1)
+        yield CommandHandler("dlq", admin_dlq, filters=admin_filter, order=1)
+        yield CommandHandler("dlq_replay", admin_dlq_replay, filters=admin_filter, order=1)
+        yield CommandHandler("dlq_drop", admin_dlq_drop, filters=admin_filter, order=1)
 
@@ -0,0 +1,92 @@
+import asyncio
+import datetime as dt
+import os
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from common.broadcast import SENT, TRANSIENT, is_unreachable
+from common.campaign_progress import ProgressCounter
+from core.database.uow import UoW
+
+
+CAMPAIGN_LEDGER_BATCH = int(os.getenv("CAMPAIGN_LEDGER_BATCH") or "500")
+CAMPAIGN_LEDGER_FLUSH_SECONDS = float(os.getenv("CAMPAIGN_LEDGER_FLUSH_SECONDS") or "5")
+
+
+def _message_id(result: Any):
+    # send_media_group возвращает по сообщению на каждый элемент группы
+    if isinstance(result, (list, tuple)):
+        result = result[0] if result else None
+    return getattr(result, "message_id", None)
+
+
+class DeliveryLedger:
+    """
+    Журнал доставки шарда: итоги отправки копятся в памяти и пишутся в
+    campaign_deliveries одним INSERT на CAMPAIGN_LEDGER_BATCH получателей или раз
+    в CAMPAIGN_LEDGER_FLUSH_SECONDS секунд — запись не тормозит отправку.
+
+    Запись пачки — контрольная точка: если воркер умрёт, повторный запуск шарда
+    пропустит записанных получателей, а повторно получат сообщение не больше
+    одной пачки. Итоги записанной пачки уходят и в прогресс кампании (progress).
+    Заблокировавшие бота отмечаются в users.blocked_at в той же транзакции.
+
+        ledger = DeliveryLedger(uow, shard)
+        await BroadcastEngine(send, on_result=ledger.record).run(recipients)
+        await ledger.flush()
+    """
+
+    def __init__(self, uow: UoW, shard, batch_size: int = CAMPAIGN_LEDGER_BATCH,
+                 flush_seconds: float = CAMPAIGN_LEDGER_FLUSH_SECONDS,
+                 progress: Optional[ProgressCounter] = None) -> None:
+        self.uow = uow
+        self.shard = shard
+        self.progress = progress
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.rows_written = 0
+        # суммарное время записи — накладные расходы журнала
+        self.write_seconds = 0.0
+        self._rows: list[dict] = []
+        self._unreachable: list[int] = []
+        self._flushed_at = time.monotonic()
+        # Сессия одна на шард, а отправителей много — пишут по очереди.
+        self._lock = asyncio.Lock()
+
+    async def record(self, chat_id: int, outcome: str, result: Any, attempts: int) -> None:
+        """on_result для BroadcastEngine."""
+        self._rows.append({
+            "campaign_id": self.shard.campaign_id,
+            "user_id": chat_id,
+            "status": outcome,
+            "message_id": _message_id(result) if outcome == SENT else None,
+            "error": None if outcome == SENT else str(result)[:255],
+            "attempts": attempts,
+        })
+        if outcome != SENT and is_unreachable(result):
+            self._unreachable.append(chat_id)
+        if (len(self._rows) >= self.batch_size
+                or time.monotonic() - self._flushed_at >= self.flush_seconds):
+            await self.flush()
+
+    async def flush(self) -> None:
+        rows, self._rows = self._rows, []
+        unreachable, self._unreachable = self._unreachable, []
+        self._flushed_at = time.monotonic()
+        if not rows:
+            return
+        async with self._lock:
+            started = time.monotonic()
+            now = dt.datetime.now(dt.timezone.utc)
+            await self.uow.campaign_repo.add_deliveries(self.shard.id, rows, now=now)
+            await self.uow.user_repo.mark_blocked(unreachable, now=now)
+            await self.uow.commit()
+            self.write_seconds += time.monotonic() - started
+            self.rows_written += len(rows)
+        if self.progress is not None:
+            counts = Counter(row["status"] for row in rows)
+            if self.shard.retry:
+                # Повтор: эти получатели уже посчитаны как временные ошибки.
+                counts[TRANSIENT] -= len(rows)
+            self.progress.add(counts)
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+from pathlib import Path
+import traceback
+from typing import AsyncIterator, Generator, List
+
+from telegram import (
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo
+)
+from telegram.constants import ParseMode
+from telegram.ext import ExtBot
+
+from common.broadcast import BroadcastEngine, BroadcastSummary
+from core.constants.config import STATIC_FOLDER
+
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramMessageSender:
+    def __init__(self, name: str,
+                 recipients: Generator[int, None, None] | AsyncIterator[int] | int,
+                 text: str = None, preview: bool = False,
+                 send_post: bool = False,
+                 channel_id: int = None,
+                 reply_markup=None, files_list: List = None,
+                 bot: ExtBot = None, upload_chat_id: int = None,
+                 post_message_ids: List[int] = None) -> None:
+        self.name = name
+        self.recipients = recipients
+        self.text = text
+        self.preview = preview
+        self.send_post = send_post
+        self.channel_id = channel_id
+        self.reply_markup = reply_markup
+        self.files_list = files_list
+        self.bot = bot
+        # Служебный чат, куда вложения загружаются до рассылки (upload_files).
+        # Без него файлы загружаются при отправке первому получателю.
+        self.upload_chat_id = upload_chat_id
+        # file_id вложений в порядке files_list после первой успешной загрузки
+        self.file_ids: List[str] = None
+        self.bytes_uploaded = 0
+        # message_id поста в канале channel_id (send_post): получателям уходят его копии
+        self.post_message_ids = post_message_ids
+        self._upload_lock = asyncio.Lock()
+        self.summary: BroadcastSummary = None
+        # Запрос, подготовленный render(): метод бота и аргументы без chat_id
+        self._method = None
+        self._payload: dict = None
+        # сколько байт вложений уходит с каждым запросом, пока нет file_id
+        self._payload_bytes = 0
+
+    def get_markup(self):
+        return self.reply_markup
+
+    def _get_file_type(self, file_path: str):
+        extension_to_type = {
+            'jpg': 'photo',
+            'jpeg': 'photo',
+            'png': 'photo',
+            'gif': 'animation',
+            'mp4': 'video_note',
+            'mkv': 'video',
+            'avi': 'video',
+            'mp3': 'voice',
+            'wav': 'voice',
+            'ogg': 'voice',
+            'oga': 'voice',
+            'pdf': 'document',
+            'doc': 'document',
+            'txt': 'document',
+            'docx': 'document',
+            'ppt': 'document',
+            'pptx': 'document',
+            'xls': 'document',
+            'xlsx': 'document',
+            'zip': 'document',
+            'rar': 'document',
+            'tar': 'document',
+            '7z': 'document'
+        }
+        extension = file_path.split('.')[-1].lower()
+        return extension_to_type.get(extension, 'unknown')
+
+    @property
+    def message_type(self):
+        if not self.files_list:
+            return 'message'
+        elif len(self.files_list) > 1:
+            return 'media_group'
+        return self._get_file_type(self.files_list[0])
+
+    def _get_media_obj(self, media_type: str = None):
+        if media_type == 'audio':
+            return InputMediaAudio
+        elif media_type == 'video':
+            return InputMediaVideo
+        elif media_type == 'document':
+            return InputMediaDocument
+        elif media_type == 'photo':
+            return InputMediaPhoto
+
+    def _build_payload(self, channel: bool = False) -> dict:
+        markup = self.get_markup()
+        if channel and not isinstance(markup, InlineKeyboardMarkup):
+            # В канале возможна только inline-клавиатура, обычная уйдёт с копиями.
+            markup = None
+
+        if self.message_type == 'message':
+            return {'text': self.get_text(),
+                    'reply_markup': markup,
+                    'parse_mode': ParseMode.HTML,
+                    'disable_web_page_preview': not self.preview}
+
+        elif self.message_type in ['document', 'photo', 'video', 'voice']:
+            return {'caption': self.get_caption(),
+                    'reply_markup': markup,
+                    'parse_mode': ParseMode.HTML,
+                    self.message_type: self.get_file_data()}
+
+        elif self.message_type == 'video_note':
+            return {'video_note': self.get_file_data(),
+                    'reply_markup': markup}
+
+        elif self.message_type == 'media_group':
+            return {'media': self.get_media_group()}
+
+        return {}
+
+    def render(self):
+        """
+        Готовит запрос один раз на рассылку: метод и аргументы без chat_id
+        (текст, parse_mode, клавиатура, вложения). Для send_post — копия поста
+        из канала. Пересобирается, только когда вложения получили file_id.
+        """
+        self._payload_bytes = 0
+        if self.post_message_ids:
+            if len(self.post_message_ids) == 1:
+                self._method = self.bot.copy_message
+                self._payload = {'from_chat_id': self.channel_id,
+                                 'message_id': self.post_message_ids[0],
+                                 'reply_markup': self.get_markup()}
+            else:
+                # альбом копируется целиком, без клавиатуры — как и send_media_group
+                self._method = self.bot.copy_messages
+                self._payload = {'from_chat_id': self.channel_id,
+                                 'message_ids': self.post_message_ids}
+            return
+
+        self._method = getattr(self.bot, f'send_{self.message_type}')
+        self._payload = self._build_payload()
+
+    def _get_file(self, index: int = 0, attach: bool = False):
+        """file_id уже загруженного вложения либо прочитанный файл для загрузки."""
+        if self.file_ids:
+            return self.file_ids[index]
+        file_path = Path(STATIC_FOLDER, self.files_list[index])
+        with open(file_path, 'rb') as file:
+            input_file = InputFile(file, filename=file_path.name, attach=attach)
+        # файл читается один раз, а уходит с каждым запросом до получения file_id
+        self._payload_bytes += len(input_file.input_file_content)
+        return input_file
+
+    def get_file_data(self):
+        return self._get_file(0)
+
+    @property
+    def is_media_group(self):
+        return self.message_type == 'media_group'
+
+    @property
+    def is_file(self):
+        return self.message_type in ['document', 'photo',
+                                     'video', 'voice']
+
+    def get_text(self):
+        return self.text
+
+    def get_caption(self):
+        return (
+            self.text if
+            self.is_file or self.is_media_group
+            else None
+        )
+
+    def get_media_group(self):
+        media_list = []
+        for index, file in enumerate(self.files_list):
+            file_type = self._get_file_type(file)
+            MediaObj = self._get_media_obj(file_type)
+
+            media = self._get_file(index, attach=True)
+
+            if index == len(self.files_list) - 1:
+                media_list.append(
+                    MediaObj(media,
+                             caption=self.get_caption(),
+                             parse_mode=ParseMode.HTML)
+                )
+            else:
+                media_list.append(MediaObj(media))
+        return media_list
+
+    @staticmethod
+    def _get_file_id(msg):
+        attachment = msg.effective_attachment
+        # фото приходит списком размеров, последний — самый большой
+        if isinstance(attachment, (list, tuple)):
+            attachment = attachment[-1] if attachment else None
+        return getattr(attachment, 'file_id', None)
+
+    def _remember_file_ids(self, msg) -> bool:
+        """
+        Запоминает file_id вложений из первого успешно отправленного сообщения;
+        True — если они только что появились.
+        """
+        if self.file_ids or not self.files_list or not msg:
+            return False
+        # send_media_group возвращает по сообщению на каждый элемент группы
+        messages = msg if isinstance(msg, (list, tuple)) else [msg]
+        file_ids = [self._get_file_id(message) for message in messages]
+        if len(file_ids) == len(self.files_list) and all(file_ids):
+            self.file_ids = file_ids
+            return True
+        return False
+
+    async def publish_post(self):
+        """
+        Публикует пост в канале channel_id (send_post); после этого получателям
+        уходят его копии (copy_message), а не новые сообщения.
+        """
+        method = getattr(self.bot, f'send_{self.message_type}')
+        self._payload_bytes = 0
+        payload = self._build_payload(channel=True)
+        self.bytes_uploaded += self._payload_bytes
+        msg = await method(chat_id=self.channel_id, **payload)
+        self._remember_file_ids(msg)
+        messages = msg if isinstance(msg, (list, tuple)) else [msg]
+        self.post_message_ids = [message.message_id for message in messages]
+        self.render()
+        return self.post_message_ids
+
+    async def upload_files(self):
+        """
+        Загружает вложения в служебный чат, чтобы получателям ушли уже file_id.
+        Ошибки Telegram не глушатся; ответ без file_id — RuntimeError.
+        """
+        if (not self.files_list or self.file_ids or self.post_message_ids
+                or self.upload_chat_id is None):
+            return
+        await self._send(chat_id=self.upload_chat_id)
+        if not self.file_ids:
+            raise RuntimeError(f"Campaign {self.name}: no file_id after upload")
+
+    async def _send(self, chat_id):
+        if self._payload is None:
+            self.render()
+        self.bytes_uploaded += self._payload_bytes
+        msg = await self._method(chat_id=chat_id, **self._payload)
+        if not self.post_message_ids and self._remember_file_ids(msg):
+            self.render()
+        return msg
+
+    async def deliver(self, chat_id):
+        """Отправка одному получателю для движка рассылки: ошибки Telegram не глушатся."""
+        if not self.files_list or self.file_ids or self.post_message_ids:
+            return await self._send(chat_id)
+        # Пока вложения не загружены, их загружает один отправитель,
+        # остальные ждут file_id, а не грузят те же файлы параллельно.
+        async with self._upload_lock:
+            return await self._send(chat_id)
+
+    async def send_one(self, chat_id=None):
+        try:
+            return await self._send(chat_id)
+        except Exception:
+            logger.info(str(traceback.format_exc()))
+
+    async def send(self, limiter=None, on_result=None) -> BroadcastSummary:
+        if isinstance(self.recipients, int):
+            await self.send_one(chat_id=self.recipients)
+            return self.summary
+
+        await self.upload_files()
+        engine = BroadcastEngine(self.deliver, limiter=limiter, on_result=on_result)
+        self.summary = await engine.run(self.recipients)
+        return self.summary
+
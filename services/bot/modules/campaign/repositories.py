@@ -0,0 +1,369 @@
+import datetime as dt
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import and_, delete, exists, false, func, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from core.database.base_repo import BaseRepository
+from common.broadcast import OUTCOMES, TRANSIENT
+from common.models.campaigns_models import (
+    CampaignDelivery,
+    CampaignSegment,
+    CampaignShard,
+    campaign_segment_members,
+)
+from common.models.users_models import SendMessageCampaign, User, user_campaign
+from common.segments import segment_definition, segment_query
+
+
+CAMPAIGN_RUNNING = 'Выполняется'
+CAMPAIGN_DONE = 'Завершена'
+
+AUDIENCE_ALL = "all"
+AUDIENCE_SEND_TO = "send_to"
+AUDIENCE_SEGMENT = "segment"
+AUDIENCE_LIST = "list"
+
+# Строк шардов в одном INSERT: у asyncpg не больше 32767 параметров на запрос.
+SHARDS_INSERT_BATCH = 2000
+
+
+def _reachable(user_id):
+    # NOT EXISTS по частичному индексу ix_users_blocked: недоступных мало.
+    return ~exists().where(User.user_id == user_id, User.blocked_at.is_not(None))
+
+
+class CampaignRepository(BaseRepository):
+    model = SendMessageCampaign
+
+    async def has_send_to(self, campaign_id: int) -> bool:
+        query = select(exists().where(user_campaign.c.campaign_id == campaign_id))
+        return bool(await self.session.scalar(query))
+
+    async def has_shards(self, campaign_id: int) -> bool:
+        query = select(exists().where(CampaignShard.campaign_id == campaign_id))
+        return bool(await self.session.scalar(query))
+
+    async def get_segment(self, campaign_id: int) -> Optional[CampaignSegment]:
+        query = (
+            select(CampaignSegment)
+            .join(SendMessageCampaign, SendMessageCampaign.segment_id == CampaignSegment.id)
+            .where(SendMessageCampaign.id == campaign_id)
+        )
+        return (await self.session.execute(query)).scalar_one_or_none()
+
+    async def _audience_ids(self, campaign_id: int, audience: str):
+        """user_id аудитории без недоступных (users.blocked_at)."""
+        if audience == AUDIENCE_SEGMENT:
+            segment = await self.get_segment(campaign_id)
+            if segment is None:
+                # Сегмент удалён после планирования — отправлять некому.
+                return select(User.user_id.label("user_id")).where(false())
+            ids = segment_query(segment).subquery()
+        elif audience == AUDIENCE_SEND_TO:
+            ids = (
+                select(user_campaign.c.user_id.label("user_id"))
+                .where(user_campaign.c.campaign_id == campaign_id)
+                .distinct()
+                .subquery()
+            )
+        else:
+            return select(User.user_id.label("user_id")).where(User.blocked_at.is_(None))
+        return select(ids.c.user_id).where(_reachable(ids.c.user_id))
+
+    async def count_audience(self, campaign_id: int, audience: str) -> int:
+        ids = (await self._audience_ids(campaign_id, audience)).subquery()
+        return int(await self.session.scalar(select(func.count()).select_from(ids)))
+
+    async def plan_ranges(self, campaign_id: int, audience: str,
+                          shard_size: int) -> list[tuple[int, int, int]]:
+        """
+        Делит аудиторию на диапазоны по shard_size получателей одним запросом:
+        [(first_user_id, last_user_id, recipients)]. Соседние диапазоны стыкуются,
+        поэтому пользователи, появившиеся во время рассылки, тоже попадают в шард.
+        """
+        ids = (await self._audience_ids(campaign_id, audience)).subquery()
+        numbered = select(
+            ids.c.user_id,
+            func.row_number().over(order_by=ids.c.user_id).label("rn"),
+        ).subquery()
+        shard_no = (numbered.c.rn - 1) // shard_size
+        query = (
+            select(func.min(numbered.c.user_id), func.max(numbered.c.user_id), func.count())
+            .group_by(shard_no)
+            .order_by(shard_no)
+        )
+        rows = (await self.session.execute(query)).all()
+        ranges = []
+        for index, (first, last, count) in enumerate(rows):
+            if index + 1 < len(rows):
+                last = rows[index + 1][0] - 1
+            ranges.append((first, last, count))
+        return ranges
+
+    async def add_shards(self, campaign_id: int, audience: str, shards: list[dict]) -> list[int]:
+        """
+        Новые шарды пачками по SHARDS_INSERT_BATCH; уже существующие (повтор события)
+        пропускаются. Возвращает id новых.
+        """
+        ids = []
+        for start in range(0, len(shards), SHARDS_INSERT_BATCH):
+            query = (
+                pg_insert(CampaignShard)
+                .values([{"campaign_id": campaign_id, "audience": audience, **shard}
+                         for shard in shards[start:start + SHARDS_INSERT_BATCH]])
+                .on_conflict_do_nothing(constraint="uq_campaign_shards_first_user")
+                .returning(CampaignShard.id)
+            )
+            ids.extend((await self.session.execute(query)).scalars().all())
+        return sorted(ids)
+
+    async def get_pending_shard_ids(self, campaign_id: int,
+                                    stale_before: Optional[dt.datetime] = None) -> list[int]:
+        """Шарды, ждущие отправки; со stale_before — и брошенные умершим воркером."""
+        query = (
+            select(CampaignShard.id)
+            .where(CampaignShard.campaign_id == campaign_id, self._claimable(stale_before))
+            .order_by(CampaignShard.id)
+        )
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+
+    @staticmethod
+    def _claimable(stale_before: Optional[dt.datetime]):
+        if stale_before is None:
+            return CampaignShard.status == "pending"
+        return or_(
+            CampaignShard.status == "pending",
+            and_(
+                CampaignShard.status == "running",
+                func.coalesce(CampaignShard.checkpoint_at, CampaignShard.started_at) < stale_before,
+            ),
+        )
+
+    async def mark_retry(self, campaign_id: int) -> list[int]:
+        """Выполненные шарды с временными ошибками снова ждут отправки — только этим получателям."""
+        query = (
+            update(CampaignShard)
+            .where(
+                CampaignShard.campaign_id == campaign_id,
+                CampaignShard.status == "done",
+                CampaignShard.transient > 0,
+            )
+            .values(status="pending", retry=True)
+            .returning(CampaignShard.id)
+        )
+        result = await self.session.execute(query)
+        return sorted(result.scalars().all())
+
+    async def set_status(self, campaign_id: int, status: str) -> None:
+        await self.session.execute(
+            update(SendMessageCampaign)
+            .where(SendMessageCampaign.id == campaign_id)
+            .values(status=status)
+        )
+
+    async def claim_shard(self, shard_id: int, now: dt.datetime,
+                          stale_before: dt.datetime) -> Optional[CampaignShard]:
+        """
+        pending → running; running без записей в журнал с stale_before (воркер умер)
+        берётся заново. None, если шард уже взят живой задачей или выполнен.
+        """
+        query = (
+            update(CampaignShard)
+            .where(CampaignShard.id == shard_id, self._claimable(stale_before))
+            .values(status="running", started_at=now, checkpoint_at=None)
+            .returning(CampaignShard)
+        )
+        result = await self.session.execute(query)
+        return result.scalar_one_or_none()
+
+    async def stream_shard_recipients(self, shard: CampaignShard,
+                                      chunk_size: int = 1000) -> AsyncIterator[int]:
+        """
+        Получатели шарда по возрастанию user_id — только id, курсором на сервере
+        по chunk_size строк, так что память не зависит от размера аудитории.
+        Курсор живёт в транзакции сессии: нужна отдельная сессия, которую
+        не коммитят, пока получатели не прочитаны.
+
+        Уже записанные в журнал доставки пропускаются, поэтому повторный запуск
+        продолжает с последней записи; retry-шард, наоборот, отправляет только
+        получателям с временной ошибкой. Недоступные (users.blocked_at)
+        пропускаются всегда — в том числе отмеченные уже после планирования.
+        """
+        if shard.audience == AUDIENCE_LIST:
+            ids = (
+                select(func.unnest(CampaignShard.user_ids).label("user_id"))
+                .where(CampaignShard.id == shard.id)
+                .subquery()
+            )
+            ids = select(ids.c.user_id).where(_reachable(ids.c.user_id)).subquery()
+        else:
+            ids = (await self._audience_ids(shard.campaign_id, shard.audience)).subquery()
+        delivery = exists().where(
+            CampaignDelivery.campaign_id == shard.campaign_id,
+            CampaignDelivery.user_id == ids.c.user_id,
+        )
+        if shard.retry:
+            delivery = delivery.where(CampaignDelivery.status == TRANSIENT)
+        else:
+            delivery = ~delivery
+        query = (
+            select(ids.c.user_id)
+            .where(ids.c.user_id.between(shard.first_user_id, shard.last_user_id), delivery)
+            .order_by(ids.c.user_id)
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await self.session.stream_scalars(query)
+        async for user_id in result:
+            yield user_id
+
+    async def count_recipients(self, campaign_id: int) -> int:
+        """Получателей во всех шардах кампании."""
+        query = (
+            select(func.coalesce(func.sum(CampaignShard.recipients), 0))
+            .where(CampaignShard.campaign_id == campaign_id)
+        )
+        return int(await self.session.scalar(query))
+
+    async def add_deliveries(self, shard_id: int, rows: list[dict], now: dt.datetime) -> None:
+        """
+        Пачка итогов в журнал доставки одним INSERT; у повторно отправленных
+        обновляются итог и число попыток. Время записи — контрольная точка шарда.
+        """
+        query = pg_insert(CampaignDelivery).values([{**row, "updated_at": now} for row in rows])
+        query = query.on_conflict_do_update(
+            index_elements=[CampaignDelivery.campaign_id, CampaignDelivery.user_id],
+            set_={
+                "status": query.excluded.status,
+                "message_id": query.excluded.message_id,
+                "error": query.excluded.error,
+                "attempts": CampaignDelivery.attempts + query.excluded.attempts,
+                "updated_at": query.excluded.updated_at,
+            },
+        )
+        await self.session.execute(query)
+        await self.session.execute(
+            update(CampaignShard).where(CampaignShard.id == shard_id).values(checkpoint_at=now)
+        )
+
+    async def count_shard_deliveries(self, shard: CampaignShard) -> dict[str, int]:
+        """Итоги шарда по журналу доставки — с учётом прерванных запусков и повторов."""
+        query = (
+            select(CampaignDelivery.status, func.count())
+            .where(
+                CampaignDelivery.campaign_id == shard.campaign_id,
+                CampaignDelivery.user_id.between(shard.first_user_id, shard.last_user_id),
+            )
+            .group_by(CampaignDelivery.status)
+        )
+        if shard.audience == AUDIENCE_LIST:
+            query = query.where(CampaignDelivery.user_id.in_(shard.user_ids or []))
+        counts = dict.fromkeys(OUTCOMES, 0)
+        counts.update((await self.session.execute(query)).all())
+        return counts
+
+    async def lock_file_ids(self, campaign_id: int) -> Optional[str]:
+        """
+        file_id вложений кампании под блокировкой строки: вложения загружает
+        тот шард, что взял блокировку первым, остальные ждут и берут его file_id.
+        """
+        query = (
+            select(SendMessageCampaign.file_ids)
+            .where(SendMessageCampaign.id == campaign_id)
+            .with_for_update()
+        )
+        return await self.session.scalar(query)
+
+    async def save_file_ids(self, campaign_id: int, file_ids: str) -> None:
+        await self.session.execute(
+            update(SendMessageCampaign)
+            .where(SendMessageCampaign.id == campaign_id, SendMessageCampaign.file_ids.is_(None))
+            .values(file_ids=file_ids)
+        )
+
+    async def lock_post_message_ids(self, campaign_id: int) -> Optional[str]:
+        """
+        post_message_ids кампании под блокировкой строки: пост в канале публикует
+        тот шард, что взял блокировку первым, остальные ждут и берут его message_id.
+        """
+        query = (
+            select(SendMessageCampaign.post_message_ids)
+            .where(SendMessageCampaign.id == campaign_id)
+            .with_for_update()
+        )
+        return await self.session.scalar(query)
+
+    async def save_post_message_ids(self, campaign_id: int, post_message_ids: str) -> None:
+        await self.session.execute(
+            update(SendMessageCampaign)
+            .where(SendMessageCampaign.id == campaign_id)
+            .values(post_message_ids=post_message_ids)
+        )
+
+    async def finish_shard(self, shard: CampaignShard, now: dt.datetime) -> bool:
+        """
+        Отмечает шард выполненным с итогами из журнала доставки; если он был
+        последним, завершает кампанию.
+        Строка кампании блокируется, чтобы параллельно завершившиеся шарды
+        не разминулись при проверке «остались ли невыполненные».
+        """
+        await self.session.execute(
+            select(SendMessageCampaign.id)
+            .where(SendMessageCampaign.id == shard.campaign_id)
+            .with_for_update()
+        )
+        counts = await self.count_shard_deliveries(shard)
+        await self.session.execute(
+            update(CampaignShard)
+            .where(CampaignShard.id == shard.id)
+            .values(status="done", finished_at=now, **counts)
+        )
+        remaining = await self.session.scalar(
+            select(func.count())
+            .select_from(CampaignShard)
+            .where(CampaignShard.campaign_id == shard.campaign_id, CampaignShard.status != "done")
+        )
+        if remaining:
+            return False
+        await self.set_status(shard.campaign_id, CAMPAIGN_DONE)
+        return True
+
+
+class SegmentRepository(BaseRepository):
+    model = CampaignSegment
+
+    async def get_materialized(self) -> list[CampaignSegment]:
+        query = select(CampaignSegment).where(CampaignSegment.materialized.is_(True))
+        return list((await self.session.execute(query)).scalars().all())
+
+    async def refresh(self, segment: CampaignSegment, now: dt.datetime) -> tuple[int, int]:
+        """
+        Инкрементально обновляет состав материализованного сегмента: добавляет
+        новых участников и удаляет выбывших, не переписывая остальных.
+        Возвращает (добавлено, удалено).
+        """
+        members = campaign_segment_members
+        definition = segment_definition(segment, now).subquery()
+        added = await self.session.execute(
+            pg_insert(members)
+            .from_select(
+                ["segment_id", "user_id"],
+                select(literal(segment.id), definition.c.user_id),
+            )
+            .on_conflict_do_nothing()
+        )
+        current = segment_definition(segment, now).where(User.user_id == members.c.user_id)
+        removed = await self.session.execute(
+            delete(members)
+            .where(members.c.segment_id == segment.id, ~current.exists())
+        )
+        count = await self.session.scalar(
+            select(func.count()).select_from(members).where(members.c.segment_id == segment.id)
+        )
+        await self.session.execute(
+            update(CampaignSegment)
+            .where(CampaignSegment.id == segment.id)
+            .values(member_count=count, refreshed_at=now)
+        )
+        return added.rowcount, removed.rowcount
@@ -0,0 +1,321 @@
+import ast
+import datetime as dt
+import json
+import logging
+import os
+from typing import AsyncIterator, Optional
+
+from common.broadcast import BroadcastSummary
+from common.campaign_progress import ProgressCounter
+from common.models.campaigns_models import CampaignSegment, CampaignShard
+from core.constants.config import CHANNEL_ID, TG_ADMIN_LIST
+from core.database.uow import SqlAlchemyUoW, UoW
+from core.interface.services import BotInterfaceService
+from modules.campaign.ledger import DeliveryLedger
+from modules.campaign.message_campaign import TelegramMessageSender
+from modules.campaign.repositories import (
+    AUDIENCE_ALL,
+    AUDIENCE_LIST,
+    AUDIENCE_SEGMENT,
+    AUDIENCE_SEND_TO,
+    CAMPAIGN_DONE,
+    CAMPAIGN_RUNNING,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+CAMPAIGN_SHARD_SIZE = int(os.getenv("CAMPAIGN_SHARD_SIZE") or "500")
+# Служебный чат для загрузки вложений до рассылки (по умолчанию — первый администратор)
+CAMPAIGN_UPLOAD_CHAT_ID = (
+    os.getenv("CAMPAIGN_UPLOAD_CHAT_ID") or (TG_ADMIN_LIST[0] if TG_ADMIN_LIST else None)
+)
+# running-шард без записей в журнал доставки дольше этого времени считается брошенным
+CAMPAIGN_SHARD_STALE_SECONDS = int(os.getenv("CAMPAIGN_SHARD_STALE_SECONDS") or "600")
+# сколько user_id получателей за раз читается из курсора
+CAMPAIGN_RECIPIENTS_CHUNK = int(os.getenv("CAMPAIGN_RECIPIENTS_CHUNK") or "1000")
+# сколько получателей обходит пробный запуск (dry_run)
+CAMPAIGN_DRY_RUN_SAMPLE = int(os.getenv("CAMPAIGN_DRY_RUN_SAMPLE") or "600")
+
+
+async def _take(recipients: AsyncIterator[int], limit: int) -> AsyncIterator[int]:
+    if limit <= 0:
+        return
+    taken = 0
+    async for user_id in recipients:
+        yield user_id
+        taken += 1
+        if taken >= limit:
+            return
+
+
+def _files(campaign) -> list[str]:
+    # web хранит список файлов строкой repr списка, без вложений — "[]"
+    return ast.literal_eval(campaign.files) if campaign.files else []
+
+
+def _stale_before(now: dt.datetime) -> dt.datetime:
+    return now - dt.timedelta(seconds=CAMPAIGN_SHARD_STALE_SECONDS)
+
+
+class CampaignService:
+    def __init__(self, uow: UoW) -> None:
+        self.uow = uow
+
+    async def plan(self, campaign_id: int, user_ids: Optional[list[int]] = None) -> list[int]:
+        """
+        Делит получателей кампании на шарды (без commit) и возвращает id всех шардов
+        кампании, которые ещё ждут отправки, — их нужно поставить в очередь.
+
+        user_ids — явный список из события campaign.send (кусок списка, если событие
+        было разбито common.event_codec); иначе аудитория — сегмент кампании,
+        send_to или все пользователи; недоступные (users.blocked_at) не попадают
+        ни в один шард. Повтор события новых шардов не создаёт, а ещё не
+        взятые шарды ставит повторно (лишнюю задачу отсекает claim_shard).
+        """
+        campaign = await self.uow.campaign_repo.get(id=campaign_id)
+        if campaign is None:
+            raise ValueError(f"Campaign {campaign_id} not found")
+        if _files(campaign) and not campaign.send_post and CAMPAIGN_UPLOAD_CHAT_ID is None:
+            # Без служебного чата вложения загружал бы каждый шард — отказ до создания шардов.
+            raise ValueError(
+                f"Campaign {campaign_id}: attachments require CAMPAIGN_UPLOAD_CHAT_ID"
+            )
+
+        if user_ids:
+            blocked = await self.uow.user_repo.get_blocked_ids(set(user_ids))
+            ids = sorted(set(user_ids) - blocked)
+            size = CAMPAIGN_SHARD_SIZE
+            chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+            shards = [
+                {"first_user_id": chunk[0], "last_user_id": chunk[-1],
+                 "user_ids": chunk, "recipients": len(chunk)}
+                for chunk in chunks
+            ]
+            audience = AUDIENCE_LIST
+        else:
+            if await self.uow.campaign_repo.has_shards(campaign_id):
+                logger.info("Campaign %s is already split into shards", campaign_id)
+                return await self.uow.campaign_repo.get_pending_shard_ids(campaign_id)
+            audience, segment = await self._audience(campaign_id)
+            if segment is not None and segment.materialized and segment.refreshed_at is None:
+                await self.uow.segment_repo.refresh(
+                    segment, now=dt.datetime.now(dt.timezone.utc)
+                )
+            ranges = await self.uow.campaign_repo.plan_ranges(
+                campaign_id, audience, CAMPAIGN_SHARD_SIZE
+            )
+            shards = [
+                {"first_user_id": first, "last_user_id": last, "recipients": count}
+                for first, last, count in ranges
+            ]
+
+        if await self.uow.campaign_repo.add_shards(campaign_id, audience, shards):
+            await self.uow.campaign_repo.set_status(campaign_id, CAMPAIGN_RUNNING)
+        elif not shards:
+            # Некому отправлять — кампания завершается сразу.
+            await self.uow.campaign_repo.set_status(campaign_id, CAMPAIGN_DONE)
+        return await self.uow.campaign_repo.get_pending_shard_ids(campaign_id)
+
+    async def _audience(self, campaign_id: int) -> tuple[str, Optional[CampaignSegment]]:
+        """Аудитория кампании без явного списка: сегмент, send_to или все."""
+        segment = await self.uow.campaign_repo.get_segment(campaign_id)
+        if segment is not None:
+            return AUDIENCE_SEGMENT, segment
+        if await self.uow.campaign_repo.has_send_to(campaign_id):
+            return AUDIENCE_SEND_TO, None
+        return AUDIENCE_ALL, None
+
+    async def resume(self, campaign_id: int) -> list[int]:
+        """
+        Шарды, которые нужно поставить в очередь, чтобы продолжить прерванную
+        рассылку: ещё не взятые и брошенные умершим воркером. Получатели,
+        уже записанные в журнал доставки, повторно не получат сообщение.
+        Кампания без шардов (событие campaign.send не дошло до бота)
+        планируется заново.
+        """
+        if not await self.uow.campaign_repo.has_shards(campaign_id):
+            return await self.plan(campaign_id)
+        now = dt.datetime.now(dt.timezone.utc)
+        shard_ids = await self.uow.campaign_repo.get_pending_shard_ids(
+            campaign_id, stale_before=_stale_before(now)
+        )
+        if shard_ids:
+            await self.uow.campaign_repo.set_status(campaign_id, CAMPAIGN_RUNNING)
+        return shard_ids
+
+    async def retry(self, campaign_id: int) -> list[int]:
+        """Повторная отправка только тем, кому не ушло из-за временной ошибки."""
+        shard_ids = await self.uow.campaign_repo.mark_retry(campaign_id)
+        if shard_ids:
+            await self.uow.campaign_repo.set_status(campaign_id, CAMPAIGN_RUNNING)
+        return await self.uow.campaign_repo.get_pending_shard_ids(campaign_id)
+
+    async def _build_sender(self, campaign, bot, recipients) -> TelegramMessageSender:
+        markup = None
+        if campaign.menu_id:
+            markup = await BotInterfaceService(self.uow).get_keyboard(menu_id=campaign.menu_id)
+        sender = TelegramMessageSender(
+            name=campaign.name,
+            recipients=recipients,
+            text=campaign.text,
+            preview=campaign.preview,
+            send_post=campaign.send_post,
+            channel_id=CHANNEL_ID,
+            reply_markup=markup,
+            files_list=_files(campaign) or None,
+            bot=bot,
+            upload_chat_id=CAMPAIGN_UPLOAD_CHAT_ID,
+        )
+        # Вложения, уже загруженные другим шардом, повторно не загружаются.
+        if campaign.file_ids:
+            sender.file_ids = json.loads(campaign.file_ids)
+        if campaign.post_message_ids:
+            sender.post_message_ids = json.loads(campaign.post_message_ids)
+        sender.render()
+        return sender
+
+    async def _ensure_post(self, campaign, sender: TelegramMessageSender) -> None:
+        """
+        send_post: пост в канале публикуется один раз на кампанию, получатели
+        получают его копии. Шарды идут параллельно, поэтому публикует первый,
+        взявший блокировку строки кампании; остальные берут его message_id.
+        """
+        if sender.post_message_ids:
+            return
+        if not sender.channel_id:
+            raise ValueError(f"Campaign {campaign.id}: send_post requires CHANNEL_ID")
+        post_message_ids = await self.uow.campaign_repo.lock_post_message_ids(campaign.id)
+        if post_message_ids:
+            sender.post_message_ids = json.loads(post_message_ids)
+            sender.render()
+        else:
+            await sender.publish_post()
+            await self.uow.campaign_repo.save_post_message_ids(
+                campaign.id, json.dumps(sender.post_message_ids)
+            )
+            logger.info("Campaign %s posted to channel %s: %s",
+                        campaign.id, sender.channel_id, sender.post_message_ids)
+        await self.uow.commit()
+
+    async def _ensure_files(self, campaign, sender: TelegramMessageSender) -> None:
+        """
+        Вложения загружаются в служебный чат один раз на кампанию, и их file_id
+        сохраняются до того, как шард начнёт отправку: загружает первый шард,
+        взявший блокировку строки кампании, остальные берут сохранённые file_id.
+        """
+        if not sender.files_list or sender.file_ids or sender.post_message_ids:
+            return
+        if sender.upload_chat_id is None:
+            raise ValueError(f"Campaign {campaign.id}: attachments require CAMPAIGN_UPLOAD_CHAT_ID")
+        file_ids = await self.uow.campaign_repo.lock_file_ids(campaign.id)
+        if file_ids:
+            sender.file_ids = json.loads(file_ids)
+            sender.render()
+        else:
+            await sender.upload_files()
+            await self.uow.campaign_repo.save_file_ids(campaign.id, json.dumps(sender.file_ids))
+            logger.info("Campaign %s attachments uploaded: %s bytes",
+                        campaign.id, sender.bytes_uploaded)
+        await self.uow.commit()
+
+    async def dry_run(self, bot, campaign_id: int, sample: int = CAMPAIGN_DRY_RUN_SAMPLE,
+                      limiter=None) -> dict:
+        """
+        Пробный запуск: тот же путь, что у send_shard (получатели курсором,
+        клавиатура из меню, вложения, лимит скорости), но на первых sample
+        получателях аудитории и через переданный bot — заглушку Telegram
+        (tests/bench/bench_campaign_dry_run.py). В БД ничего не пишется:
+        ни шарды, ни журнал доставки, ни blocked_at.
+
+        Возвращает итог выборки и оценку длительности и скорости для всей
+        аудитории кампании.
+        """
+        campaign = await self.uow.campaign_repo.get(id=campaign_id)
+        if campaign is None:
+            raise ValueError(f"Campaign {campaign_id} not found")
+        audience, _ = await self._audience(campaign_id)
+        recipients = await self.uow.campaign_repo.count_audience(campaign_id, audience)
+        # Шард на всю аудиторию — только для выборки получателей, в БД не попадает.
+        shard = CampaignShard(
+            id=0, campaign_id=campaign_id, audience=audience, retry=False,
+            first_user_id=0, last_user_id=2 ** 63 - 1,
+        )
+        stream = self.uow.campaign_repo.stream_shard_recipients(
+            shard, chunk_size=CAMPAIGN_RECIPIENTS_CHUNK
+        )
+        sender = await self._build_sender(campaign, bot, _take(stream, sample))
+        if campaign.send_post and not sender.post_message_ids:
+            # пост уходит в канал заглушки и в кампанию не сохраняется
+            await sender.publish_post()
+        summary = await sender.send(limiter)
+        await stream.aclose()
+
+        # Пропускная способность — по всем обработанным, а не только доставленным:
+        # заблокировавшие тоже занимают слот лимита.
+        rate = summary.total / summary.elapsed if summary.elapsed else 0.0
+        return {
+            "campaign_id": campaign_id,
+            "audience": audience,
+            "recipients": recipients,
+            "shards": -(-recipients // CAMPAIGN_SHARD_SIZE),
+            "sample": summary.as_dict(),
+            "bytes_uploaded": sender.bytes_uploaded,
+            "expected_msgs_per_second": round(rate, 2),
+            "expected_seconds": round(recipients / rate, 1) if rate else None,
+        }
+
+    async def send_shard(self, bot, shard_id: int, limiter=None,
+                         progress_kv=None) -> Optional[BroadcastSummary]:
+        """
+        Отправляет шард и отмечает его выполненным; последний шард завершает кампанию.
+        Итог по каждому получателю пишется в журнал доставки (DeliveryLedger),
+        с progress_kv — ещё и в прогресс кампании (common.campaign_progress).
+        None — шард уже взят другой задачей (повторная постановка).
+        """
+        now = dt.datetime.now(dt.timezone.utc)
+        shard = await self.uow.campaign_repo.claim_shard(
+            shard_id, now=now, stale_before=_stale_before(now)
+        )
+        await self.uow.commit()
+        if shard is None:
+            logger.info("Campaign shard %s is already taken, skipping", shard_id)
+            return None
+
+        campaign = await self.uow.campaign_repo.get(id=shard.campaign_id)
+        progress = None
+        if progress_kv is not None:
+            total = await self.uow.campaign_repo.count_recipients(campaign.id)
+            progress = ProgressCounter(progress_kv, campaign.id, total)
+        ledger = DeliveryLedger(self.uow, shard, progress=progress)
+        # Получатели читаются курсором в отдельной сессии по мере отправки,
+        # а основная сессия свободна для записей журнала доставки.
+        async with SqlAlchemyUoW() as reader:
+            recipients = reader.campaign_repo.stream_shard_recipients(
+                shard, chunk_size=CAMPAIGN_RECIPIENTS_CHUNK
+            )
+            sender = await self._build_sender(campaign, bot, recipients)
+            if campaign.send_post:
+                await self._ensure_post(campaign, sender)
+            else:
+                await self._ensure_files(campaign, sender)
+            await self.uow.commit()
+            summary = await sender.send(limiter, on_result=ledger.record)
+        await ledger.flush()
+        if progress is not None:
+            await progress.close()
+
+        completed = await self.uow.campaign_repo.finish_shard(
+            shard, now=dt.datetime.now(dt.timezone.utc)
+        )
+        await self.uow.commit()
+        logger.info(
+            "Campaign %s shard %s: %s, %s bytes uploaded, ledger %s rows in %.3fs (%.1f%%)",
+            campaign.id, shard_id, summary.as_dict(), sender.bytes_uploaded,
+            ledger.rows_written, ledger.write_seconds,
+            100 * ledger.write_seconds / summary.elapsed if summary.elapsed else 0.0,
+        )
+        if completed:
+            logger.info("Campaign %s completed", campaign.id)
+        return summary
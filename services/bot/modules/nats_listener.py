@@ -1,162 +1,332 @@
 import logging
-import json
 import datetime as dt
+import os
 
-from pydantic import ValidationError
-from sqlalchemy import update
-from telegram import Bot
+from sqlalchemy.dialects.postgresql import insert
+from telegram.error import BadRequest, Forbidden, RetryAfter
 
-from common.events import PaymentSucceededEvent, SendCampaignEvent
-from common.models.payments_models import Payment
+from common import latency, metrics
+from common.event_codec import decode_event, describe_event
+from common.models.payments_models import PaymentLatency
 from core.constants.config import CHANNEL_ID, TOKEN
 from core.database.uow import SqlAlchemyUoW
+from core.utils.bot import get_bot
+from modules.campaign.services import CampaignService
 from modules.subscriptions.services import SubscriptionService
 import asyncio
-import nats
-from nats.js.api import StreamConfig
+from nats.errors import TimeoutError as NatsTimeoutError
 from nats.aio.msg import Msg
 
-from modules.tasks.tasks import simple_task
-from modules.tasks.broker import broker_context
+from common.dlq import dead_letter, nak_or_dead_letter, watch_max_deliveries
+from common.nats_client import (
+    CONSUMERS,
+    PAYMENT_PARTITIONS,
+    PAYMENTS_DURABLE,
+    STREAMS,
+    get_consumer_spec,
+    nats_manager,
+)
+from common.stream_health import StreamHealth, WatchedConsumer
+
+from modules.tasks.tasks import send_campaign_shard
+from modules.tasks.broker import broker, kick_many
 
 
 logger = logging.getLogger(__name__)
 
 
-async def _ensure_stream(
-    js,
-    *,
-    name: str,
-    subjects: list[str],
-    max_msgs: int,
-) -> None:
-    stream_config = StreamConfig(
-        name=name,
-        subjects=subjects,
-        retention="workqueue",
-        max_msgs=max_msgs,
+CAMPAIGNS_DURABLE = "campaign_processor"
+
+# Повтор не поможет: битый payload (ValidationError — тоже ValueError),
+# пользователь заблокировал бота, неверный запрос к Telegram.
+PERMANENT_ERRORS = (ValueError, Forbidden, BadRequest)
+
+PAYMENT_STAGE_SECONDS = metrics.histogram(
+    "payment_stage_seconds",
+    "Время от предыдущего этапа оплаты до этого (common.latency.STAGES)",
+    ("stage",),
+)
+PAYMENT_TO_ACCESS_SECONDS = metrics.histogram(
+    "payment_to_access_seconds",
+    "От callback провайдера до отправки инвайта пользователю",
+    ("provider",),
+)
+
+
+async def _handle_failure(msg: Msg, exc: Exception, durable: str) -> None:
+    """Постоянные ошибки — сразу в DLQ, временные — повтор с backoff, после max_deliver — в DLQ."""
+    error = f"{exc.__class__.__name__}: {exc}"
+    max_deliver = get_consumer_spec(durable).max_deliver
+    try:
+        if isinstance(exc, PERMANENT_ERRORS):
+            await dead_letter(nats_manager, msg, error)
+        elif isinstance(exc, RetryAfter) and msg.metadata.num_delivered < max_deliver:
+            retry_after = exc.retry_after
+            if isinstance(retry_after, dt.timedelta):
+                retry_after = retry_after.total_seconds()
+            await msg.nak(delay=retry_after)
+        else:
+            await nak_or_dead_letter(nats_manager, msg, error, max_deliver=max_deliver)
+    except Exception as nak_exc:
+        # Если не удалось ни nak, ни DLQ — сообщение вернётся после ack_wait.
+        logger.error("Failed to nak/dead-letter message: %s", nak_exc)
+
+
+class PullConsumer:
+    """
+    Забирает сообщения pull-consumer'а пачками и обрабатывает их параллельно,
+    не более `concurrency` одновременно. Пачка запрашивается ровно под свободные
+    слоты, поэтому сообщения не ждут в локальной очереди и не истекают по ack_wait.
+    `handler` сам делает ack/nak каждого сообщения.
+    """
+
+    def __init__(self, psub, handler, *, concurrency: int, batch: int,
+                 fetch_timeout: float = 5.0, name: str = "") -> None:
+        self.psub = psub
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.batch = max(1, min(batch, concurrency))
+        self.fetch_timeout = fetch_timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    async def _process(self, msg: Msg) -> None:
+        try:
+            await self.handler(msg)
+        finally:
+            self._slots.release()
+
+    async def _acquire_slots(self) -> int:
+        await self._slots.acquire()
+        slots = 1
+        while slots < self.batch and not self._slots.locked():
+            await self._slots.acquire()
+            slots += 1
+        return slots
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            slots = await self._acquire_slots()
+            try:
+                msgs = await self.psub.fetch(slots, timeout=self.fetch_timeout)
+            except NatsTimeoutError:
+                msgs = []
+            except Exception as exc:
+                logger.error("Fetch from %s failed: %s", self.name, exc)
+                msgs = []
+                await asyncio.sleep(1)
+
+            for _ in range(slots - len(msgs)):
+                self._slots.release()
+            for msg in msgs:
+                task = asyncio.create_task(self._process(msg))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def drain(self, timeout: float) -> None:
+        """Перестаёт забирать новые сообщения и ждёт обработки уже полученных."""
+        self._stopping.set()
+        if self._tasks:
+            logger.info("Waiting for %s in-flight messages", len(self._tasks))
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                # Не подтверждённые сообщения NATS передоставит после ack_wait.
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+
+async def _record_latency(session, event, stamps: dict[str, float]) -> None:
+    """Метрики и строка payment_latency; ошибка записи не должна передоставлять событие."""
+    for stage, seconds in latency.stage_durations(stamps).items():
+        PAYMENT_STAGE_SECONDS.observe(seconds, stage=stage)
+    total = latency.total_seconds(stamps)
+    if total is not None:
+        PAYMENT_TO_ACCESS_SECONDS.observe(total, provider=event.provider)
+
+    values = {
+        "payment_id": event.payment_id,
+        "provider": event.provider,
+        "total_ms": round(total * 1000) if total is not None else None,
+    }
+    for stage, at in stamps.items():
+        values[f"{stage}_at"] = dt.datetime.fromtimestamp(at, dt.timezone.utc)
+    query = insert(PaymentLatency).values(**values)
+    query = query.on_conflict_do_update(
+        index_elements=[PaymentLatency.payment_id],
+        set_={key: query.excluded[key] for key in values if key != "payment_id"},
     )
     try:
-        await js.add_stream(config=stream_config)
-    except nats.js.errors.APIError as exc:
-        if "stream name already in use" not in str(exc):
-            raise
+        await session.execute(query)
+        await session.commit()
+    except Exception as exc:
+        await session.rollback()
+        logger.warning("Failed to save payment latency (payment_id=%s): %s", event.payment_id, exc)
 
 
-async def handle_event(msg: Msg):
+async def handle_payment_succeeded(msg: Msg) -> None:
+    stamps = latency.stamp(latency.from_headers(msg.headers), "event_consumed")
     try:
-        data = json.loads(msg.data.decode())
-        logger.info("Получено событие: subject=%s payload=%s", msg.subject, data)
+        event = decode_event(msg.subject, msg.data, msg.headers)
+        logger.info("Получено событие: subject=%s %s", msg.subject, describe_event(event))
 
-        if msg.subject == "campaign.send":
-            await msg.ack()  # Подтверждаем получение сообщения
-            async with broker_context():
-                await simple_task.kiq()
-            return
+        if not TOKEN:
+            raise RuntimeError("TOKEN is not set, cannot notify user about payment")
+        if not CHANNEL_ID:
+            raise RuntimeError("CHANNEL_ID is not set, cannot grant subscription")
 
-        if msg.subject == "payment.succeeded":
-            event = PaymentSucceededEvent.model_validate(data)
+        # Инвайт — до транзакции; claim + подписка + доступ — одним запросом и одним commit'ом
+        # (SubscriptionService.grant_payment). Повтор уже обработанного платежа стоит
+        # лишнего инвайта, который сразу отзывается, — это редкий случай.
+        bot = get_bot()
+        async with SqlAlchemyUoW() as uow:
+            ss = SubscriptionService(uow)
+            invite_link, expire_at = await ss.create_payment_invite(bot, channel_id=CHANNEL_ID)
+            latency.stamp(stamps, "invite_created")
 
-            if not TOKEN:
-                logger.error("TOKEN is not set, cannot notify user about payment")
-                await msg.nak()
-                return
-            if not CHANNEL_ID:
-                logger.error("CHANNEL_ID is not set, cannot grant subscription")
-                await msg.nak()
+            grant = await ss.grant_payment(
+                bot,
+                payment_id=event.payment_id,
+                user_id=event.user_id,
+                invite_link=invite_link,
+                invite_expire_at=expire_at,
+                channel_id=CHANNEL_ID,
+                start_at=event.paid_at,
+            )
+            if grant is None:
+                # Уже обработано ранее.
+                await msg.ack()
                 return
+            latency.stamp(stamps, "subscription_granted")
 
-            async with SqlAlchemyUoW() as uow:
-                now = dt.datetime.now(dt.timezone.utc)
-                res = await uow.session.execute(
-                    update(Payment)
-                    .where(Payment.id == event.payment_id)
-                    .where(Payment.processed_at.is_(None))
-                    .values(processed_at=now)
-                )
-                if res.rowcount == 0:
-                    # Уже обработано ранее.
-                    await uow.commit()
-                    await msg.ack()
-                    return
-
-                ss = SubscriptionService(uow)
-                await ss.grant_30d(
-                    user_id=event.user_id,
-                    channel_id=CHANNEL_ID,
-                    start_at=event.paid_at,
-                )
-                # Коммит нужен, чтобы подписка была консистентна для дальнейших действий.
-                await uow.commit()
+            end_at_str = grant.end_at.astimezone(dt.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+            text = (
+                "Оплата успешна.\n"
+                f"Подписка активирована до: {end_at_str}\n\n"
+                f"Инвайт-ссылка (действует до {expire_at.strftime('%Y-%m-%d %H:%M UTC')}):\n"
+                f"{invite_link}"
+            )
+            try:
+                await bot.send_message(chat_id=event.user_id, text=text)
+            except PERMANENT_ERRORS:
+                # Пользователь заблокировал бота — оплаченная подписка остаётся, событие уйдёт в DLQ.
+                raise
+            except Exception:
+                # Временная ошибка: откатываем выдачу, чтобы повтор события отправил ссылку заново.
+                try:
+                    await ss.undo_payment_grant(
+                        bot, event.payment_id, grant, invite_link, channel_id=CHANNEL_ID
+                    )
+                except Exception as undo_exc:
+                    logger.error(
+                        "Failed to undo grant for payment_id=%s: %s", event.payment_id, undo_exc
+                    )
+                raise
+            latency.stamp(stamps, "message_sent")
+            await _record_latency(uow.session, event, stamps)
 
-                bot = Bot(token=TOKEN)
-                invite_link, expire_at, _ = await ss.create_invite_link(
-                    bot=bot,
-                    user_id=event.user_id,
-                    channel_id=CHANNEL_ID,
-                )
-                await uow.commit()
+        await msg.ack()
 
-                sub = await ss.get_active(user_id=event.user_id, channel_id=CHANNEL_ID)
-                end_at_str = "—"
-                if sub:
-                    end_at_str = sub.end_at.astimezone(dt.timezone.utc).strftime(
-                        "%Y-%m-%d %H:%M UTC"
-                    )
+    except Exception as e:
+        logger.error(f"Ошибка при обработке сообщения: {e}")
+        await _handle_failure(msg, e, PAYMENTS_DURABLE)
 
-                text = (
-                    "Оплата успешна.\n"
-                    f"Подписка активирована до: {end_at_str}\n\n"
-                    f"Инвайт-ссылка (действует до {expire_at.strftime('%Y-%m-%d %H:%M UTC')}):\n"
-                    f"{invite_link}"
-                )
-                await bot.send_message(chat_id=event.user_id, text=text)
 
+async def handle_event(msg: Msg):
+    try:
+        if msg.subject == "campaign.send":
+            event = decode_event(msg.subject, msg.data, msg.headers)
+            logger.info("Получено событие: subject=%s %s", msg.subject, describe_event(event))
+            # Шарды сохраняются до постановки задач: задача берёт шард из БД,
+            # а повтор события не создаёт шарды заново.
+            async with SqlAlchemyUoW() as uow:
+                service = CampaignService(uow)
+                if event.action == "resume":
+                    shard_ids = await service.resume(event.campaign_id)
+                elif event.action == "retry":
+                    shard_ids = await service.retry(event.campaign_id)
+                else:
+                    shard_ids = await service.plan(event.campaign_id, event.user_ids)
+                await uow.commit()
+            # Брокер уже запущен вместе с listener'ом — только публикуем задачи по шардам.
+            kicked = await kick_many(send_campaign_shard, [(shard_id,) for shard_id in shard_ids])
             await msg.ack()
+            logger.info(
+                "Campaign %s (%s): %s shard tasks queued", event.campaign_id, event.action, kicked
+            )
             return
 
         # Неизвестные события не должны ломать consumer.
+        logger.info("Получено событие: subject=%s", msg.subject)
         await msg.ack()
 
-    except ValidationError as e:
-        logger.error(f"Ошибка валидации события: {e}")
-        await msg.ack()
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
-        await msg.nak()
+        await _handle_failure(msg, e, CAMPAIGNS_DURABLE)
 
 
 async def nats_listener():
+    consumers: list[PullConsumer] = []
+    broker_started = False
     try:
-        nc = await nats.connect("nats://nats:4222")
-        js = nc.jetstream()
+        metrics_port = int(os.getenv("METRICS_PORT") or "9100")
+        if metrics_port:
+            try:
+                metrics.start_metrics_server(metrics_port)
+            except OSError as exc:
+                logger.warning("Metrics server is not started on port %s: %s", metrics_port, exc)
+        # Топологией (стримы, consumer'ы, KV из common.nats_client) владеет только listener.
+        # NATS может подняться позже бота — ждём подключения без ограничения.
+        await nats_manager.connect(ensure_topology=True, timeout=None)
+        await watch_max_deliveries(nats_manager)
+        # Брокер taskiq запускается один раз на процесс, а не на каждое событие.
+        await broker.startup()
+        broker_started = True
 
-        # Создаем стримы, если они еще не существуют
-        await _ensure_stream(
-            js, name="campaigns", subjects=["campaign.send"], max_msgs=10000
-        )
-        await _ensure_stream(
-            js, name="payments", subjects=["payment.succeeded"], max_msgs=100000
-        )
-
-        # Подписываемся на сообщения
-        await js.subscribe(
-            "campaign.send",
-            durable="campaign_processor",
-            cb=handle_event,
-            manual_ack=True
+        # Партиции payment.succeeded.<n> (и legacy payment.succeeded) обрабатываются параллельно,
+        # сообщения внутри партиции — по одному: у consumer'а max_ack_pending=1, так что
+        # порядок сохраняется и при нескольких процессах бота на одном durable.
+        payment_durables = [spec.durable for spec in CONSUMERS if spec.stream == "payments"]
+        for durable in payment_durables:
+            consumers.append(
+                PullConsumer(
+                    await nats_manager.pull_subscription(durable),
+                    handle_payment_succeeded,
+                    concurrency=1,
+                    batch=1,
+                    name=durable,
+                )
+            )
+        consumers.append(
+            PullConsumer(
+                await nats_manager.pull_subscription(CAMPAIGNS_DURABLE),
+                handle_event,
+                concurrency=1,
+                batch=1,
+                name=CAMPAIGNS_DURABLE,
+            )
         )
-        await js.subscribe(
-            "payment.succeeded",
-            durable="payment_processor",
-            cb=handle_event,
-            manual_ack=True,
+        # Хвосты стримов, consumer'ов и очереди taskiq — в метриках и алертах (NATS_ALERT_*).
+        health = StreamHealth(
+            nats_manager,
+            streams=[spec.name for spec in STREAMS] + [broker.stream_name],
+            consumers=[WatchedConsumer(spec.stream, spec.durable) for spec in CONSUMERS]
+            + [WatchedConsumer(broker.stream_name, broker.durable)],
         )
+        logger.info("Payments consumer started: partitions=%s", PAYMENT_PARTITIONS)
+        await asyncio.gather(health.run(), *(consumer.run() for consumer in consumers))
 
-        # Держим соединение открытым
-        while True:
-            await asyncio.sleep(1)
-
+    except asyncio.CancelledError:
+        logger.info("NATS listener is shutting down")
+        drain_timeout = max(spec.ack_wait for spec in CONSUMERS)
+        await asyncio.gather(*(consumer.drain(timeout=drain_timeout) for consumer in consumers))
+        raise
     except Exception as e:
         logger.error(f"Ошибка в NATS listener: {e}")
         raise
+    finally:
+        if broker_started:
+            await broker.shutdown()
+        await nats_manager.close()
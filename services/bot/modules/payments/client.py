@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+import httpx
+from nats.errors import ConnectionClosedError, NoRespondersError, NoServersError
+from nats.errors import TimeoutError as NatsTimeoutError
+
+from common.nats_client import nats_manager
+from exceptions import PaymentsUnavailableError
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    После `failure_threshold` подряд неудачных вызовов перестаёт пускать запросы
+    на `reset_timeout` секунд, затем пропускает один пробный вызов (half-open):
+    allow() вернёт True только одному вызывающему, пока проба не завершится
+    (record_success/record_failure) или не истечёт ещё `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        # когда пропущен пробный вызов; пропавшая проба не держит цепь вечно
+        self.probe_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        if self.opened_at is None:
+            return False
+        return time.monotonic() - self.opened_at < self.reset_timeout
+
+    @property
+    def is_half_open(self) -> bool:
+        return self.opened_at is not None and not self.is_open
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.is_open:
+            return False
+        now = time.monotonic()
+        if self.probe_at is not None and now - self.probe_at < self.reset_timeout:
+            return False
+        self.probe_at = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probe_at = None
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None or not self.is_open:
+                logger.warning("Payments circuit breaker opened after %s failures", self.failures)
+            self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Скользящее окно задержек «нажатие → ссылка показана», пишет перцентили в лог."""
+
+    def __init__(self, name: str, window: int = 200, report_every: int = 50) -> None:
+        self.name = name
+        self.samples: deque[float] = deque(maxlen=window)
+        self.report_every = report_every
+        self.count = 0
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        if self.count % self.report_every == 0:
+            logger.info(
+                "%s latency over last %s: p50=%.0fms p95=%.0fms max=%.0fms",
+                self.name,
+                len(self.samples),
+                self.percentile(0.5) * 1000,
+                self.percentile(0.95) * 1000,
+                max(self.samples) * 1000,
+            )
+
+
+class PaymentsClient:
+    """
+    Создание платежей в web: сначала NATS request–reply (`rpc.payments.<provider>.create`),
+    при отсутствии ответчиков или ошибке соединения — HTTP через общий пул httpx.
+    Весь вызов укладывается в PAYMENTS_RPC_TIMEOUT секунд, а circuit breaker не даёт
+    колбэкам бота висеть на недоступном web.
+    """
+
+    def __init__(self) -> None:
+        self.web_base_url = (os.getenv("WEB_BASE_URL") or "http://web:5000").rstrip("/")
+        self.timeout = float(os.getenv("PAYMENTS_RPC_TIMEOUT") or "5")
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("PAYMENTS_RPC_FAILURE_THRESHOLD") or "5"),
+            reset_timeout=float(os.getenv("PAYMENTS_RPC_RESET_TIMEOUT") or "30"),
+        )
+        self._http: httpx.AsyncClient | None = None
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.web_base_url,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._http
+
+    async def _via_nats(self, provider: str, user_id: int, token: str,
+                        timeout: float) -> tuple[int, dict]:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        # Первое подключение — не дольше половины бюджета: при недоступном NATS
+        # (NoServersError) должно остаться время на HTTP.
+        nc = await nats_manager.connect(timeout=timeout / 2)
+        msg = await nc.request(
+            f"rpc.payments.{provider}.create",
+            json.dumps({"user_id": user_id}).encode("utf-8"),
+            timeout=max(0.001, timeout - (loop.time() - started)),
+            headers={"X-Internal-Token": token},
+        )
+        data = json.loads(msg.data.decode())
+        return int(data["status"]), data.get("body") or {}
+
+    async def _via_http(self, provider: str, user_id: int, token: str,
+                        timeout: float) -> tuple[int, dict]:
+        resp = await self._get_http().post(
+            f"/payments/{provider}/create",
+            json={"user_id": user_id},
+            headers={"X-Internal-Token": token},
+            timeout=timeout,
+        )
+        return resp.status_code, resp.json()
+
+    async def _create_via_nats(self, provider: str, user_id: int, token: str,
+                               deadline: float) -> tuple[int, dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await self._via_nats(provider, user_id, token, self.timeout)
+        except (NoRespondersError, NoServersError, ConnectionClosedError, OSError) as exc:
+            # RPC-сервер не запущен или NATS недоступен — идём в web по HTTP
+            # в рамках оставшегося бюджета времени.
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise
+            logger.info("Payments RPC unavailable (%s), falling back to HTTP", exc)
+            return await self._via_http(provider, user_id, token, remaining)
+
+    async def create(self, provider: str, user_id: int, token: str) -> tuple[int, dict]:
+        """Возвращает (status_code, body) как у HTTP-эндпойнта web."""
+        use_nats = self.breaker.allow()
+        if not use_nats and not self.breaker.is_half_open:
+            raise PaymentsUnavailableError("circuit_open")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            if not use_nats:
+                # half-open: пробный вызов через NATS уже идёт — остальные сразу в web по HTTP
+                status, body = await self._via_http(provider, user_id, token, self.timeout)
+            else:
+                status, body = await self._create_via_nats(provider, user_id, token, deadline)
+        except (NatsTimeoutError, asyncio.TimeoutError, httpx.HTTPError, OSError,
+                NoRespondersError, NoServersError, ConnectionClosedError, ValueError) as exc:
+            self.breaker.record_failure()
+            raise PaymentsUnavailableError(str(exc) or exc.__class__.__name__) from exc
+
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return status, body
+
+
+payments_client = PaymentsClient()
+tap_to_link_latency = LatencyStats("tap -> payment link")
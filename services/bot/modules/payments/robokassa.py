@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import logging
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Any, Iterable
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+
+OPSTATE_URL = "https://auth.robokassa.ru/Merchant/WebService/Service.asmx/OpStateExt"
+
+# Коды Result.Code из ответа OpStateExt
+RESULT_OK = 0
+RESULT_INVOICE_NOT_FOUND = 3
+
+# Коды State.Code (https://docs.robokassa.ru/xml-interfaces/)
+STATE_INITIATED = 5      # операция создана, оплата не поступала
+STATE_CANCELED = 10      # операция отменена, деньги не получены
+STATE_PROCESSING = 50    # деньги получены, зачисляются магазину
+STATE_REFUNDED = 60      # деньги возвращены покупателю
+STATE_SUSPENDED = 80     # исполнение приостановлено (проверка)
+STATE_PAID = 100         # платёж проведён успешно
+
+# Состояния, в которых оплата ещё может завершиться успехом — такие не отменяем по TTL.
+IN_PROGRESS_STATES = {STATE_PROCESSING, STATE_SUSPENDED}
+# Состояния, в которых деньги точно не поступали — такие счета можно отменять по TTL.
+UNPAID_STATES = {STATE_INITIATED, STATE_CANCELED}
+
+
+def _hash_hexdigest(payload: str) -> str:
+    algo = (os.getenv("ROBO_SIGNATURE_ALGO") or "md5").strip().lower()
+    data = payload.encode("utf-8")
+    if algo == "md5":
+        return hashlib.md5(data).hexdigest()  # noqa: S324
+    if algo in {"sha256", "sha-256"}:
+        return hashlib.sha256(data).hexdigest()
+    raise ValueError(f"unsupported_signature_algo:{algo}")
+
+
+def opstate_signature(merchant_login: str, inv_id: int, password2: str) -> str:
+    # Для OpStateExt подпись: MerchantLogin:InvoiceID:Password#2
+    return _hash_hexdigest(f"{merchant_login}:{inv_id}:{password2}")
+
+
+@dataclass
+class OpState:
+    inv_id: int
+    result_code: int
+    state_code: int | None = None
+    out_sum: Decimal | None = None
+    user_fields: dict[str, str] = field(default_factory=dict)
+    raw: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def is_paid(self) -> bool:
+        return self.result_code == RESULT_OK and self.state_code == STATE_PAID
+
+    @property
+    def is_not_found(self) -> bool:
+        return self.result_code == RESULT_INVOICE_NOT_FOUND
+
+    @property
+    def is_in_progress(self) -> bool:
+        return self.result_code == RESULT_OK and self.state_code in IN_PROGRESS_STATES
+
+    @property
+    def is_unpaid(self) -> bool:
+        """Счёт не оплачен: Robokassa его не знает или деньги по нему не поступали."""
+        return self.is_not_found or (
+            self.result_code == RESULT_OK and self.state_code in UNPAID_STATES
+        )
+
+
+def _local(tag: str) -> str:
+    # Ответ приходит с namespace http://merchant.roboxchange.com/WebService/
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(node: ET.Element | None, *path: str) -> ET.Element | None:
+    for name in path:
+        if node is None:
+            return None
+        node = next((child for child in node if _local(child.tag) == name), None)
+    return node
+
+
+def _text(node: ET.Element | None, *path: str) -> str | None:
+    found = _find(node, *path)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip()
+
+
+def _int(value: str | None) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_opstate(inv_id: int, body: str) -> OpState:
+    root = ET.fromstring(body)
+
+    result_code = _int(_text(root, "Result", "Code"))
+    state_code = _int(_text(root, "State", "Code"))
+
+    out_sum: Decimal | None = None
+    raw_out_sum = _text(root, "Info", "OutSum")
+    if raw_out_sum:
+        try:
+            out_sum = Decimal(raw_out_sum)
+        except InvalidOperation:
+            out_sum = None
+
+    user_fields: dict[str, str] = {}
+    user_field = _find(root, "UserField")
+    if user_field is not None:
+        for item in user_field:
+            name = _text(item, "Name")
+            if name:
+                user_fields[name] = _text(item, "Value") or ""
+
+    raw = {
+        "result_code": result_code,
+        "result_description": _text(root, "Result", "Description"),
+        "state_code": state_code,
+        "state_date": _text(root, "State", "StateDate"),
+        "out_sum": raw_out_sum,
+        "inc_curr_label": _text(root, "Info", "IncCurrLabel"),
+        "user_fields": user_fields,
+    }
+    return OpState(
+        inv_id=inv_id,
+        result_code=result_code if result_code is not None else -1,
+        state_code=state_code,
+        out_sum=out_sum,
+        user_fields=user_fields,
+        raw=raw,
+    )
+
+
+class RobokassaOpStateClient:
+    """
+    Клиент интерфейса OpStateExt. Адрес можно переопределить через ROBO_OPSTATE_URL,
+    чтобы гонять reconcile против локальной заглушки.
+    """
+
+    def __init__(
+        self,
+        merchant_login: str,
+        password2: str,
+        url: str | None = None,
+        concurrency: int = 5,
+        timeout: float = 10.0,
+    ) -> None:
+        self.merchant_login = merchant_login
+        self.password2 = password2
+        self.url = url or (os.getenv("ROBO_OPSTATE_URL") or OPSTATE_URL)
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+
+    async def _get_one(
+        self, client: httpx.AsyncClient, sem: asyncio.Semaphore, inv_id: int
+    ) -> OpState | None:
+        params = {
+            "MerchantLogin": self.merchant_login,
+            "InvoiceID": str(inv_id),
+            "Signature": opstate_signature(self.merchant_login, inv_id, self.password2),
+        }
+        async with sem:
+            try:
+                resp = await client.get(self.url, params=params)
+                resp.raise_for_status()
+                return parse_opstate(inv_id, resp.text)
+            except (httpx.HTTPError, ET.ParseError) as exc:
+                logger.warning("Robokassa OpState failed for inv_id=%s: %s", inv_id, exc)
+                return None
+
+    async def get_states(self, inv_ids: Iterable[int]) -> dict[int, OpState]:
+        """Опрашивает состояние счетов, не более `concurrency` запросов одновременно."""
+        sem = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            states = await asyncio.gather(
+                *(self._get_one(client, sem, inv_id) for inv_id in inv_ids)
+            )
+        return {state.inv_id: state for state in states if state is not None}
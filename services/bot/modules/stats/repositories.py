@@ -0,0 +1,254 @@
+import datetime as dt
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, delete, distinct, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from core.database.base_repo import BaseRepository
+from common.models.payments_models import Payment
+from common.models.stats_models import (
+    DailyPaymentStats,
+    DailySubscriptionStats,
+    DailyUserStats,
+    StatsWatermark,
+)
+from common.models.subscriptions_models import Subscription
+from common.models.users_models import User
+
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def _utc_day(column):
+    return func.date(func.timezone("UTC", column))
+
+
+def _day_bounds(day: dt.date) -> tuple[dt.datetime, dt.datetime]:
+    start = dt.datetime.combine(day, dt.time.min, tzinfo=dt.timezone.utc)
+    return start, start + dt.timedelta(days=1)
+
+
+class StatsRepository(BaseRepository):
+    """
+    Роллапы статистики. Пересчёт инкрементальный: по watermark находим строки,
+    изменённые с прошлого запуска, и пересчитываем только затронутые ими дни
+    (пересчёт дня идемпотентен, поэтому окно перекрытия не даёт двойного счёта).
+    Чтение — только из дневных таблиц за ограниченное окно дней.
+    """
+    model = StatsWatermark
+
+    async def get_watermark(self, name: str) -> Optional[StatsWatermark]:
+        return await self.session.get(StatsWatermark, name)
+
+    async def set_watermark(self, name: str, value: dt.datetime) -> None:
+        stmt = pg_insert(StatsWatermark).values(name=name, value=value)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StatsWatermark.name],
+            set_={"value": stmt.excluded.value, "refreshed_at": func.now()},
+        )
+        await self.session.execute(stmt)
+
+    async def _days(self, query) -> set[dt.date]:
+        result = await self.session.execute(query)
+        return {day for day in result.scalars().all() if day is not None}
+
+    # --- поиск затронутых дней ---
+
+    async def changed_payment_days(self, since: dt.datetime) -> tuple[set[dt.date], set[dt.date]]:
+        """(дни по created_at, дни по paid_at) для платежей, изменённых после since."""
+        created = await self._days(
+            select(_utc_day(Payment.created_at).label("day")).distinct().where(Payment.updated_at > since)
+        )
+        paid = await self._days(
+            select(_utc_day(Payment.paid_at).label("day")).distinct().where(
+                Payment.updated_at > since, Payment.paid_at.is_not(None)
+            )
+        )
+        return created, paid
+
+    async def changed_subscription_days(self, since: dt.datetime) -> set[dt.date]:
+        days: set[dt.date] = set()
+        for column in (Subscription.created_at, Subscription.end_at, Subscription.revoked_at):
+            days |= await self._days(
+                select(_utc_day(column).label("day")).distinct().where(Subscription.updated_at > since)
+            )
+        return days
+
+    async def changed_user_days(self, since: dt.datetime) -> set[dt.date]:
+        return await self._days(
+            select(_utc_day(User.created_at).label("day")).distinct().where(User.created_at > since)
+        )
+
+    # --- пересчёт дня ---
+
+    async def rebuild_payment_day(self, day: dt.date) -> None:
+        start, end = _day_bounds(day)
+        await self.session.execute(delete(DailyPaymentStats).where(DailyPaymentStats.day == day))
+        source = (
+            select(
+                literal(day),
+                Payment.provider,
+                Payment.currency,
+                Payment.status,
+                func.count(Payment.id),
+                func.coalesce(func.sum(Payment.amount), 0),
+            )
+            .where(Payment.created_at >= start, Payment.created_at < end)
+            .group_by(Payment.provider, Payment.currency, Payment.status)
+        )
+        await self.session.execute(
+            pg_insert(DailyPaymentStats).from_select(
+                ["day", "provider", "currency", "status", "count", "amount"], source
+            )
+        )
+
+    async def rebuild_subscription_day(self, day: dt.date) -> None:
+        start, end = _day_bounds(day)
+        rows: dict[int, dict[str, int]] = {}
+
+        def add(result, field: str) -> None:
+            for channel_id, cnt in result.all():
+                rows.setdefault(channel_id, {})[field] = cnt
+
+        add(await self.session.execute(
+            select(Subscription.channel_id, func.count(Subscription.id))
+            .where(Subscription.created_at >= start, Subscription.created_at < end)
+            .group_by(Subscription.channel_id)
+        ), "new")
+        add(await self.session.execute(
+            select(Subscription.channel_id, func.count(Subscription.id))
+            .where(
+                Subscription.status == "expired",
+                Subscription.end_at >= start,
+                Subscription.end_at < end,
+            )
+            .group_by(Subscription.channel_id)
+        ), "expired")
+        add(await self.session.execute(
+            select(Subscription.channel_id, func.count(Subscription.id))
+            .where(
+                Subscription.status == "revoked",
+                Subscription.revoked_at >= start,
+                Subscription.revoked_at < end,
+            )
+            .group_by(Subscription.channel_id)
+        ), "revoked")
+        # Продление: успешная оплата пользователя, у которого подписка уже была до оплаты.
+        add(await self.session.execute(
+            select(Subscription.channel_id, func.count(distinct(Payment.id)))
+            .join(
+                Subscription,
+                and_(
+                    Subscription.user_id == Payment.user_id,
+                    Subscription.created_at < Payment.paid_at,
+                ),
+            )
+            .where(
+                Payment.status == "success",
+                Payment.paid_at >= start,
+                Payment.paid_at < end,
+            )
+            .group_by(Subscription.channel_id)
+        ), "renewed")
+
+        await self.session.execute(
+            delete(DailySubscriptionStats).where(DailySubscriptionStats.day == day)
+        )
+        if rows:
+            await self.session.execute(
+                pg_insert(DailySubscriptionStats),
+                [
+                    {"day": day, "channel_id": channel_id,
+                     "new": 0, "renewed": 0, "expired": 0, "revoked": 0, **counts}
+                    for channel_id, counts in rows.items()
+                ],
+            )
+
+    async def rebuild_user_day(self, day: dt.date) -> None:
+        start, end = _day_bounds(day)
+        await self.session.execute(delete(DailyUserStats).where(DailyUserStats.day == day))
+        source_col = func.coalesce(User.source, "")
+        source = (
+            select(literal(day), source_col, func.count(User.user_id))
+            .where(User.created_at >= start, User.created_at < end)
+            .group_by(source_col)
+        )
+        await self.session.execute(
+            pg_insert(DailyUserStats).from_select(["day", "source", "new"], source)
+        )
+
+    # --- чтение ---
+
+    async def payments_summary(self, since_day: dt.date) -> list[tuple[str, str, str, int, object]]:
+        query = (
+            select(
+                DailyPaymentStats.provider,
+                DailyPaymentStats.currency,
+                DailyPaymentStats.status,
+                func.sum(DailyPaymentStats.count),
+                func.sum(DailyPaymentStats.amount),
+            )
+            .where(DailyPaymentStats.day >= since_day)
+            .group_by(DailyPaymentStats.provider, DailyPaymentStats.currency, DailyPaymentStats.status)
+            .order_by(DailyPaymentStats.provider, DailyPaymentStats.currency, DailyPaymentStats.status)
+        )
+        result = await self.session.execute(query)
+        return list(result.all())
+
+    async def subscriptions_summary(self, channel_id: int, since_day: dt.date) -> dict[str, int]:
+        query = select(
+            func.coalesce(func.sum(DailySubscriptionStats.new), 0),
+            func.coalesce(func.sum(DailySubscriptionStats.renewed), 0),
+            func.coalesce(func.sum(DailySubscriptionStats.expired), 0),
+            func.coalesce(func.sum(DailySubscriptionStats.revoked), 0),
+        ).where(
+            DailySubscriptionStats.channel_id == channel_id,
+            DailySubscriptionStats.day >= since_day,
+        )
+        new, renewed, expired, revoked = (await self.session.execute(query)).one()
+        return {"new": new, "renewed": renewed, "expired": expired, "revoked": revoked}
+
+    async def users_by_source(self, since_day: dt.date, limit: int = 10) -> list[tuple[str, int]]:
+        total = func.sum(DailyUserStats.new)
+        query = (
+            select(DailyUserStats.source, total)
+            .where(DailyUserStats.day >= since_day)
+            .group_by(DailyUserStats.source)
+            .order_by(total.desc())
+            .limit(limit)
+        )
+        result = await self.session.execute(query)
+        return list(result.all())
+
+
+async def refresh_rollups(repo: StatsRepository, now: dt.datetime,
+                          lag: dt.timedelta) -> dict[str, int]:
+    """
+    Пересчитывает дни, затронутые изменениями после watermark'ов, и сдвигает watermark'и.
+    lag — перекрытие на транзакции, закоммиченные позже своего updated_at/created_at.
+    Возвращает количество пересчитанных дней по каждому роллапу.
+    """
+    async def since(name: str) -> dt.datetime:
+        wm = await repo.get_watermark(name)
+        return (wm.value - lag) if wm else EPOCH
+
+    payment_days, paid_days = await repo.changed_payment_days(await since("payments"))
+    subscription_days = await repo.changed_subscription_days(await since("subscriptions"))
+    # Смена статуса платежа влияет на «продления» в роллапе подписок.
+    subscription_days |= paid_days
+    user_days = await repo.changed_user_days(await since("users"))
+
+    async def rebuild(days: Iterable[dt.date], fn) -> int:
+        days = sorted(days)
+        for day in days:
+            await fn(day)
+        return len(days)
+
+    counts = {
+        "payments": await rebuild(payment_days, repo.rebuild_payment_day),
+        "subscriptions": await rebuild(subscription_days, repo.rebuild_subscription_day),
+        "users": await rebuild(user_days, repo.rebuild_user_day),
+    }
+    for name in counts:
+        await repo.set_watermark(name, now)
+    return counts
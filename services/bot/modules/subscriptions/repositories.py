@@ -1,12 +1,36 @@
 import datetime as dt
+from dataclasses import dataclass
 from typing import Optional
 
-from sqlalchemy import desc, func, select
+from sqlalchemy import (
+    DateTime,
+    cast,
+    delete,
+    desc,
+    exists,
+    func,
+    insert,
+    literal,
+    null,
+    select,
+    union_all,
+    update,
+)
 
 from core.database.base_repo import BaseRepository
+from common.models.payments_models import Payment
 from common.models.subscriptions_models import Subscription, SubscriptionAccess
 
 
+@dataclass(frozen=True)
+class PaymentGrant:
+    subscription_id: int
+    end_at: dt.datetime
+    # None — подписка создана этим платежом, иначе end_at до продления.
+    prev_end_at: Optional[dt.datetime]
+    access_id: int
+
+
 class SubscriptionRepository(BaseRepository):
     model = Subscription
 
@@ -57,6 +81,115 @@ class SubscriptionRepository(BaseRepository):
         result = await self.session.execute(query)
         return {status: cnt for status, cnt in result.all()}
 
+    async def grant_for_payment(
+        self,
+        *,
+        payment_id: int,
+        user_id: int,
+        channel_id: int,
+        start_at: dt.datetime,
+        period: dt.timedelta,
+        invite_link: str,
+        invite_expire_at: dt.datetime,
+        member_limit: int,
+        now: dt.datetime,
+    ) -> Optional[PaymentGrant]:
+        """
+        Одним запросом: помечает платёж обработанным (processed_at), продлевает активную
+        подписку или создаёт новую и записывает выданный инвайт в subscription_access.
+        Возвращает None, если платёж уже был обработан (ничего не меняется).
+        """
+        tz_datetime = DateTime(timezone=True)
+        claimed = (
+            update(Payment)
+            .where(Payment.id == payment_id, Payment.processed_at.is_(None))
+            .values(processed_at=now)
+            .returning(Payment.id)
+            .cte("claimed")
+        )
+        is_claimed = exists(select(claimed.c.id))
+        prev = (
+            select(self.model.id, self.model.end_at)
+            .where(
+                self.model.user_id == user_id,
+                self.model.channel_id == channel_id,
+                self.model.status == "active",
+            )
+            .order_by(self.model.end_at.desc())
+            .limit(1)
+            .with_for_update()
+            .cte("prev")
+        )
+        # Как grant_30d: от max(end_at, start_at) ещё на период.
+        extended = (
+            update(self.model)
+            .where(self.model.id == prev.c.id, is_claimed)
+            .values(end_at=func.greatest(prev.c.end_at, start_at) + period)
+            .returning(self.model.id, self.model.end_at, prev.c.end_at.label("prev_end_at"))
+            .cte("extended")
+        )
+        inserted = (
+            insert(self.model)
+            .from_select(
+                ["user_id", "channel_id", "start_at", "end_at", "status"],
+                select(
+                    literal(user_id, self.model.user_id.type),
+                    literal(channel_id, self.model.channel_id.type),
+                    literal(start_at, tz_datetime),
+                    literal(start_at + period, tz_datetime),
+                    literal("active"),
+                ).where(is_claimed, ~exists(select(prev.c.id))),
+            )
+            .returning(self.model.id, self.model.end_at, cast(null(), tz_datetime).label("prev_end_at"))
+            .cte("inserted")
+        )
+        granted = union_all(
+            select(extended.c.id, extended.c.end_at, extended.c.prev_end_at),
+            select(inserted.c.id, inserted.c.end_at, inserted.c.prev_end_at),
+        ).cte("granted")
+        access = (
+            insert(SubscriptionAccess)
+            .from_select(
+                ["subscription_id", "invite_link", "expire_at", "member_limit"],
+                select(
+                    granted.c.id,
+                    literal(invite_link),
+                    literal(invite_expire_at, tz_datetime),
+                    literal(member_limit),
+                ),
+            )
+            .returning(SubscriptionAccess.id, SubscriptionAccess.subscription_id)
+            .cte("access")
+        )
+        query = select(
+            granted.c.id, granted.c.end_at, granted.c.prev_end_at, access.c.id
+        ).join_from(granted, access, access.c.subscription_id == granted.c.id)
+        row = (await self.session.execute(query)).first()
+        if row is None:
+            return None
+        return PaymentGrant(
+            subscription_id=row[0], end_at=row[1], prev_end_at=row[2], access_id=row[3]
+        )
+
+    async def undo_payment_grant(self, payment_id: int, grant: PaymentGrant) -> None:
+        """Компенсация grant_for_payment, если пользователю не удалось отправить инвайт."""
+        await self.session.execute(
+            delete(SubscriptionAccess).where(SubscriptionAccess.id == grant.access_id)
+        )
+        if grant.prev_end_at is None:
+            await self.session.execute(
+                delete(self.model).where(self.model.id == grant.subscription_id)
+            )
+        else:
+            await self.session.execute(
+                update(self.model)
+                .where(self.model.id == grant.subscription_id)
+                .values(end_at=grant.prev_end_at)
+            )
+        await self.session.execute(
+            update(Payment).where(Payment.id == payment_id).values(processed_at=None)
+        )
+
 
 class SubscriptionAccessRepository(BaseRepository):
     model = SubscriptionAccess
@@ -1,9 +1,14 @@
 import datetime as dt
+import logging
 
 from telegram.error import TelegramError
 
 from core.constants.config import CHANNEL_ID, INVITE_TTL_SECONDS, SUBSCRIPTION_DAYS
 from core.database.uow import UoW
+from modules.subscriptions.repositories import PaymentGrant
+
+
+logger = logging.getLogger(__name__)
 
 
 class SubscriptionService:
@@ -134,3 +139,91 @@ class SubscriptionService:
         )
         return invite.invite_link, expire_at, sub.id
 
+
+    async def create_payment_invite(
+        self,
+        bot,
+        channel_id: int | None = None,
+        ttl_seconds: int | None = None,
+        member_limit: int = 1,
+    ) -> tuple[str, dt.datetime]:
+        """
+        Инвайт для оплаченного платежа. Создаётся до транзакции grant_payment,
+        чтобы HTTP-запрос к Telegram не держал транзакцию открытой.
+        Ошибки Telegram пробрасываются как есть (RetryAfter/BadRequest разбирает consumer).
+        """
+        channel_id = channel_id or CHANNEL_ID
+        if not channel_id:
+            raise ValueError("CHANNEL_ID is not set")
+        expire_at = dt.datetime.now(dt.timezone.utc) + dt.timedelta(
+            seconds=ttl_seconds or INVITE_TTL_SECONDS
+        )
+        invite = await bot.create_chat_invite_link(
+            chat_id=channel_id,
+            member_limit=member_limit,
+            expire_date=expire_at,
+        )
+        return invite.invite_link, expire_at
+
+    async def grant_payment(
+        self,
+        bot,
+        payment_id: int,
+        user_id: int,
+        invite_link: str,
+        invite_expire_at: dt.datetime,
+        channel_id: int | None = None,
+        start_at: dt.datetime | None = None,
+        member_limit: int = 1,
+    ) -> PaymentGrant | None:
+        """
+        Claim платежа + подписка + запись доступа одной транзакцией (один запрос и commit).
+        Если платёж уже обработан или транзакция не прошла — инвайт отзывается.
+        """
+        channel_id = channel_id or CHANNEL_ID
+        now = dt.datetime.now(dt.timezone.utc)
+        try:
+            grant = await self.uow.subscription_repo.grant_for_payment(
+                payment_id=payment_id,
+                user_id=user_id,
+                channel_id=channel_id,
+                start_at=start_at or now,
+                period=dt.timedelta(days=SUBSCRIPTION_DAYS),
+                invite_link=invite_link,
+                invite_expire_at=invite_expire_at,
+                member_limit=member_limit,
+                now=now,
+            )
+            await self.uow.commit()
+        except Exception:
+            await self.uow.rollback()
+            await self.revoke_invite(bot, invite_link, channel_id)
+            raise
+
+        if grant is None:
+            await self.revoke_invite(bot, invite_link, channel_id)
+        return grant
+
+    async def undo_payment_grant(
+        self,
+        bot,
+        payment_id: int,
+        grant: PaymentGrant,
+        invite_link: str,
+        channel_id: int | None = None,
+    ) -> None:
+        """
+        Компенсация grant_payment (пользователю не ушло сообщение): платёж снова
+        не обработан, подписка и доступ возвращаются как были, инвайт отзывается.
+        """
+        channel_id = channel_id or CHANNEL_ID
+        await self.uow.subscription_repo.undo_payment_grant(payment_id, grant)
+        await self.uow.commit()
+        await self.revoke_invite(bot, invite_link, channel_id)
+
+    async def revoke_invite(self, bot, invite_link: str, channel_id: int | None = None) -> None:
+        try:
+            await bot.revoke_chat_invite_link(chat_id=channel_id or CHANNEL_ID, invite_link=invite_link)
+        except TelegramError as exc:
+            # Не критично: инвайт одноразовый и истечёт по TTL.
+            logger.warning("Failed to revoke invite link: %s", exc)
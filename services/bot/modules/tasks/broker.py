@@ -1,26 +1,71 @@
+import asyncio
+import os
 from contextlib import asynccontextmanager
-from nats.js.api import RetentionPolicy, StreamConfig
+from typing import Any, Iterable, Sequence
+from nats.js.api import ConsumerConfig, RetentionPolicy, StreamConfig
+from taskiq import TaskiqEvents, TaskiqState
 from taskiq_nats import PullBasedJetStreamBroker
 from taskiq_nats.result_backend import NATSObjectStoreResultBackend
 
+from common.nats_client import NATS_URL, nats_manager
 
-result_backend = NATSObjectStoreResultBackend(servers="nats://nats:4222")
+
+# Стрим taskiq_queue ведёт сам taskiq-nats; остальные стримы — common.nats_client.
+result_backend = NATSObjectStoreResultBackend(servers=NATS_URL)
 
 stream_config = StreamConfig(
     retention=RetentionPolicy.WORK_QUEUE,
 )
 
+# taskiq подтверждает задачу после выполнения, а шард рассылки под общим лимитом
+# Telegram идёт минутами: с ack_wait по умолчанию (30 с) задача приходила бы повторно.
+consumer_config = ConsumerConfig(
+    durable_name="taskiq_durable",
+    ack_wait=float(os.getenv("TASKIQ_ACK_WAIT_SECONDS") or "3600"),
+)
+
 broker = PullBasedJetStreamBroker(
-    servers="nats://nats:4222",
+    servers=NATS_URL,
     queue="taskiq_queue",
     stream_config=stream_config,
+    consumer_config=consumer_config,
 ).with_result_backend(result_backend=result_backend)
 
 
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def nats_startup(state: TaskiqState) -> None:
+    # Соединение открывается при старте воркера, а не при первой публикации из задачи;
+    # стримы и consumer'ы создаёт NATS listener бота.
+    await nats_manager.connect()
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def nats_shutdown(state: TaskiqState) -> None:
+    await nats_manager.close()
+
+
 @asynccontextmanager
 async def broker_context():
+    """Для разовых скриптов; долгоживущие процессы запускают брокер один раз при старте."""
     await broker.startup()
     try:
         yield
     finally:
         await broker.shutdown()
+
+
+async def kick_many(task, args_list: Iterable[Sequence[Any]], concurrency: int = 20) -> int:
+    """
+    Ставит в очередь `task` для каждого набора аргументов (например, по задаче на шард
+    получателей) по уже запущенному брокеру, не больше `concurrency` публикаций сразу.
+    Возвращает количество поставленных задач.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def kick(args: Sequence[Any]) -> None:
+        async with sem:
+            await task.kiq(*args)
+
+    kicks = [kick(args) for args in args_list]
+    await asyncio.gather(*kicks)
+    return len(kicks)
@@ -1,4 +1,6 @@
 import asyncio
+import gzip
+import json
 import os
 
 from modules.tasks.broker import broker
@@ -6,17 +8,23 @@ import logging
 
 import datetime as dt
 from decimal import Decimal
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import TelegramError
 
 from core.constants.config import CHANNEL_ID, TOKEN
 from core.database.uow import SqlAlchemyUoW
+from core.utils.bot import get_bot
+from common import latency
+from common.broadcast import SharedRateLimiter, is_unreachable
+from common.cryptopay import crypto_pay
 from common.events import PaymentSucceededEvent
-from common.models.payments_models import Payment
+from common.models.payments_models import Payment, PaymentCallback
+from common.nats_client import CAMPAIGNS_KV, nats_manager, payment_subject
+from modules.campaign.services import CampaignService
+from modules.payments.robokassa import RESULT_OK, RobokassaOpStateClient
+from modules.stats.repositories import refresh_rollups
 
-import nats
-from nats.js.api import StreamConfig
-from sqlalchemy import select
+from sqlalchemy import delete, select
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +50,7 @@ async def subscriptions_expire_and_kick() -> None:
     - ищет активные подписки с end_at < now()
     - пытается удалить пользователя из канала
     - помечает подписку expired
+    - уведомляет пользователя, если он не заблокировал бота (users.blocked_at)
     """
     if not TOKEN:
         logger.warning("TOKEN is not set, skipping subscriptions_expire_and_kick")
@@ -50,13 +59,14 @@ async def subscriptions_expire_and_kick() -> None:
         logger.warning("CHANNEL_ID is not set, skipping subscriptions_expire_and_kick")
         return
 
-    bot = Bot(token=TOKEN)
+    bot = get_bot()
     now = dt.datetime.now(dt.timezone.utc)
 
     async with SqlAlchemyUoW() as uow:
         subs = await uow.subscription_repo.get_expired_active(now=now)
         if not subs:
             return
+        blocked = await uow.user_repo.get_blocked_ids({sub.user_id for sub in subs})
 
         for sub in subs:
             chat_id = sub.channel_id or CHANNEL_ID
@@ -75,6 +85,8 @@ async def subscriptions_expire_and_kick() -> None:
                     )
 
             sub.status = "expired"
+            if sub.user_id in blocked:
+                continue
 
             try:
                 keyboard = InlineKeyboardMarkup([
@@ -91,31 +103,46 @@ async def subscriptions_expire_and_kick() -> None:
                     sub.user_id,
                     exc,
                 )
+                if is_unreachable(exc):
+                    await uow.user_repo.mark_blocked([sub.user_id], now=now)
+                    blocked.add(sub.user_id)
 
         await uow.commit()
 
 
-async def _publish_payment_succeeded_events(events: list[PaymentSucceededEvent]) -> None:
-    if not events:
-        return
-    nc = await nats.connect("nats://nats:4222")
-    js = nc.jetstream()
-
-    stream_config = StreamConfig(
-        name="payments",
-        subjects=["payment.succeeded"],
-        retention="workqueue",
-        max_msgs=100000,
-    )
-    try:
-        await js.add_stream(config=stream_config)
-    except nats.js.errors.APIError as exc:
-        if "stream name already in use" not in str(exc):
-            raise
-
+async def _publish_payment_succeeded_events(events: list[PaymentSucceededEvent],
+                                            stamps: dict[str, float]) -> None:
     for event in events:
-        await js.publish("payment.succeeded", event.model_dump_json().encode("utf-8"))
-    await nc.close()
+        event_stamps = latency.stamp(dict(stamps), "event_published")
+        await nats_manager.publish(
+            payment_subject(event.user_id), event, headers=latency.to_headers(event_stamps)
+        )
+
+
+def _add_reconcile_callback(session, p: Payment, payload: dict) -> None:
+    """Сохраняет ответ провайдера в журнал payment_callbacks (вместо payments.raw_callback)."""
+    session.add(PaymentCallback(payment_id=p.id, source="reconcile", payload=payload))
+
+
+def _mark_payment_succeeded(
+    session, p: Payment, now: dt.datetime, raw_callback: dict
+) -> PaymentSucceededEvent:
+    """
+    Переводит платёж в success так же, как это делают ResultURL/webhook в web,
+    и возвращает событие для публикации после коммита.
+    """
+    p.status = "success"
+    p.signature_verified = True  # verified via polling
+    p.paid_at = now
+    _add_reconcile_callback(session, p, raw_callback)
+    return PaymentSucceededEvent(
+        payment_id=p.id,
+        user_id=int(p.user_id),
+        provider=p.provider,
+        amount=str(p.amount),
+        currency=p.currency,
+        paid_at=now,
+    )
 
 
 @broker.task(schedule=[{"cron": "*/2 * * * *"}])
@@ -138,7 +165,7 @@ async def payments_reconcile_cryptobot_pending() -> None:
     cutoff = now - dt.timedelta(seconds=min_age_seconds)
 
     try:
-        from aiosend import CryptoPay
+        import aiosend  # noqa: F401
     except Exception as exc:
         logger.warning("aiosend is not available, skipping reconcile: %s", exc)
         return
@@ -172,12 +199,14 @@ async def payments_reconcile_cryptobot_pending() -> None:
         if not invoice_ids:
             return
 
-        cp = CryptoPay(token=token)
+        cp = crypto_pay(token)
         try:
             invoices = await cp.get_invoices(invoice_ids=invoice_ids)
         except Exception as exc:
             logger.error("Reconcile error: %s", exc)
             return
+        # Для reconcile «callback» — ответ провайдера на опрос.
+        stamps = latency.stamp({}, "callback_received")
 
         events: list[PaymentSucceededEvent] = []
         has_changes = False
@@ -228,26 +257,14 @@ async def payments_reconcile_cryptobot_pending() -> None:
                 if p.status == "success":
                     continue
 
-                p.status = "success"
-                p.signature_verified = True  # verified via polling
-                p.paid_at = now
                 p.provider_invoice_id = p.provider_invoice_id or str(inv.invoice_id)
                 p.provider_payload = p.provider_payload or (inv.payload if inv.payload else None)
-                p.raw_callback = {
-                    "reconcile": True,
-                    "invoice": inv.model_dump(),
-                }
-                has_changes = True
                 events.append(
-                    PaymentSucceededEvent(
-                        payment_id=p.id,
-                        user_id=int(p.user_id),
-                        provider=p.provider,
-                        amount=str(p.amount),
-                        currency=p.currency,
-                        paid_at=now,
+                    _mark_payment_succeeded(
+                        uow.session, p, now, {"reconcile": True, "invoice": inv.model_dump()}
                     )
                 )
+                has_changes = True
 
             # СЦЕНАРИЙ 2: ИНВОЙС ИСТЕК (пользователь не оплатил)
             elif str(inv.status) == "expired":
@@ -257,13 +274,294 @@ async def payments_reconcile_cryptobot_pending() -> None:
                         p.id,
                     )
                     p.status = "canceled"
-                    p.raw_callback = {"reconcile": True, "status": "expired"}
+                    _add_reconcile_callback(uow.session, p, {"reconcile": True, "status": "expired"})
                     has_changes = True
 
         if not has_changes:
             return
 
         await uow.commit()
+        latency.stamp(stamps, "payment_committed")
+
+    # Публикация событий делается после коммита, чтобы consumer видел консистентные данные.
+    await _publish_payment_succeeded_events(events, stamps)
+
+
+@broker.task(schedule=[{"cron": "*/2 * * * *"}])
+async def payments_reconcile_robokassa_pending() -> None:
+    """
+    Фолбэк на случай потери ResultURL callback'а Robokassa:
+    - берёт пачку pending платежей Robokassa старше ROBO_RECONCILE_MIN_AGE_SECONDS
+    - опрашивает их состояние через OpStateExt (не более ROBO_RECONCILE_CONCURRENCY параллельно)
+    - оплаченные переводит в success и публикует payment.succeeded (как robokassa_result)
+    - неоплаченные (счёт не найден или State 5/10) старше ROBO_PENDING_TTL_SECONDS
+      переводит в canceled; при ошибке OpState платёж не трогает
+    - проверяет и отменённые за последние ROBO_RECONCILE_CANCELED_SECONDS: ссылка на оплату
+      у Robokassa остаётся рабочей и после отмены (окно переиспользования счёта в web,
+      TTL), и оплату по ней без ResultURL иначе не восстановить
+    """
+    merchant_login = (os.getenv("ROBO_MERCHANT_LOGIN") or "").strip()
+    password2 = (os.getenv("ROBO_PASSWORD_2") or "").strip()
+    if not merchant_login or not password2:
+        logger.info("Robokassa is not configured, skipping payments_reconcile_robokassa_pending")
+        return
+
+    min_age_seconds = int(os.getenv("ROBO_RECONCILE_MIN_AGE_SECONDS") or "120")
+    limit = int(os.getenv("ROBO_RECONCILE_LIMIT") or "100")
+    concurrency = int(os.getenv("ROBO_RECONCILE_CONCURRENCY") or "5")
+    ttl_seconds = int(os.getenv("ROBO_PENDING_TTL_SECONDS") or "86400")
+    canceled_seconds = int(os.getenv("ROBO_RECONCILE_CANCELED_SECONDS") or str(ttl_seconds))
+    now = dt.datetime.now(dt.timezone.utc)
+    cutoff = now - dt.timedelta(seconds=min_age_seconds)
+    ttl_cutoff = now - dt.timedelta(seconds=ttl_seconds)
+    canceled_cutoff = now - dt.timedelta(seconds=canceled_seconds)
+
+    # Пачку выбираем отдельной короткой сессией: пока идут HTTP-запросы,
+    # транзакция в БД не должна висеть открытой.
+    async with SqlAlchemyUoW() as uow:
+        res = await uow.session.execute(
+            select(Payment.id)
+            .where(
+                Payment.provider == "robokassa",
+                Payment.status == "pending",
+                Payment.created_at < cutoff,
+            )
+            .order_by(Payment.created_at.asc())
+            .limit(limit)
+        )
+        inv_ids = list(res.scalars().all())
+        res = await uow.session.execute(
+            select(Payment.id)
+            .where(
+                Payment.provider == "robokassa",
+                Payment.status == "canceled",
+                Payment.updated_at > canceled_cutoff,
+            )
+            .order_by(Payment.updated_at.desc())
+            .limit(limit)
+        )
+        inv_ids += res.scalars().all()
+    if not inv_ids:
+        return
+
+    client = RobokassaOpStateClient(
+        merchant_login=merchant_login,
+        password2=password2,
+        concurrency=concurrency,
+    )
+    states = await client.get_states(inv_ids)
+    if not states:
+        return
+    stamps = latency.stamp({}, "callback_received")
+
+    events: list[PaymentSucceededEvent] = []
+
+    async with SqlAlchemyUoW() as uow:
+        res = await uow.session.execute(
+            select(Payment)
+            .where(Payment.id.in_(list(states)), Payment.status.in_(("pending", "canceled")))
+            .with_for_update(skip_locked=True)
+        )
+        has_changes = False
+
+        for p in res.scalars().all():
+            state = states[p.id]
+
+            # СЦЕНАРИЙ 1: ОПЛАТА ПРОШЛА (ResultURL потерялся)
+            if state.is_paid:
+                expected = Decimal(str(p.amount)).quantize(Decimal("0.01"))
+                incoming = (
+                    state.out_sum.quantize(Decimal("0.01"))
+                    if state.out_sum is not None
+                    else None
+                )
+                if incoming != expected:
+                    logger.warning(
+                        "robokassa amount mismatch payment_id=%s expected=%s got=%s",
+                        p.id,
+                        expected,
+                        incoming,
+                    )
+                    continue
+
+                shp_user_id = {
+                    k.lower(): v for k, v in state.user_fields.items()
+                }.get("shp_user_id")
+                if shp_user_id is not None and str(p.user_id) != str(shp_user_id):
+                    logger.warning(
+                        "robokassa user mismatch payment_id=%s user_id=%s shp_user_id=%s",
+                        p.id,
+                        p.user_id,
+                        shp_user_id,
+                    )
+                    continue
+
+                events.append(
+                    _mark_payment_succeeded(
+                        uow.session, p, now, {"reconcile": True, "opstate": state.raw}
+                    )
+                )
+                has_changes = True
+
+            # Ошибка OpState (подпись, логин магазина, сбой Robokassa, неразобранный ответ):
+            # состояние счёта неизвестно — оставляем как есть до следующего прогона.
+            elif state.result_code != RESULT_OK and not state.is_not_found:
+                logger.warning(
+                    "Robokassa OpState error for payment_id=%s: result_code=%s",
+                    p.id,
+                    state.result_code,
+                )
+
+            # СЦЕНАРИЙ 2: ПОЛЬЗОВАТЕЛЬ НЕ ОПЛАТИЛ (брошенный счёт)
+            elif p.status == "pending" and p.created_at < ttl_cutoff and state.is_unpaid:
+                logger.info(
+                    "Payment %s is not paid in Robokassa after TTL. Canceling local payment.",
+                    p.id,
+                )
+                p.status = "canceled"
+                _add_reconcile_callback(uow.session, p, {"reconcile": True, "opstate": state.raw})
+                has_changes = True
+
+        if not has_changes:
+            return
+
+        await uow.commit()
+        latency.stamp(stamps, "payment_committed")
 
     # Публикация событий делается после коммита, чтобы consumer видел консистентные данные.
-    await _publish_payment_succeeded_events(events)
+    await _publish_payment_succeeded_events(events, stamps)
+
+
+def _write_callbacks_archive(path: str, rows: list[PaymentCallback]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({
+                "id": row.id,
+                "payment_id": row.payment_id,
+                "source": row.source,
+                "payload": row.payload,
+                "created_at": row.created_at.isoformat(),
+            }, ensure_ascii=False, default=str))
+            f.write("\n")
+        # Без fsync после падения хоста файл может оказаться пустым, а строки уже удалены.
+        f.flush()
+        os.fsync(f.fileno())
+    # Файл появляется под итоговым именем только целиком записанным.
+    os.replace(tmp_path, path)
+    dir_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+@broker.task(schedule=[{"cron": "30 3 * * *"}])
+async def payment_callbacks_archive() -> None:
+    """
+    Ретенция журнала payment_callbacks:
+    - записи старше PAYMENT_CALLBACKS_RETENTION_DAYS выгружает пачками в gzip JSONL
+      в PAYMENT_CALLBACKS_ARCHIVE_DIR (payment_callbacks_<first_id>-<last_id>.jsonl.gz)
+    - только после fsync и закрытия файла удаляет выгруженные строки из БД
+    Без PAYMENT_CALLBACKS_ARCHIVE_DIR задача ничего не делает: архив в файловой системе
+    контейнера пропал бы при пересоздании вместе с удалёнными строками.
+    """
+    archive_dir = os.getenv("PAYMENT_CALLBACKS_ARCHIVE_DIR")
+    if not archive_dir:
+        logger.warning("PAYMENT_CALLBACKS_ARCHIVE_DIR is not set, payment callbacks archive skipped")
+        return
+    retention_days = int(os.getenv("PAYMENT_CALLBACKS_RETENTION_DAYS") or "90")
+    batch_size = int(os.getenv("PAYMENT_CALLBACKS_ARCHIVE_BATCH") or "5000")
+    cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=retention_days)
+
+    archived = 0
+    while True:
+        async with SqlAlchemyUoW() as uow:
+            res = await uow.session.execute(
+                select(PaymentCallback)
+                .where(PaymentCallback.created_at < cutoff)
+                .order_by(PaymentCallback.id.asc())
+                .limit(batch_size)
+            )
+            rows = list(res.scalars().all())
+            if not rows:
+                break
+
+            first_id, last_id = rows[0].id, rows[-1].id
+            path = os.path.join(archive_dir, f"payment_callbacks_{first_id}-{last_id}.jsonl.gz")
+            await asyncio.to_thread(_write_callbacks_archive, path, rows)
+
+            await uow.session.execute(
+                delete(PaymentCallback).where(PaymentCallback.id.in_([r.id for r in rows]))
+            )
+            await uow.commit()
+            archived += len(rows)
+
+        if len(rows) < batch_size:
+            break
+
+    if archived:
+        logger.info("Archived %s payment callbacks older than %s days", archived, retention_days)
+
+
+@broker.task(schedule=[{"cron": "*/5 * * * *"}])
+async def stats_rollups_refresh() -> None:
+    """
+    Инкрементально обновляет дневные роллапы статистики (платежи, подписки, новые пользователи):
+    пересчитываются только дни, затронутые строками, изменёнными после прошлого запуска.
+    STATS_ROLLUP_LAG_SECONDS — перекрытие на транзакции, закоммиченные с опозданием.
+    """
+    lag = dt.timedelta(seconds=int(os.getenv("STATS_ROLLUP_LAG_SECONDS") or "120"))
+    now = dt.datetime.now(dt.timezone.utc)
+
+    async with SqlAlchemyUoW() as uow:
+        counts = await refresh_rollups(uow.stats_repo, now=now, lag=lag)
+        await uow.commit()
+
+    if any(counts.values()):
+        logger.info("Stats rollups refreshed, days rebuilt: %s", counts)
+
+
+@broker.task(schedule=[{"cron": "*/15 * * * *"}])
+async def refresh_campaign_segments() -> None:
+    """
+    Обновляет состав материализованных сегментов рассылок (campaign_segment_members):
+    пишутся только вошедшие в сегмент и выбывшие из него пользователи.
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    async with SqlAlchemyUoW() as uow:
+        for segment in await uow.segment_repo.get_materialized():
+            added, removed = await uow.segment_repo.refresh(segment, now=now)
+            await uow.commit()
+            if added or removed:
+                logger.info("Segment %s refreshed: +%s -%s", segment.name, added, removed)
+
+
+@broker.task()
+async def send_campaign_shard(shard_id: int) -> int:
+    """
+    Отправляет шард рассылки (campaign_shards), возвращает число доставленных.
+    Воркеров может быть сколько угодно: лимит Telegram у них общий (NATS KV),
+    кампанию завершает задача, закончившая последний шард.
+    """
+    if not TOKEN:
+        logger.warning("TOKEN is not set, skipping send_campaign_shard")
+        return 0
+
+    kv = await nats_manager.key_value(CAMPAIGNS_KV)
+    async with SqlAlchemyUoW() as uow:
+        summary = await CampaignService(uow).send_shard(
+            get_bot(), shard_id, limiter=_campaign_limiter(kv), progress_kv=kv
+        )
+    return summary.sent if summary else 0
+
+
+_limiter: SharedRateLimiter | None = None
+
+
+def _campaign_limiter(kv) -> SharedRateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = SharedRateLimiter(kv)
+    return _limiter
@@ -29,6 +29,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 source=source
             )
             await mm.session.commit()
+        elif user.blocked_at:
+            # Раз пишет боту — снова доступен для рассылок и уведомлений.
+            await mm.user_service.update_user(mm.user_id, blocked_at=None)
+            await mm.session.commit()
 
         await mm.send_message('msg-start')
         return mm.end_conversation
@@ -1,13 +1,15 @@
 import datetime as dt
 import os
+import time
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
-import httpx
 
 from core.interface.services import BotInterfaceService
 from core.constants.config import CHANNEL_ID
 from core.message_manager import MessageManager
+from exceptions import PaymentsUnavailableError
+from modules.payments.client import payments_client, tap_to_link_latency
 
 
 async def _menu(mm: MessageManager, slug: str):
@@ -44,9 +46,10 @@ async def buy_subscription_stub(update: Update, context: ContextTypes.DEFAULT_TY
 
 
 async def pay_robokassa(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started_at = time.perf_counter()
     async with MessageManager(update, context) as mm:
         try:
-            web_base_url, internal_token = await _require_internal_api(mm)
+            _, internal_token = await _require_internal_api(mm)
         except RuntimeError:
             await mm.bot.edit_message_text(
                 chat_id=mm.chat_id,
@@ -57,21 +60,17 @@ async def pay_robokassa(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                resp = await client.post(
-                    f"{web_base_url}/payments/robokassa/create",
-                    json={"user_id": mm.user_id},
-                    headers={"X-Internal-Token": internal_token},
-                )
-                data = resp.json()
-        except Exception as exc:
+            status_code, data = await payments_client.create(
+                "robokassa", mm.user_id, internal_token
+            )
+        except PaymentsUnavailableError as exc:
             await mm.query.answer(f"Не удалось создать платёж. Попробуйте позже.\nОшибка: {exc}", show_alert=True)
             await _show_payment_method_screen(mm)
             return
 
-        if resp.status_code != 200:
+        if status_code != 200:
             err = data.get("error") if isinstance(data, dict) else str(data)
-            await mm.query.answer(f"Не удалось создать платёж. Код {resp.status_code}.\n{err}", show_alert=True)
+            await mm.query.answer(f"Не удалось создать платёж. Код {status_code}.\n{err}", show_alert=True)
             await _show_payment_method_screen(mm)
             return
 
@@ -104,12 +103,14 @@ async def pay_robokassa(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ),
             reply_markup=keyboard,
         )
+        tap_to_link_latency.observe(time.perf_counter() - started_at)
 
 
 async def pay_ton(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started_at = time.perf_counter()
     async with MessageManager(update, context) as mm:
         try:
-            web_base_url, internal_token = await _require_internal_api(mm)
+            _, internal_token = await _require_internal_api(mm)
         except RuntimeError:
             await mm.bot.edit_message_text(
                 chat_id=mm.chat_id,
@@ -120,21 +121,17 @@ async def pay_ton(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                resp = await client.post(
-                    f"{web_base_url}/payments/cryptobot/create",
-                    json={"user_id": mm.user_id},
-                    headers={"X-Internal-Token": internal_token},
-                )
-                data = resp.json()
-        except Exception as exc:
+            status_code, data = await payments_client.create(
+                "cryptobot", mm.user_id, internal_token
+            )
+        except PaymentsUnavailableError as exc:
             await mm.query.answer(f"Не удалось создать счёт на оплату. Попробуйте позже.\nОшибка: {exc}", show_alert=True)
             await _show_payment_method_screen(mm)
             return
 
-        if resp.status_code != 200:
+        if status_code != 200:
             err = data.get("error") if isinstance(data, dict) else str(data)
-            await mm.query.answer(f"Не удалось создать счёт на оплату. Код {resp.status_code}.\n{err}", show_alert=True)
+            await mm.query.answer(f"Не удалось создать счёт на оплату. Код {status_code}.\n{err}", show_alert=True)
             await _show_payment_method_screen(mm)
             return
 
@@ -164,6 +161,7 @@ async def pay_ton(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ),
             reply_markup=keyboard,
         )
+        tap_to_link_latency.observe(time.perf_counter() - started_at)
 
 
 async def my_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1,10 +1,19 @@
-from sqlalchemy import insert, select, update
+import datetime as dt
+from typing import Iterable
+
+from sqlalchemy import ARRAY, BigInteger, any_, bindparam, insert, select, update
 
 from core.database.base_repo import BaseRepository
 from common.models.admin_models import AdminModel
 from common.models.users_models import User
 
 
+def _in_ids(column, ids: list[int]):
+    # Один параметр-массив вместо параметра на каждый id: IN (...) упирается
+    # в лимит asyncpg (32767 параметров) на больших списках.
+    return column == any_(bindparam("user_ids", ids, type_=ARRAY(BigInteger)))
+
+
 class UserRepository(BaseRepository):
     model = User
 
@@ -37,6 +46,31 @@ class UserRepository(BaseRepository):
         if result.rowcount == 0:
             raise ValueError(f'Не удалось обновить {id}, values: {values}')
 
+    async def get_blocked_ids(self, user_ids: Iterable[int]) -> set[int]:
+        """Кто из user_ids недоступен (заблокировал бота или удалён)"""
+        ids = list(user_ids)
+        if not ids:
+            return set()
+        query = (
+            select(self.model.user_id)
+            .where(_in_ids(self.model.user_id, ids), self.model.blocked_at.is_not(None))
+        )
+        result = await self.session.execute(query)
+        return set(result.scalars().all())
+
+    async def mark_blocked(self, user_ids: Iterable[int], now: dt.datetime) -> int:
+        """Отмечает недоступных; уже отмеченные не трогает (время первой блокировки)"""
+        ids = list(user_ids)
+        if not ids:
+            return 0
+        query = (
+            update(self.model)
+            .where(_in_ids(self.model.user_id, ids), self.model.blocked_at.is_(None))
+            .values(blocked_at=now)
+        )
+        result = await self.session.execute(query)
+        return result.rowcount
+
 
 class AdminRepository(BaseRepository):
     model = AdminModel
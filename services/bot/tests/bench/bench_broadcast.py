@@ -0,0 +1,116 @@
+"""
+Бенчмарк рассылки: прежний последовательный цикл (send_message по одному,
+ошибки в лог) против common.broadcast.BroadcastEngine с пулом отправителей
+и TokenBucket на CAMPAIGN_RATE сообщений в секунду.
+
+Telegram заменён FakeTelegram с задержкой BENCH_TELEGRAM_LATENCY секунд на вызов;
+часть получателей заблокировала бота, часть не существует, часть один раз
+получает 429 (retry_after=1). БД и NATS не нужны.
+
+    BENCH_RECIPIENTS=600 CAMPAIGN_RATE=30 python tests/bench/bench_broadcast.py
+
+Результат печатается JSON'ом; для движка дополнительно проверяется, что
+в любом окне в 1 секунду отправлено не больше CAMPAIGN_RATE сообщений.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from common.broadcast import CAMPAIGN_RATE, BroadcastEngine  # noqa: E402
+from tests.fakes.telegram import FakeTelegram  # noqa: E402
+
+RECIPIENTS = int(os.getenv("BENCH_RECIPIENTS") or "600")
+LATENCY = float(os.getenv("BENCH_TELEGRAM_LATENCY") or "0.15")
+BLOCKED_SHARE = 0.1
+NOT_FOUND_SHARE = 0.02
+FLOOD_SHARE = 0.01
+
+
+def _bot(api_url: str):
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    return Bot(
+        token="123:bench",
+        base_url=f"{api_url}/bot",
+        request=HTTPXRequest(connection_pool_size=64, pool_timeout=10),
+    )
+
+
+def _prepare(fake: FakeTelegram) -> list[int]:
+    user_ids = list(range(1, RECIPIENTS + 1))
+    for user_id in user_ids[::int(1 / BLOCKED_SHARE)]:
+        fake.fail("sendMessage", user_id, 403, "Forbidden: bot was blocked by the user")
+    for user_id in user_ids[1::int(1 / NOT_FOUND_SHARE)]:
+        fake.fail("sendMessage", user_id, 400, "Bad Request: chat not found")
+    for user_id in user_ids[2::int(1 / FLOOD_SHARE)]:
+        fake.fail("sendMessage", user_id, 429, "Too Many Requests: retry after 1", times=1)
+    return user_ids
+
+
+def _max_per_second(times: list[float]) -> int:
+    ordered = sorted(times)
+    best, start = 0, 0
+    for end, at in enumerate(ordered):
+        while at - ordered[start] >= 1.0:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+async def _sequential(bot, user_ids: list[int]) -> dict:
+    sent = failed = 0
+    started = time.monotonic()
+    for user_id in user_ids:
+        try:
+            await bot.send_message(chat_id=user_id, text="bench")
+            sent += 1
+        except Exception:
+            failed += 1
+    elapsed = time.monotonic() - started
+    return {
+        "sent": sent,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 3),
+        "msgs_per_second": round(sent / elapsed, 2),
+    }
+
+
+async def _engine(bot, user_ids: list[int]) -> dict:
+    engine = BroadcastEngine(lambda user_id: bot.send_message(chat_id=user_id, text="bench"))
+    summary = await engine.run(user_ids)
+    return summary.as_dict()
+
+
+async def _run(name: str, flow) -> dict:
+    with FakeTelegram(latency=LATENCY) as fake:
+        user_ids = _prepare(fake)
+        bot = _bot(fake.api_url)
+        async with bot:
+            result = await flow(bot, user_ids)
+        result["requests"] = fake.count("sendMessage")
+        result["max_requests_per_second"] = _max_per_second(fake.times["sendMessage"])
+    return {"flow": name, **result}
+
+
+async def main() -> None:
+    results = [
+        await _run("sequential", _sequential),
+        await _run("engine", _engine),
+    ]
+    print(json.dumps({
+        "recipients": RECIPIENTS,
+        "latency": LATENCY,
+        "rate_limit": CAMPAIGN_RATE,
+        "runs": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Пробный запуск рассылки без сообщений реальным пользователям: кампания
+из БД бота проходит CampaignService.dry_run — получатели курсором, клавиатура
+через BotInterfaceService.get_keyboard, вложения, лимит CAMPAIGN_RATE — но
+запросы уходят в FakeTelegram с задержкой BENCH_TELEGRAM_LATENCY секунд на вызов.
+Доля BENCH_BLOCKED_SHARE получателей заблокировала бота, доля BENCH_FLOOD_SHARE
+один раз получает 429 (retry_after=1).
+
+    CAMPAIGN_DRY_RUN_SAMPLE=600 python tests/bench/bench_campaign_dry_run.py <campaign_id>
+
+Обходятся первые CAMPAIGN_DRY_RUN_SAMPLE получателей аудитории; в БД ничего
+не пишется. Результат — JSON: итог выборки и оценка длительности и скорости
+рассылки на всю аудиторию кампании.
+"""
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR.parent))
+
+from common.broadcast import CAMPAIGN_RATE, TokenBucket  # noqa: E402
+from tests.fakes.telegram import MEDIA_METHODS, FakeTelegram  # noqa: E402
+
+LATENCY = float(os.getenv("BENCH_TELEGRAM_LATENCY") or "0.15")
+BLOCKED_SHARE = float(os.getenv("BENCH_BLOCKED_SHARE") or "0.1")
+FLOOD_SHARE = float(os.getenv("BENCH_FLOOD_SHARE") or "0.01")
+SEND_METHODS = ("sendMessage", "sendMediaGroup", "copyMessage", "copyMessages", *MEDIA_METHODS)
+
+
+def _bot(api_url: str):
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    return Bot(
+        token="123:dry-run",
+        base_url=f"{api_url}/bot",
+        request=HTTPXRequest(connection_pool_size=64, pool_timeout=10),
+    )
+
+
+def _prepare(fake: FakeTelegram) -> None:
+    for method in SEND_METHODS:
+        fake.fail_share(method, BLOCKED_SHARE, 403, "Forbidden: bot was blocked by the user")
+        fake.fail_share(method, FLOOD_SHARE, 429, "Too Many Requests: retry after 1", once=True)
+
+
+async def main(campaign_id: int) -> None:
+    from core.database.uow import SqlAlchemyUoW
+    from modules.campaign.services import CampaignService
+
+    with FakeTelegram(latency=LATENCY) as fake:
+        _prepare(fake)
+        bot = _bot(fake.api_url)
+        async with bot, SqlAlchemyUoW() as uow:
+            report = await CampaignService(uow).dry_run(
+                bot, campaign_id, limiter=TokenBucket(CAMPAIGN_RATE)
+            )
+        report["requests"] = {method: fake.count(method) for method in SEND_METHODS
+                              if fake.count(method)}
+    print(json.dumps({
+        "latency": LATENCY,
+        "rate_limit": CAMPAIGN_RATE,
+        "blocked_share": BLOCKED_SHARE,
+        "flood_share": FLOOD_SHARE,
+        **report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise SystemExit(f"usage: {sys.argv[0]} <campaign_id>")
+    asyncio.run(main(int(sys.argv[1])))
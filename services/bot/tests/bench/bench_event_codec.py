@@ -0,0 +1,74 @@
+"""
+Бенчмарк кодирования событий: прежний JSON (model_dump_json / json.loads + model_validate)
+против конверта common.event_codec для SendCampaignEvent с разным числом получателей.
+
+Внешние сервисы не нужны:
+
+    BENCH_RECIPIENTS=1000,1000000 python tests/bench/bench_event_codec.py
+
+Результат печатается JSON'ом: размер сообщения(й) и время кодирования/декодирования.
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from common.event_codec import decode_event, encode_event  # noqa: E402
+from common.events import SendCampaignEvent  # noqa: E402
+
+RECIPIENTS = [int(n) for n in (os.getenv("BENCH_RECIPIENTS") or "1000,1000000").split(",")]
+REPEAT = int(os.getenv("BENCH_REPEAT") or "3")
+USER_ID_BASE = 100_000_000
+
+
+def _best(fn) -> tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench(recipients: int) -> dict:
+    # Как в рассылке: id из БД по возрастанию, с пропусками.
+    user_ids = list(range(USER_ID_BASE, USER_ID_BASE + recipients * 3, 3))
+    event = SendCampaignEvent(campaign_id=1, user_ids=user_ids, text="x" * 500)
+
+    legacy_encode, legacy_payload = _best(lambda: event.model_dump_json().encode("utf-8"))
+    legacy_decode, _ = _best(
+        lambda: SendCampaignEvent.model_validate(json.loads(legacy_payload.decode()))
+    )
+
+    envelope_encode, chunks = _best(lambda: encode_event(event))
+    envelope_decode, decoded = _best(
+        lambda: [decode_event("campaign.send", data, headers) for data, headers in chunks]
+    )
+    assert [uid for part in decoded for uid in part.user_ids] == user_ids
+
+    return {
+        "recipients": recipients,
+        "legacy": {
+            "bytes": len(legacy_payload),
+            "encode_ms": round(legacy_encode * 1000, 2),
+            "decode_ms": round(legacy_decode * 1000, 2),
+        },
+        "envelope": {
+            "bytes": sum(len(data) for data, _ in chunks),
+            "messages": len(chunks),
+            "encode_ms": round(envelope_encode * 1000, 2),
+            "decode_ms": round(envelope_decode * 1000, 2),
+        },
+    }
+
+
+def main() -> None:
+    print(json.dumps([bench(n) for n in RECIPIENTS], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Бенчмарк выдачи доступа по оплаченному платежу: число обращений к БД (запросы +
+BEGIN/COMMIT/ROLLBACK) и время на платёж для прежней последовательности
+(claim → grant_30d → commit → create_invite_link → commit → get_active)
+и для SubscriptionService.create_payment_invite + grant_payment.
+
+Нужна тестовая БД из настроек бота. Telegram заменён FakeTelegram
+с задержкой BENCH_TELEGRAM_LATENCY секунд на вызов.
+
+    BENCH_PAYMENTS=200 python tests/bench/bench_payment_fulfillment.py
+
+Результат печатается JSON'ом. Созданные пользователи/платежи/подписки удаляются.
+"""
+import asyncio
+import datetime as dt
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from tests.fakes.telegram import FakeTelegram  # noqa: E402
+
+PAYMENTS = int(os.getenv("BENCH_PAYMENTS") or "200")
+LATENCY = float(os.getenv("BENCH_TELEGRAM_LATENCY") or "0")
+USER_ID_BASE = 9_100_000_000
+
+
+class RoundTrips:
+    """Считает обращения к БД через события движка SQLAlchemy."""
+
+    def __init__(self, engine) -> None:
+        from sqlalchemy import event
+
+        self.counts: Counter = Counter()
+        self._engine = engine.sync_engine
+        self._listeners = {
+            "before_cursor_execute": lambda *args: self.counts.update(["statement"]),
+            "begin": lambda conn: self.counts.update(["begin"]),
+            "commit": lambda conn: self.counts.update(["commit"]),
+            "rollback": lambda conn: self.counts.update(["rollback"]),
+        }
+        for name, fn in self._listeners.items():
+            event.listen(self._engine, name, fn)
+
+    def close(self) -> None:
+        from sqlalchemy import event
+
+        for name, fn in self._listeners.items():
+            event.remove(self._engine, name, fn)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+async def _seed(start_id: int) -> list[tuple[int, int]]:
+    from sqlalchemy import insert
+
+    from common.models.payments_models import Payment
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    user_ids = list(range(start_id, start_id + PAYMENTS))
+    now = dt.datetime.now(dt.timezone.utc)
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            insert(User), [{"user_id": uid, "first_name": "bench"} for uid in user_ids]
+        )
+        result = await uow.session.execute(
+            insert(Payment).returning(Payment.id),
+            [
+                {"user_id": uid, "provider": "robokassa", "amount": 5000, "currency": "KZT",
+                 "status": "success", "signature_verified": True, "paid_at": now}
+                for uid in user_ids
+            ],
+        )
+        payment_ids = list(result.scalars().all())
+        await uow.commit()
+    return list(zip(payment_ids, user_ids))
+
+
+async def _cleanup(start_id: int) -> None:
+    from sqlalchemy import delete, select
+
+    from common.models.payments_models import Payment
+    from common.models.subscriptions_models import Subscription, SubscriptionAccess
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    users = (start_id, start_id + PAYMENTS)
+    async with SqlAlchemyUoW() as uow:
+        subs = select(Subscription.id).where(Subscription.user_id.between(*users))
+        await uow.session.execute(
+            delete(SubscriptionAccess).where(SubscriptionAccess.subscription_id.in_(subs))
+        )
+        await uow.session.execute(delete(Subscription).where(Subscription.user_id.between(*users)))
+        await uow.session.execute(delete(Payment).where(Payment.user_id.between(*users)))
+        await uow.session.execute(delete(User).where(User.user_id.between(*users)))
+        await uow.commit()
+
+
+async def _legacy(bot, payment_id: int, user_id: int, channel_id: int) -> None:
+    from sqlalchemy import update
+
+    from common.models.payments_models import Payment
+    from core.database.uow import SqlAlchemyUoW
+    from modules.subscriptions.services import SubscriptionService
+
+    paid_at = dt.datetime.now(dt.timezone.utc)
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            update(Payment)
+            .where(Payment.id == payment_id, Payment.processed_at.is_(None))
+            .values(processed_at=paid_at)
+        )
+        ss = SubscriptionService(uow)
+        await ss.grant_30d(user_id=user_id, channel_id=channel_id, start_at=paid_at)
+        await uow.commit()
+        await ss.create_invite_link(bot=bot, user_id=user_id, channel_id=channel_id)
+        await uow.commit()
+        await ss.get_active(user_id=user_id, channel_id=channel_id)
+
+
+async def _single_transaction(bot, payment_id: int, user_id: int, channel_id: int) -> None:
+    from core.database.uow import SqlAlchemyUoW
+    from modules.subscriptions.services import SubscriptionService
+
+    async with SqlAlchemyUoW() as uow:
+        ss = SubscriptionService(uow)
+        invite_link, expire_at = await ss.create_payment_invite(bot, channel_id=channel_id)
+        await ss.grant_payment(
+            bot,
+            payment_id=payment_id,
+            user_id=user_id,
+            invite_link=invite_link,
+            invite_expire_at=expire_at,
+            channel_id=channel_id,
+        )
+
+
+async def _run(name: str, fulfill, start_id: int) -> dict:
+    from core.database.database import engine
+    from core.utils.bot import get_bot
+
+    bot = get_bot()
+    channel_id = -1000000000001
+    payments = await _seed(start_id)
+    round_trips = RoundTrips(engine)
+    started = time.perf_counter()
+    try:
+        for payment_id, user_id in payments:
+            await fulfill(bot, payment_id, user_id, channel_id)
+    finally:
+        elapsed = time.perf_counter() - started
+        round_trips.close()
+        await _cleanup(start_id)
+
+    return {
+        "flow": name,
+        "round_trips_per_payment": round(round_trips.total / PAYMENTS, 2),
+        "breakdown_per_payment": {
+            kind: round(count / PAYMENTS, 2) for kind, count in sorted(round_trips.counts.items())
+        },
+        "ms_per_payment": round(elapsed / PAYMENTS * 1000, 2),
+    }
+
+
+async def main() -> None:
+    with FakeTelegram(latency=LATENCY) as fake:
+        os.environ["TELEGRAM_API_URL"] = fake.api_url
+        results = [
+            await _run("legacy", _legacy, USER_ID_BASE),
+            await _run("single_transaction", _single_transaction, USER_ID_BASE + PAYMENTS + 1),
+        ]
+    print(json.dumps({"payments": PAYMENTS, "runs": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+"""
+Бенчмарк consumer'а payment.succeeded: N событий в очереди JetStream,
+все в одной партиции (строго последовательно) и по партициям
+payment.succeeded.<user_id % PAYMENT_PARTITIONS> — как публикуют web и reconcile.
+Внутри партиции проверяется порядок обработки (stream sequence по возрастанию).
+
+Нужны локальный NATS с JetStream (BENCH_NATS_URL, по умолчанию nats://127.0.0.1:4222)
+и тестовая БД из настроек бота. Telegram заменён FakeTelegram с задержкой
+BENCH_TELEGRAM_LATENCY секунд на вызов.
+
+    BENCH_EVENTS=1000 PAYMENT_PARTITIONS=16 python tests/bench/bench_payments_consumer.py
+
+Результат печатается JSON'ом. Созданные пользователи/платежи/подписки удаляются.
+"""
+import asyncio
+import datetime as dt
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from common.nats_client import PAYMENT_PARTITIONS  # noqa: E402
+from tests.fakes.telegram import FakeTelegram  # noqa: E402
+
+EVENTS = int(os.getenv("BENCH_EVENTS") or "1000")
+LATENCY = float(os.getenv("BENCH_TELEGRAM_LATENCY") or "0.15")
+NATS_URL = os.getenv("BENCH_NATS_URL") or "nats://127.0.0.1:4222"
+USER_ID_BASE = 9_000_000_000
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def _seed(start_id: int) -> list[int]:
+    from sqlalchemy import insert
+
+    from common.models.payments_models import Payment
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    user_ids = list(range(start_id, start_id + EVENTS))
+    now = dt.datetime.now(dt.timezone.utc)
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            insert(User), [{"user_id": uid, "first_name": "bench"} for uid in user_ids]
+        )
+        result = await uow.session.execute(
+            insert(Payment).returning(Payment.id),
+            [
+                {"user_id": uid, "provider": "robokassa", "amount": 5000, "currency": "KZT",
+                 "status": "success", "signature_verified": True, "paid_at": now}
+                for uid in user_ids
+            ],
+        )
+        payment_ids = list(result.scalars().all())
+        await uow.commit()
+    return payment_ids
+
+
+async def _cleanup(start_id: int) -> None:
+    from sqlalchemy import delete, select
+
+    from common.models.payments_models import Payment, PaymentLatency
+    from common.models.subscriptions_models import Subscription, SubscriptionAccess
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    user_filter = User.user_id.between(start_id, start_id + EVENTS)
+    async with SqlAlchemyUoW() as uow:
+        subs = select(Subscription.id).where(
+            Subscription.user_id.between(start_id, start_id + EVENTS)
+        )
+        await uow.session.execute(
+            delete(SubscriptionAccess).where(SubscriptionAccess.subscription_id.in_(subs))
+        )
+        await uow.session.execute(
+            delete(Subscription).where(Subscription.user_id.between(start_id, start_id + EVENTS))
+        )
+        payments = select(Payment.id).where(Payment.user_id.between(start_id, start_id + EVENTS))
+        await uow.session.execute(
+            delete(PaymentLatency).where(PaymentLatency.payment_id.in_(payments))
+        )
+        await uow.session.execute(
+            delete(Payment).where(Payment.user_id.between(start_id, start_id + EVENTS))
+        )
+        await uow.session.execute(delete(User).where(user_filter))
+        await uow.commit()
+
+
+async def _run(partitioned: bool, start_id: int) -> dict:
+    from common.events import PaymentSucceededEvent
+    from common.nats_client import NatsManager, payment_durable, payment_subject
+    from modules.nats_listener import PullConsumer, handle_payment_succeeded
+
+    payment_ids = await _seed(start_id)
+    manager = NatsManager(url=NATS_URL)
+    await manager.connect(ensure_topology=True)
+
+    paid_at = dt.datetime.now(dt.timezone.utc)
+    for payment_id, user_id in zip(payment_ids, range(start_id, start_id + EVENTS)):
+        event = PaymentSucceededEvent(
+            payment_id=payment_id, user_id=user_id, provider="robokassa",
+            amount="5000", currency="KZT", paid_at=paid_at,
+        )
+        subject = payment_subject(user_id) if partitioned else "payment.succeeded.0"
+        await manager.publish(subject, event)
+
+    durations: list[float] = []
+    sequences: dict[str, list[int]] = {}
+    done = asyncio.Event()
+
+    async def measured(msg) -> None:
+        sequences.setdefault(msg.subject, []).append(msg.metadata.sequence.stream)
+        started = time.perf_counter()
+        await handle_payment_succeeded(msg)
+        durations.append(time.perf_counter() - started)
+        if len(durations) >= EVENTS:
+            done.set()
+
+    durables = [payment_durable(n) for n in range(PAYMENT_PARTITIONS if partitioned else 1)]
+    consumers = [
+        PullConsumer(await manager.pull_subscription(durable), measured,
+                     concurrency=1, batch=1, fetch_timeout=1, name=durable)
+        for durable in durables
+    ]
+    started = time.perf_counter()
+    runners = [asyncio.create_task(consumer.run()) for consumer in consumers]
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(consumer.drain(timeout=10) for consumer in consumers))
+    for runner in runners:
+        runner.cancel()
+    await manager.close()
+    await _cleanup(start_id)
+
+    return {
+        "partitions": len(durables),
+        "seconds": round(elapsed, 2),
+        "events_per_second": round(EVENTS / elapsed, 1),
+        "handler_p50_ms": round(_percentile(durations, 0.5) * 1000, 1),
+        "handler_p95_ms": round(_percentile(durations, 0.95) * 1000, 1),
+        "ordered_within_partition": all(seq == sorted(seq) for seq in sequences.values()),
+    }
+
+
+async def main() -> None:
+    with FakeTelegram(latency=LATENCY) as fake:
+        os.environ["TELEGRAM_API_URL"] = fake.api_url
+        os.environ.setdefault("TELEGRAM_POOL_SIZE", str(PAYMENT_PARTITIONS))
+        results = [
+            await _run(False, USER_ID_BASE),
+            await _run(True, USER_ID_BASE + EVENTS + 1),
+        ]
+        report = {
+            "events": EVENTS,
+            "telegram_latency_ms": LATENCY * 1000,
+            "runs": results,
+            "telegram_calls": {m: fake.count(m) for m in ("createChatInviteLink", "sendMessage")},
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,355 @@
+"""
+Сценарные бенчмарки на локальном стенде (tests/bench/harness.py):
+
+- payments — HARNESS_PAYMENTS оплат с темпом HARNESS_PAYMENT_RATE в секунду, поровну
+  Robokassa ResultURL и webhook CryptoBot: web → NATS → бот → инвайт в FakeTelegram;
+- expiry — истечение HARNESS_EXPIRED подписок задачей subscriptions_expire_and_kick;
+- broadcast — рассылка HARNESS_RECIPIENTS пользователям: campaign.send → listener → taskiq.
+
+    HARNESS_SCENARIOS=payments,expiry,broadcast python tests/bench/bench_pipeline.py
+
+Отчёт — JSON в stdout (и в файл HARNESS_REPORT, если задан): ревизия git, параметры
+стенда и по каждому сценарию пропускная способность и перцентили задержек в мс —
+чтобы сравнивать прогоны до и после изменения. Созданные строки удаляются.
+"""
+import asyncio
+import datetime as dt
+import json
+import os
+import subprocess
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT_DIR))
+
+from tests.bench.harness import CHANNEL_ID, TARIFF_AMOUNT, Harness, percentiles  # noqa: E402
+
+SCENARIOS = [s.strip() for s in (os.getenv("HARNESS_SCENARIOS") or "payments,expiry,broadcast")
+             .split(",") if s.strip()]
+PAYMENTS = int(os.getenv("HARNESS_PAYMENTS") or "500")
+PAYMENT_RATE = float(os.getenv("HARNESS_PAYMENT_RATE") or "50")
+EXPIRED = int(os.getenv("HARNESS_EXPIRED") or "1000")
+RECIPIENTS = int(os.getenv("HARNESS_RECIPIENTS") or "5000")
+TIMEOUT = float(os.getenv("HARNESS_TIMEOUT") or "300")
+REPORT_PATH = os.getenv("HARNESS_REPORT")
+
+PAYMENTS_USER_BASE = 9_300_000_000
+EXPIRY_USER_BASE = 9_400_000_000
+BROADCAST_USER_BASE = 9_500_000_000
+
+
+def _revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _wait(predicate, timeout: float = TIMEOUT, interval: float = 0.2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await predicate():
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+
+async def _seed_users(start_id: int, count: int) -> list[int]:
+    from sqlalchemy import insert
+
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    user_ids = list(range(start_id, start_id + count))
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            insert(User), [{"user_id": uid, "first_name": "harness"} for uid in user_ids]
+        )
+        await uow.commit()
+    return user_ids
+
+
+async def _cleanup(start_id: int, count: int) -> None:
+    from sqlalchemy import delete, select
+
+    from common.models.payments_models import Payment, PaymentCallback, PaymentLatency
+    from common.models.subscriptions_models import Subscription, SubscriptionAccess
+    from common.models.users_models import User
+    from core.database.uow import SqlAlchemyUoW
+
+    users = (start_id, start_id + count)
+    async with SqlAlchemyUoW() as uow:
+        subs = select(Subscription.id).where(Subscription.user_id.between(*users))
+        payments = select(Payment.id).where(Payment.user_id.between(*users))
+        await uow.session.execute(
+            delete(SubscriptionAccess).where(SubscriptionAccess.subscription_id.in_(subs))
+        )
+        await uow.session.execute(delete(Subscription).where(Subscription.user_id.between(*users)))
+        await uow.session.execute(
+            delete(PaymentLatency).where(PaymentLatency.payment_id.in_(payments))
+        )
+        await uow.session.execute(
+            delete(PaymentCallback).where(PaymentCallback.payment_id.in_(payments))
+        )
+        await uow.session.execute(delete(Payment).where(Payment.user_id.between(*users)))
+        await uow.session.execute(delete(User).where(User.user_id.between(*users)))
+        await uow.commit()
+
+
+async def _tariff_amount() -> Decimal:
+    # web сверяет сумму с настройкой TARIFF_AMOUNT_KZT из БД, если она есть.
+    from sqlalchemy import select
+
+    from common.models.models import Settings
+    from core.database.uow import SqlAlchemyUoW
+
+    async with SqlAlchemyUoW() as uow:
+        value = await uow.session.scalar(
+            select(Settings.value_).where(Settings.key == "TARIFF_AMOUNT_KZT").limit(1)
+        )
+    return Decimal(value or TARIFF_AMOUNT).quantize(Decimal("0.01"))
+
+
+async def scenario_payments(harness: Harness) -> dict:
+    from sqlalchemy import func, insert, select
+
+    from common import latency
+    from common.models.payments_models import Payment, PaymentLatency
+    from core.database.uow import SqlAlchemyUoW
+
+    amount = await _tariff_amount()
+    user_ids = await _seed_users(PAYMENTS_USER_BASE, PAYMENTS)
+    rows, invoices = [], []
+    for index, user_id in enumerate(user_ids):
+        row = {"user_id": user_id, "amount": amount, "currency": "KZT", "status": "pending",
+               "provider": "robokassa"}
+        invoice_id = None
+        if index % 2:
+            invoice_id = harness.cryptopay.add_invoice(amount=str(amount))["invoice_id"]
+            row.update(provider="cryptobot", provider_invoice_id=str(invoice_id))
+        rows.append(row)
+        invoices.append(invoice_id)
+    async with SqlAlchemyUoW() as uow:
+        result = await uow.session.execute(insert(Payment).returning(Payment.id), rows)
+        payment_ids = list(result.scalars().all())
+        await uow.commit()
+
+    http_ms: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def callback(payment_id: int, user_id: int, invoice_id: int | None) -> None:
+        started = time.perf_counter()
+        if invoice_id is None:
+            status = await harness.post_robokassa_result(payment_id, user_id, str(amount))
+        else:
+            status = await harness.post_cryptobot_webhook(invoice_id)
+        http_ms.append((time.perf_counter() - started) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    # Темп задаёт расписание, а не ответы web: медленный web не снижает нагрузку.
+    started = time.perf_counter()
+    tasks = []
+    for index, args in enumerate(zip(payment_ids, user_ids, invoices)):
+        delay = started + index / PAYMENT_RATE - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(callback(*args)))
+    await asyncio.gather(*tasks)
+    offered_seconds = time.perf_counter() - started
+
+    done_query = select(PaymentLatency).where(
+        PaymentLatency.payment_id.in_(payment_ids), PaymentLatency.message_sent_at.is_not(None)
+    )
+
+    async def finished() -> bool:
+        async with SqlAlchemyUoW() as uow:
+            done = await uow.session.scalar(select(func.count()).select_from(done_query.subquery()))
+        return done >= statuses.get(200, 0)
+
+    completed_in_time = await _wait(finished)
+    async with SqlAlchemyUoW() as uow:
+        latencies = (await uow.session.execute(done_query)).scalars().all()
+    await _cleanup(PAYMENTS_USER_BASE, PAYMENTS)
+
+    stage_ms: dict[str, list[float]] = {}
+    first_callback, last_sent = None, None
+    for row in latencies:
+        stamps = {
+            stage: getattr(row, f"{stage}_at").timestamp()
+            for stage in latency.STAGES if getattr(row, f"{stage}_at") is not None
+        }
+        for stage, seconds in latency.stage_durations(stamps).items():
+            stage_ms.setdefault(stage, []).append(seconds * 1000)
+        if stamps:
+            first = min(stamps.values())
+            first_callback = first if first_callback is None else min(first_callback, first)
+            sent = stamps.get("message_sent")
+            if sent is not None:
+                last_sent = sent if last_sent is None else max(last_sent, sent)
+
+    window = (last_sent - first_callback) if latencies and last_sent and first_callback else 0
+    return {
+        "payments": PAYMENTS,
+        "target_rate": PAYMENT_RATE,
+        "offered_rate": round(PAYMENTS / offered_seconds, 1),
+        "http_statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "completed": len(latencies),
+        "completed_in_time": completed_in_time,
+        "throughput_per_second": round(len(latencies) / window, 1) if window else None,
+        "callback_http_ms": percentiles(http_ms),
+        "payment_to_access_ms": percentiles(
+            [row.total_ms for row in latencies if row.total_ms is not None]
+        ),
+        "stages_ms": {stage: percentiles(values) for stage, values in stage_ms.items()},
+    }
+
+
+async def scenario_expiry(harness: Harness) -> dict:
+    from sqlalchemy import func, insert, select
+
+    from common.models.subscriptions_models import Subscription
+    from core.database.uow import SqlAlchemyUoW
+    from modules.tasks.tasks import subscriptions_expire_and_kick
+
+    user_ids = await _seed_users(EXPIRY_USER_BASE, EXPIRED)
+    now = dt.datetime.now(dt.timezone.utc)
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(insert(Subscription), [
+            {"user_id": uid, "channel_id": CHANNEL_ID, "status": "active",
+             "start_at": now - dt.timedelta(days=31), "end_at": now - dt.timedelta(days=1)}
+            for uid in user_ids
+        ])
+        await uow.commit()
+
+    methods = ("banChatMember", "unbanChatMember", "sendMessage")
+    before = {method: harness.telegram.count(method) for method in methods}
+    started = time.perf_counter()
+    await subscriptions_expire_and_kick()
+    elapsed = time.perf_counter() - started
+
+    async with SqlAlchemyUoW() as uow:
+        still_active = await uow.session.scalar(
+            select(func.count(Subscription.id)).where(
+                Subscription.user_id.in_(user_ids), Subscription.status == "active"
+            )
+        )
+    await _cleanup(EXPIRY_USER_BASE, EXPIRED)
+
+    return {
+        "subscriptions": EXPIRED,
+        "seconds": round(elapsed, 2),
+        "per_second": round(EXPIRED / elapsed, 1),
+        "still_active": still_active,
+        "telegram_calls": {m: harness.telegram.count(m) - before[m] for m in methods},
+    }
+
+
+async def scenario_broadcast(harness: Harness) -> dict:
+    from sqlalchemy import delete, func, insert, select
+
+    from common.campaign_progress import read_progress
+    from common.events import SendCampaignEvent
+    from common.models.campaigns_models import CampaignShard
+    from common.models.users_models import SendMessageCampaign
+    from common.nats_client import CAMPAIGNS_KV, nats_manager
+    from core.database.uow import SqlAlchemyUoW
+
+    user_ids = await _seed_users(BROADCAST_USER_BASE, RECIPIENTS)
+    async with SqlAlchemyUoW() as uow:
+        campaign_id = await uow.session.scalar(
+            insert(SendMessageCampaign)
+            .values(name="harness broadcast", text="Harness broadcast")
+            .returning(SendMessageCampaign.id)
+        )
+        await uow.commit()
+
+    sent_before = harness.telegram.count("sendMessage")
+    published_at = time.time()
+    await nats_manager.publish(
+        "campaign.send",
+        SendCampaignEvent(campaign_id=campaign_id, user_ids=user_ids, text="Harness broadcast"),
+    )
+
+    kv = await nats_manager.key_value(CAMPAIGNS_KV)
+    # промежуточные значения прогресса, которые видела бы админка
+    progress_updates: set[int] = set()
+
+    async def completed() -> bool:
+        progress = (await read_progress(kv, [campaign_id])).get(campaign_id)
+        if progress and progress.remaining:
+            progress_updates.add(progress.processed)
+        # Кампанию завершает задача, закончившая последний шард.
+        async with SqlAlchemyUoW() as uow:
+            status = await uow.session.scalar(
+                select(SendMessageCampaign.status).where(SendMessageCampaign.id == campaign_id)
+            )
+        return status == "Завершена"
+
+    completed_in_time = await _wait(completed)
+    times = harness.telegram.times["sendMessage"][sent_before:]
+    progress = (await read_progress(kv, [campaign_id])).get(campaign_id)
+    async with SqlAlchemyUoW() as uow:
+        shards = await uow.session.scalar(
+            select(func.count()).where(CampaignShard.campaign_id == campaign_id)
+        )
+        await uow.session.execute(
+            delete(SendMessageCampaign).where(SendMessageCampaign.id == campaign_id)
+        )
+        await uow.commit()
+    await _cleanup(BROADCAST_USER_BASE, RECIPIENTS)
+
+    seconds = (max(times) - published_at) if times else None
+    return {
+        "recipients": RECIPIENTS,
+        "delivered": len(times),
+        "shards": shards,
+        "completed_in_time": completed_in_time,
+        "progress": {
+            "sent": progress.sent if progress else None,
+            "total": progress.total if progress else None,
+            "live_updates": len(progress_updates),
+        },
+        "seconds": round(seconds, 2) if seconds else None,
+        "messages_per_second": round(len(times) / seconds, 1) if seconds else None,
+        "first_message_ms": round((min(times) - published_at) * 1000, 1) if times else None,
+        "delivery_ms": percentiles([(t - published_at) * 1000 for t in times]),
+    }
+
+
+SCENARIO_RUNNERS = {
+    "payments": scenario_payments,
+    "expiry": scenario_expiry,
+    "broadcast": scenario_broadcast,
+}
+
+
+async def main() -> None:
+    unknown = set(SCENARIOS) - set(SCENARIO_RUNNERS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {
+        "revision": _revision(),
+        "started_at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "harness": None,
+        "scenarios": {},
+    }
+    async with Harness() as harness:
+        report["harness"] = harness.describe()
+        for name in SCENARIOS:
+            report["scenarios"][name] = await SCENARIO_RUNNERS[name](harness)
+
+    output = json.dumps(report, indent=2)
+    if REPORT_PATH:
+        Path(REPORT_PATH).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,385 @@
+"""
+Локальный стенд для интеграционных бенчмарков: NATS, Postgres, web, бот и воркер taskiq.
+
+- NATS: HARNESS_NATS_URL или временный `nats-server -js` (бинарник из NATS_SERVER_BIN / PATH);
+- Postgres: HARNESS_DATABASE_URL (postgresql://...) или временный кластер через
+  initdb/pg_ctl (каталог PG_BIN / PATH; initdb не запускается от root);
+- заглушки в процессе стенда: FakeTelegram, FakeRobokassa, FakeCryptoPay;
+- процессы сервисов с адресами стенда в окружении: схема (create_db.py),
+  web (gunicorn manage:app), NATS listener бота и воркер taskiq.
+
+config.py сервисов читает настройки из окружения (.env), поэтому стенд подменяет
+DATABASE_URL, NATS_URL, TELEGRAM_API_URL, ROBO_*, CRYPTOBOT_* и т.п., а остальное
+наследует от текущего окружения. Логи процессов — в HARNESS_LOG_DIR
+(по умолчанию временный каталог), путь печатается при ошибке запуска.
+
+    async with Harness() as harness:
+        harness.telegram.count("sendMessage")
+        await harness.post_robokassa_result(payment_id, user_id, out_sum="5000.00")
+"""
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Optional
+
+BOT_DIR = Path(__file__).resolve().parents[2]
+SERVICES_DIR = BOT_DIR.parent
+WEB_DIR = SERVICES_DIR / "web"
+for path in (str(BOT_DIR), str(SERVICES_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from tests.fakes.cryptopay import FakeCryptoPay  # noqa: E402
+from tests.fakes.robokassa import FakeRobokassa  # noqa: E402
+from tests.fakes.telegram import FakeTelegram  # noqa: E402
+
+TELEGRAM_LATENCY = float(os.getenv("HARNESS_TELEGRAM_LATENCY") or "0.05")
+WEB_WORKERS = int(os.getenv("HARNESS_WEB_WORKERS") or "2")
+WEB_THREADS = int(os.getenv("HARNESS_WEB_THREADS") or "8")
+START_TIMEOUT = float(os.getenv("HARNESS_START_TIMEOUT") or "60")
+
+BOT_TOKEN = "100000001:HARNESS"
+CHANNEL_ID = -1001000000000
+TARIFF_AMOUNT = "5000"
+ROBO_LOGIN = "harness"
+ROBO_PASSWORD_1 = "harness-pass-1"
+ROBO_PASSWORD_2 = "harness-pass-2"
+CRYPTOBOT_TOKEN = "1:HARNESS"
+INTERNAL_API_TOKEN = "harness-internal"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float, host: str = "127.0.0.1") -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{host}:{port} is not listening after {timeout}s")
+
+
+def percentiles(values: list[float], digits: int = 1) -> dict[str, Optional[float]]:
+    """p50/p95/p99/max (ближайший ранг); пустой список — None."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], digits)
+
+    return {
+        "p50": rank(0.5), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1], digits)
+    }
+
+
+def _find_binary(name: str, env_dir: str) -> str:
+    directory = os.getenv(env_dir)
+    path = os.path.join(directory, name) if directory else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f"{name} is not found: add it to PATH or set {env_dir}")
+    return path
+
+
+class LocalNats:
+    """HARNESS_NATS_URL или временный nats-server с JetStream."""
+
+    def __init__(self, log_dir: Path) -> None:
+        self.url = os.getenv("HARNESS_NATS_URL") or ""
+        self.log_dir = log_dir
+        self._process: Optional[subprocess.Popen] = None
+        self._data_dir: Optional[str] = None
+
+    def __enter__(self) -> "LocalNats":
+        if self.url:
+            return self
+        binary = _find_binary("nats-server", "NATS_SERVER_BIN")
+        port = free_port()
+        self._data_dir = tempfile.mkdtemp(prefix="harness-nats-")
+        log = open(self.log_dir / "nats.log", "wb")
+        self._process = subprocess.Popen(
+            [binary, "-js", "-a", "127.0.0.1", "-p", str(port), "-sd", self._data_dir],
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+        wait_for_port(port, START_TIMEOUT)
+        self.url = f"nats://127.0.0.1:{port}"
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._process:
+            self._process.terminate()
+            self._process.wait(timeout=10)
+        if self._data_dir:
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+
+
+class LocalPostgres:
+    """HARNESS_DATABASE_URL или временный кластер Postgres (initdb + pg_ctl)."""
+
+    def __init__(self, log_dir: Path) -> None:
+        self.url = os.getenv("HARNESS_DATABASE_URL") or ""
+        self.log_dir = log_dir
+        self._pg_ctl: Optional[str] = None
+        self._data_dir: Optional[str] = None
+
+    def __enter__(self) -> "LocalPostgres":
+        if self.url:
+            return self
+        initdb = _find_binary("initdb", "PG_BIN")
+        self._pg_ctl = _find_binary("pg_ctl", "PG_BIN")
+        port = free_port()
+        self._data_dir = tempfile.mkdtemp(prefix="harness-pg-")
+        data = os.path.join(self._data_dir, "data")
+        subprocess.run(
+            [initdb, "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+        )
+        options = f"-p {port} -k {self._data_dir} -c listen_addresses=127.0.0.1"
+        subprocess.run(
+            [self._pg_ctl, "-D", data, "-o", options, "-l", str(self.log_dir / "postgres.log"),
+             "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        self.url = f"postgresql://postgres@127.0.0.1:{port}/postgres"
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._pg_ctl and self._data_dir:
+            subprocess.run(
+                [self._pg_ctl, "-D", os.path.join(self._data_dir, "data"), "-m", "fast", "stop"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+
+    def driver_url(self, driver: str) -> str:
+        scheme, rest = self.url.split("://", 1)
+        return f"{scheme.split('+', 1)[0]}+{driver}://{rest}"
+
+
+class ServiceProcess:
+    """Процесс сервиса с логом в файл; при падении на старте ошибка содержит хвост лога."""
+
+    def __init__(self, name: str, args: list[str], cwd: Path, env: dict[str, str],
+                 log_dir: Path) -> None:
+        self.name = name
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.log_path = log_dir / f"{name}.log"
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self) -> "ServiceProcess":
+        log = open(self.log_path, "ab")
+        self._process = subprocess.Popen(
+            self.args, cwd=self.cwd, env=self.env, stdout=log, stderr=subprocess.STDOUT
+        )
+        return self
+
+    def _fail(self) -> None:
+        tail = self.log_path.read_text(errors="replace")[-2000:]
+        raise RuntimeError(
+            f"{self.name} exited with {self._process.returncode}, log {self.log_path}:\n{tail}"
+        )
+
+    def check(self) -> None:
+        """Долгоживущий процесс не должен завершаться."""
+        if self._process and self._process.poll() is not None:
+            self._fail()
+
+    def run(self, timeout: float = START_TIMEOUT) -> None:
+        """Для разовых процессов (схема): ждёт завершения и проверяет код выхода."""
+        self.start()
+        if self._process.wait(timeout=timeout) != 0:
+            self._fail()
+
+    def stop(self) -> None:
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+class Harness:
+    def __init__(self, telegram_latency: float = TELEGRAM_LATENCY) -> None:
+        log_dir = os.getenv("HARNESS_LOG_DIR")
+        self.log_dir = Path(log_dir or tempfile.mkdtemp(prefix="harness-logs-"))
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.telegram = FakeTelegram(latency=telegram_latency)
+        self.robokassa = FakeRobokassa(merchant_login=ROBO_LOGIN, password2=ROBO_PASSWORD_2)
+        self.cryptopay = FakeCryptoPay(token=CRYPTOBOT_TOKEN)
+        self.nats = LocalNats(self.log_dir)
+        self.postgres = LocalPostgres(self.log_dir)
+        self.web_url = ""
+        self.processes: list[ServiceProcess] = []
+        self._stack = ExitStack()
+        self._http = None
+
+    def _env(self, service_dir: Path, database_url: str) -> dict[str, str]:
+        env = dict(os.environ)
+        python_path = [str(service_dir), str(SERVICES_DIR)]
+        if env.get("PYTHONPATH"):
+            python_path.append(env["PYTHONPATH"])
+        env.update(
+            PYTHONPATH=os.pathsep.join(python_path),
+            PYTHONUNBUFFERED="1",
+            DATABASE_URL=database_url,
+            SQLALCHEMY_DATABASE_URI=database_url,
+            NATS_URL=self.nats.url,
+            TOKEN=BOT_TOKEN,
+            BOT_TOKEN=BOT_TOKEN,
+            CHANNEL_ID=str(CHANNEL_ID),
+            TELEGRAM_API_URL=self.telegram.api_url,
+            TARIFF_AMOUNT_KZT=TARIFF_AMOUNT,
+            ROBO_MERCHANT_LOGIN=ROBO_LOGIN,
+            ROBO_PASSWORD_1=ROBO_PASSWORD_1,
+            ROBO_PASSWORD_2=ROBO_PASSWORD_2,
+            ROBO_OPSTATE_URL=self.robokassa.opstate_url,
+            ROBO_ALLOWED_IPS="",
+            CRYPTOBOT_TOKEN=CRYPTOBOT_TOKEN,
+            CRYPTOBOT_API_URL=self.cryptopay.api_url,
+            INTERNAL_API_TOKEN=INTERNAL_API_TOKEN,
+            METRICS_PORT="0",
+        )
+        return env
+
+    def _service(self, name: str, args: list[str], cwd: Path,
+                 env: dict[str, str]) -> ServiceProcess:
+        process = ServiceProcess(name, args, cwd, env, self.log_dir)
+        self.processes.append(process)
+        return process
+
+    async def _wait_pulling(self, stream: str, durable: str) -> None:
+        """Процесс готов, когда на его durable-consumer висят pull-запросы."""
+        from nats.js.errors import NotFoundError
+
+        from common.nats_client import nats_manager
+
+        js = await nats_manager.jetstream()
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            for process in self.processes:
+                process.check()
+            try:
+                info = await js.consumer_info(stream, durable)
+                if info.num_waiting:
+                    return
+            except NotFoundError:
+                pass
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f"nobody pulls from {stream}/{durable} after {START_TIMEOUT}s")
+
+    async def __aenter__(self) -> "Harness":
+        try:
+            await self._start()
+        except BaseException:
+            await self.__aexit__(*sys.exc_info())
+            raise
+        return self
+
+    async def _start(self) -> None:
+        for fake in (self.telegram, self.robokassa, self.cryptopay):
+            self._stack.enter_context(fake)
+        self._stack.enter_context(self.nats)
+        self._stack.enter_context(self.postgres)
+
+        bot_env = self._env(BOT_DIR, self.postgres.driver_url("asyncpg"))
+        web_env = self._env(WEB_DIR, self.postgres.driver_url("psycopg2"))
+        # Код бота в этом процессе (сидирование, задачи, чтение результатов) —
+        # с тем же окружением; импортировать его можно только после этого.
+        os.environ.update(bot_env)
+
+        ServiceProcess(
+            "create_db", [sys.executable, "create_db.py"], BOT_DIR, bot_env, self.log_dir
+        ).run()
+
+        web_port = free_port()
+        web = self._service(
+            "web",
+            [sys.executable, "-m", "gunicorn", "--worker-class", "gthread",
+             "--workers", str(WEB_WORKERS), "--threads", str(WEB_THREADS),
+             "--bind", f"127.0.0.1:{web_port}", "manage:app"],
+            WEB_DIR, web_env,
+        ).start()
+        listener = self._service(
+            "listener",
+            [sys.executable, "-c",
+             "import asyncio\n"
+             "from modules.nats_listener import nats_listener\n"
+             "asyncio.run(nats_listener())"],
+            BOT_DIR, bot_env,
+        ).start()
+        worker = self._service(
+            "worker",
+            [sys.executable, "-m", "taskiq", "worker", "-fsd", "modules.tasks.broker:broker"],
+            BOT_DIR, bot_env,
+        ).start()
+
+        from common.nats_client import PAYMENTS_DURABLE, nats_manager
+        from modules.tasks.broker import broker
+
+        await nats_manager.connect()
+        await asyncio.to_thread(wait_for_port, web_port, START_TIMEOUT)
+        web.check()
+        await self._wait_pulling("payments", PAYMENTS_DURABLE)
+        listener.check()
+        await self._wait_pulling(broker.stream_name, broker.durable)
+        worker.check()
+        self.web_url = f"http://127.0.0.1:{web_port}"
+
+        import httpx
+
+        self._http = httpx.AsyncClient(
+            base_url=self.web_url,
+            timeout=30,
+            limits=httpx.Limits(max_connections=WEB_WORKERS * WEB_THREADS),
+        )
+
+    async def __aexit__(self, *exc) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+        for process in reversed(self.processes):
+            process.stop()
+        try:
+            from common.nats_client import nats_manager
+
+            await nats_manager.close()
+        except Exception:
+            pass
+        self._stack.close()
+
+    def describe(self) -> dict:
+        return {
+            "nats": "external" if os.getenv("HARNESS_NATS_URL") else "nats-server",
+            "postgres": "external" if os.getenv("HARNESS_DATABASE_URL") else "initdb",
+            "telegram_latency_ms": self.telegram.latency * 1000,
+            "web": f"gunicorn gthread {WEB_WORKERS}x{WEB_THREADS}",
+            "logs": str(self.log_dir),
+        }
+
+    # --- провайдеры → web ---
+
+    async def post_robokassa_result(self, payment_id: int, user_id: int, out_sum: str) -> int:
+        form = self.robokassa.result_form(payment_id, out_sum, {"Shp_user_id": str(user_id)})
+        response = await self._http.post("/payments/robokassa/result", data=form)
+        return response.status_code
+
+    async def post_cryptobot_webhook(self, invoice_id: int) -> int:
+        body, headers = self.cryptopay.paid_webhook(invoice_id)
+        response = await self._http.post("/payments/cryptobot/webhook", content=body,
+                                         headers=headers)
+        return response.status_code
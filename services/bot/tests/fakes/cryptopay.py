@@ -0,0 +1,163 @@
+"""
+Локальная заглушка Crypto Pay API (CryptoBot).
+
+Поднимает HTTP-сервер в отдельном потоке и отвечает на `getMe`/`createInvoice`/
+`getInvoices` в формате API, которого ждёт aiosend. Умеет подписывать webhook
+invoice_paid так же, как CryptoBot (заголовок `crypto-pay-api-signature`):
+
+    with FakeCryptoPay(token="123:abc") as fake:
+        os.environ["CRYPTOBOT_API_URL"] = fake.api_url
+        invoice = fake.add_invoice(amount="5000", payload="pay:42")
+        body, headers = fake.paid_webhook(invoice["invoice_id"])
+        ...
+"""
+import datetime as dt
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+
+def webhook_signature(token: str, body: bytes) -> str:
+    secret = hashlib.sha256(token.encode("utf-8")).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+class FakeCryptoPay:
+    def __init__(self, token: str, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.token = token
+        self.invoices: dict[int, dict] = {}
+        self.requests_count = 0
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def add_invoice(self, amount: str, fiat: str = "KZT", payload: str | None = None,
+                    description: str | None = None) -> dict:
+        with self._lock:
+            invoice_id = next(self._ids)
+            invoice = {
+                "invoice_id": invoice_id,
+                "hash": f"IV{invoice_id}",
+                "currency_type": "fiat",
+                "fiat": fiat,
+                "amount": str(amount),
+                "accepted_assets": ["TON"],
+                "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+                "mini_app_invoice_url": f"https://t.me/CryptoBot/app?startapp=IV{invoice_id}",
+                "web_app_invoice_url": f"https://app.send.tg/invoices/IV{invoice_id}",
+                "description": description,
+                "status": "active",
+                "created_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+                "allow_comments": True,
+                "allow_anonymous": True,
+                "payload": payload,
+            }
+            self.invoices[invoice_id] = invoice
+            return invoice
+
+    def pay(self, invoice_id: int) -> dict:
+        with self._lock:
+            invoice = self.invoices[invoice_id]
+            invoice.update(
+                status="paid",
+                paid_asset="TON",
+                paid_amount="1.5",
+                paid_at=dt.datetime.now(dt.timezone.utc).isoformat(),
+            )
+            return dict(invoice)
+
+    def paid_webhook(self, invoice_id: int) -> tuple[bytes, dict[str, str]]:
+        """Отмечает счёт оплаченным и возвращает подписанный webhook (тело, заголовки)."""
+        invoice = self.pay(invoice_id)
+        body = json.dumps({
+            "update_id": invoice_id,
+            "update_type": "invoice_paid",
+            "request_date": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "payload": invoice,
+        }).encode("utf-8")
+        headers = {
+            "Content-Type": "application/json",
+            "crypto-pay-api-signature": webhook_signature(self.token, body),
+        }
+        return body, headers
+
+    def handle(self, method: str, token: str, params: dict) -> tuple[int, dict]:
+        with self._lock:
+            self.requests_count += 1
+        if token != self.token:
+            return 401, {"ok": False, "error": {"code": 401, "name": "UNAUTHORIZED"}}
+
+        if method == "getMe":
+            # aiosend проверяет токен GET-запросом getMe прямо в конструкторе CryptoPay.
+            return 200, {"ok": True, "result": {
+                "app_id": 1, "name": "FakeApp", "payment_processing_bot_username": "CryptoBot",
+            }}
+        if method == "createInvoice":
+            invoice = self.add_invoice(
+                amount=str(params.get("amount")),
+                fiat=params.get("fiat") or "KZT",
+                payload=params.get("payload"),
+                description=params.get("description"),
+            )
+            return 200, {"ok": True, "result": invoice}
+        if method == "getInvoices":
+            raw_ids = str(params.get("invoice_ids") or "")
+            ids = {int(i) for i in raw_ids.split(",") if i.strip()}
+            with self._lock:
+                items = [dict(inv) for inv_id, inv in self.invoices.items()
+                         if not ids or inv_id in ids]
+            return 200, {"ok": True, "result": {"items": items}}
+        return 400, {"ok": False, "error": {"code": 400, "name": "METHOD_NOT_FOUND"}}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                params = json.loads(raw) if raw else {}
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                token = self.headers.get("Crypto-Pay-API-Token") or ""
+                status, body = fake.handle(method, token, params)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeCryptoPay":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeCryptoPay":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,158 @@
+"""
+Локальная заглушка Robokassa OpStateExt.
+
+Поднимает HTTP-сервер в отдельном потоке и отвечает XML в формате
+OperationStateResponse. Используется, чтобы прогонять
+`payments_reconcile_robokassa_pending` без обращения к боевому API:
+
+    with FakeRobokassa(merchant_login="shop", password2="pass2") as fake:
+        fake.set_state(inv_id=42, state_code=100, out_sum="5000.00", shp_user_id=1)
+        os.environ["ROBO_OPSTATE_URL"] = fake.opstate_url
+        ...
+
+`result_form` собирает подписанный ResultURL-callback, как его шлёт Robokassa в web.
+"""
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+from modules.payments.robokassa import (
+    RESULT_INVOICE_NOT_FOUND,
+    RESULT_OK,
+    _hash_hexdigest,
+    opstate_signature,
+)
+
+
+NAMESPACE = "http://merchant.roboxchange.com/WebService/"
+RESULT_BAD_SIGNATURE = 1
+
+
+@dataclass
+class _InvoiceState:
+    state_code: int
+    out_sum: str
+    shp_user_id: int | None = None
+
+
+class FakeRobokassa:
+    def __init__(self, merchant_login: str, password2: str,
+                 host: str = "127.0.0.1", port: int = 0) -> None:
+        self.merchant_login = merchant_login
+        self.password2 = password2
+        self.invoices: dict[int, _InvoiceState] = {}
+        # Result.Code вместо состояния счёта (ошибки OpState)
+        self.results: dict[int, str] = {}
+        self.requests_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def opstate_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/Merchant/WebService/Service.asmx/OpStateExt"
+
+    def set_state(self, inv_id: int, state_code: int, out_sum: str,
+                  shp_user_id: int | None = None) -> None:
+        self.invoices[inv_id] = _InvoiceState(state_code, out_sum, shp_user_id)
+
+    def set_result(self, inv_id: int, code: int | str) -> None:
+        """Ответ только с Result.Code: 1 — подпись, 1000 — внутренняя ошибка, не число — мусор."""
+        self.results[inv_id] = str(code)
+
+    def result_form(self, inv_id: int, out_sum: str, shp: dict[str, str] | None = None,
+                    state_code: int = 100) -> dict[str, str]:
+        """Форма ResultURL: OutSum:InvId:Password#2[:Shp_key=value...] по алфавиту Shp_*."""
+        shp = shp or {}
+        self.set_state(inv_id, state_code, out_sum,
+                       shp_user_id=int(shp["Shp_user_id"]) if "Shp_user_id" in shp else None)
+        tail = [f"{key}={shp[key]}" for key in sorted(shp, key=str.lower)]
+        signature = _hash_hexdigest(":".join([out_sum, str(inv_id), self.password2, *tail]))
+        return {"OutSum": out_sum, "InvId": str(inv_id), "SignatureValue": signature, **shp}
+
+    def render(self, params: dict[str, str]) -> str:
+        with self._lock:
+            self.requests_count += 1
+
+        try:
+            inv_id = int(params.get("InvoiceID", ""))
+        except ValueError:
+            return self._result_only(RESULT_INVOICE_NOT_FOUND)
+
+        expected = opstate_signature(self.merchant_login, inv_id, self.password2)
+        if params.get("MerchantLogin") != self.merchant_login or \
+                params.get("Signature", "").lower() != expected:
+            return self._result_only(RESULT_BAD_SIGNATURE)
+
+        if inv_id in self.results:
+            return self._result_only(self.results[inv_id])
+
+        invoice = self.invoices.get(inv_id)
+        if invoice is None:
+            return self._result_only(RESULT_INVOICE_NOT_FOUND)
+
+        user_field = ""
+        if invoice.shp_user_id is not None:
+            user_field = (
+                "<UserField><Field><Name>shp_user_id</Name>"
+                f"<Value>{invoice.shp_user_id}</Value></Field></UserField>"
+            )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<OperationStateResponse xmlns="{NAMESPACE}">'
+            f"<Result><Code>{RESULT_OK}</Code></Result>"
+            f"<State><Code>{invoice.state_code}</Code>"
+            "<RequestDate>2024-01-01T00:00:00+03:00</RequestDate>"
+            "<StateDate>2024-01-01T00:00:00+03:00</StateDate></State>"
+            "<Info><IncCurrLabel>BankCard</IncCurrLabel>"
+            f"<IncSum>{escape(invoice.out_sum)}</IncSum>"
+            f"<OutCurrLabel>KZT</OutCurrLabel><OutSum>{escape(invoice.out_sum)}</OutSum>"
+            "</Info>"
+            f"{user_field}"
+            "</OperationStateResponse>"
+        )
+
+    def _result_only(self, code: int | str) -> str:
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<OperationStateResponse xmlns="{NAMESPACE}">'
+            f"<Result><Code>{code}</Code><Description>fake</Description></Result>"
+            "</OperationStateResponse>"
+        )
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                params = {k: v[0] for k, v in query.items()}
+                body = fake.render(params).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeRobokassa":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeRobokassa":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,273 @@
+"""
+Локальная заглушка Telegram Bot API.
+
+Поднимает HTTP-сервер в отдельном потоке, принимает `/bot<token>/<method>`
+и отвечает `{"ok": true, "result": ...}` с минимально нужными полями.
+`latency` имитирует задержку Telegram, `calls` хранит вызовы по методам,
+`times` — время (time.time()) каждого вызова, `uploaded_bytes` — объём файлов,
+пришедших в multipart-запросах. На отправку файла отвечает сообщением с
+вложением и file_id, который можно передать вместо файла повторно:
+
+    with FakeTelegram(latency=0.05) as fake:
+        os.environ["TELEGRAM_API_URL"] = fake.api_url
+        ...
+        assert fake.count("sendMessage") == 1000
+"""
+import json
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs
+
+
+# метод отправки -> (поле сообщения, поля вложения помимо file_id)
+MEDIA_METHODS = {
+    "sendPhoto": ("photo", {"width": 1280, "height": 720}),
+    "sendVideo": ("video", {"width": 1280, "height": 720, "duration": 1}),
+    "sendVideoNote": ("video_note", {"length": 240, "duration": 1}),
+    "sendAnimation": ("animation", {"width": 320, "height": 240, "duration": 1}),
+    "sendVoice": ("voice", {"duration": 1}),
+    "sendAudio": ("audio", {"duration": 1}),
+    "sendDocument": ("document", {}),
+}
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_bot",
+}
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.latency = latency
+        self.calls: dict[str, list[dict]] = defaultdict(list)
+        self.times: dict[str, list[float]] = defaultdict(list)
+        # method -> chat_id -> код ошибки (403/400/429) для имитации отказов
+        self.failures: dict[str, dict[int, tuple[int, str]]] = defaultdict(dict)
+        # method -> chat_id -> сколько раз ещё отвечать ошибкой (нет записи — всегда)
+        self._failures_left: dict[str, dict[int, int]] = defaultdict(dict)
+        # method -> [(доля chat_id, код, описание, только первый вызов)]
+        self._share_failures: dict[str, list[tuple[float, int, str, bool]]] = defaultdict(list)
+        self._failed_once: set[tuple[str, int, int]] = set()
+        self.uploaded_bytes = 0
+        self._counts: Counter = Counter()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, method: str) -> int:
+        with self._lock:
+            return self._counts[method]
+
+    def fail(self, method: str, chat_id: int, code: int, description: str,
+             times: int | None = None) -> None:
+        """Ответ ошибкой на вызовы method для chat_id: всегда или первые `times` раз."""
+        self.failures[method][int(chat_id)] = (code, description)
+        if times is not None:
+            self._failures_left[method][int(chat_id)] = times
+
+    def fail_share(self, method: str, share: float, code: int, description: str,
+                   once: bool = False) -> None:
+        """
+        Ответ ошибкой для доли `share` пользователей, когда их id заранее
+        неизвестны (пробный запуск рассылки). Выбор chat_id детерминирован;
+        once — ошибка только на первый вызов для chat_id (например, 429).
+        """
+        self._share_failures[method].append((share, code, description, once))
+
+    def parse_multipart(self, content_type: str, raw: bytes) -> dict:
+        """Поля multipart-запроса; вместо файлов — `attach://<имя>`, их объём в uploaded_bytes."""
+        header = f"Content-Type: {content_type}\r\n\r\n".encode("latin-1")
+        message = BytesParser(policy=HTTP).parsebytes(header + raw)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename() is None:
+                params[name] = payload.decode("utf-8")
+                continue
+            with self._lock:
+                self.uploaded_bytes += len(payload)
+            params[name] = f"attach://{name}"
+        return params
+
+    def _attachment(self, media, extra: dict) -> dict:
+        # Переданный file_id возвращается как есть, загруженный файл получает новый.
+        if isinstance(media, str) and media and not media.startswith("attach://"):
+            file_id = media
+        else:
+            file_id = f"fake-file-{next(self._ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id, **extra}
+
+    def _message(self, chat_id, now: int, text: str = "") -> dict:
+        return {
+            "message_id": next(self._ids),
+            "date": now,
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "text": text,
+        }
+
+    def _result(self, method: str, params: dict):
+        now = int(time.time())
+        chat_id = params.get("chat_id")
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return []
+        if method == "createChatInviteLink":
+            return {
+                "invite_link": f"https://t.me/+fake{next(self._ids)}",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "expire_date": int(params.get("expire_date") or now),
+                "member_limit": int(params.get("member_limit") or 1),
+            }
+        if method == "revokeChatInviteLink":
+            return {
+                "invite_link": params.get("invite_link") or "",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": True,
+            }
+        if method in MEDIA_METHODS:
+            field, extra = MEDIA_METHODS[method]
+            message = self._message(chat_id, now)
+            attachment = self._attachment(params.get(field), extra)
+            message[field] = [attachment] if field == "photo" else attachment
+            return message
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            if isinstance(media, str):
+                media = json.loads(media)
+            messages = []
+            for item in media:
+                field = item.get("type") or "document"
+                extra = MEDIA_METHODS.get(f"send{field.title().replace('_', '')}", (field, {}))[1]
+                message = self._message(chat_id, now)
+                attachment = self._attachment(item.get("media"), extra)
+                message[field] = [attachment] if field == "photo" else attachment
+                messages.append(message)
+            return messages or [self._message(chat_id, now)]
+        if method == "copyMessages":
+            message_ids = params.get("message_ids") or []
+            if isinstance(message_ids, str):
+                message_ids = json.loads(message_ids)
+            return [{"message_id": next(self._ids)} for _ in message_ids]
+        if method in ("sendMessage", "copyMessage", "forwardMessage"):
+            message = self._message(chat_id, now, params.get("text") or "")
+            if method == "copyMessage":
+                return {"message_id": message["message_id"]}
+            return message
+        # banChatMember, unbanChatMember и т.п.
+        return True
+
+    def _take_failure(self, method: str, chat_id: int) -> tuple[int, str] | None:
+        with self._lock:
+            failure = self.failures.get(method, {}).get(chat_id)
+            left = self._failures_left.get(method, {})
+            if failure and chat_id in left:
+                left[chat_id] -= 1
+                if left[chat_id] <= 0:
+                    del left[chat_id]
+                    del self.failures[method][chat_id]
+            if failure:
+                return failure
+            # доля считается только среди пользователей: каналы и группы (id < 0) не падают
+            shares = self._share_failures.get(method, ()) if chat_id > 0 else ()
+            for index, (share, code, description, once) in enumerate(shares):
+                if zlib.crc32(f"{index}:{chat_id}".encode()) / 2 ** 32 >= share:
+                    continue
+                if once:
+                    key = (method, index, chat_id)
+                    if key in self._failed_once:
+                        continue
+                    self._failed_once.add(key)
+                return code, description
+            return None
+
+    def handle(self, method: str, params: dict) -> tuple[int, dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._counts[method] += 1
+            self.calls[method].append(params)
+            self.times[method].append(time.time())
+
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            failure = self._take_failure(method, int(chat_id))
+            if failure:
+                code, description = failure
+                body = {"ok": False, "error_code": code, "description": description}
+                if code == 429:
+                    body["parameters"] = {"retry_after": 1}
+                return code, body
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят разными send(): без TCP_NODELAY keep-alive
+            # соединение ловит задержку Nagle + delayed ACK (~40 мс на вызов).
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type") or ""
+                if "application/json" in content_type and raw:
+                    params = json.loads(raw)
+                elif "multipart/form-data" in content_type:
+                    params = fake.parse_multipart(content_type, raw)
+                else:
+                    params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                status, body = fake.handle(method, params)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeTelegram":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeTelegram":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
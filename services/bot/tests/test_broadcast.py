@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from telegram.error import NetworkError, RetryAfter
+
+from common.broadcast import SENT, TRANSIENT, BroadcastEngine
+
+
+class NoLimit:
+    def __init__(self) -> None:
+        self.pauses: list[float] = []
+
+    async def acquire(self) -> None:
+        pass
+
+    async def pause(self, seconds: float) -> None:
+        self.pauses.append(seconds)
+
+
+_real_sleep = asyncio.sleep
+
+
+async def _no_sleep(delay, *args):
+    await _real_sleep(0)
+
+
+def _engine(send, **kwargs) -> BroadcastEngine:
+    return BroadcastEngine(send, limiter=NoLimit(), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_retry_after_does_not_use_attempts():
+    floods = {1: 4}
+    results = []
+
+    async def send(chat_id):
+        if floods[chat_id]:
+            floods[chat_id] -= 1
+            raise RetryAfter(1)
+        return "ok"
+
+    engine = _engine(send, max_attempts=1, max_flood_waits=10,
+                     on_result=lambda *args: results.append(args))
+    summary = await engine.run([1])
+
+    assert results == [(1, SENT, "ok", 5)]
+    assert summary.flood_waits == 4
+    assert engine.limiter.pauses == [1, 1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_has_own_cap():
+    results = []
+
+    async def send(chat_id):
+        raise RetryAfter(1)
+
+    summary = await _engine(
+        send, max_attempts=5, max_flood_waits=3, on_result=lambda *args: results.append(args)
+    ).run([1])
+
+    [(chat_id, outcome, error, attempts)] = results
+    assert (chat_id, outcome, attempts) == (1, TRANSIENT, 3)
+    assert isinstance(error, RetryAfter)
+    assert summary.transient == 1
+
+
+@pytest.mark.asyncio
+async def test_network_errors_use_attempts(monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep)
+    results = []
+
+    async def send(chat_id):
+        raise NetworkError("timeout")
+
+    await _engine(send, max_attempts=2, on_result=lambda *args: results.append(args)).run([1])
+
+    assert [(r[1], r[3]) for r in results] == [(TRANSIENT, 2)]
+
+
+@pytest.mark.asyncio
+async def test_on_result_error_stops_run():
+    async def send(chat_id):
+        return chat_id
+
+    async def on_result(chat_id, outcome, result, attempts):
+        if chat_id == 3:
+            raise RuntimeError("ledger is down")
+
+    engine = _engine(send, concurrency=2, on_result=on_result)
+    with pytest.raises(RuntimeError, match="ledger is down"):
+        # Получателей заметно больше очереди: без контроля отправителей производитель
+        # навсегда повис бы на queue.put.
+        await asyncio.wait_for(engine.run(range(1, 1000)), timeout=5)
+
+
+@pytest.mark.asyncio
+async def test_all_recipients_delivered():
+    delivered = []
+
+    async def send(chat_id):
+        await asyncio.sleep(0)
+        delivered.append(chat_id)
+
+    summary = await _engine(send, concurrency=4).run(range(100))
+
+    assert sorted(delivered) == list(range(100))
+    assert summary.sent == 100
@@ -0,0 +1,92 @@
+import asyncio
+import datetime as dt
+import json
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select
+from telegram import Bot
+
+from common.broadcast import TokenBucket
+from common.models.users_models import SendMessageCampaign
+from core.database.database import engine
+from core.database.uow import SqlAlchemyUoW
+from modules.campaign import message_campaign, services
+from modules.campaign.services import CampaignService
+from tests.fakes.telegram import FakeTelegram
+
+
+UPLOAD_CHAT_ID = 777
+FILE_SIZE = 20_000
+
+
+@pytest_asyncio.fixture
+async def campaigns():
+    try:
+        async with engine.connect():
+            pass
+    except Exception as exc:
+        pytest.skip(f"database is not available: {exc}")
+    campaign_ids = []
+    yield campaign_ids
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            delete(SendMessageCampaign).where(SendMessageCampaign.id.in_(campaign_ids))
+        )
+        await uow.commit()
+    await engine.dispose()
+
+
+@pytest.fixture
+def telegram(monkeypatch, tmp_path):
+    (tmp_path / "pic.jpg").write_bytes(b"x" * FILE_SIZE)
+    monkeypatch.setattr(message_campaign, "STATIC_FOLDER", str(tmp_path))
+    monkeypatch.setattr(services, "CAMPAIGN_UPLOAD_CHAT_ID", UPLOAD_CHAT_ID)
+    monkeypatch.setattr(services, "CAMPAIGN_SHARD_SIZE", 20)
+    with FakeTelegram() as fake:
+        yield fake
+
+
+async def _campaign(campaign_ids: list[int], user_ids: list[int]) -> tuple[int, list[int]]:
+    async with SqlAlchemyUoW() as uow:
+        campaign_id = await uow.campaign_repo.add(
+            name="files", text="hi", status="Новая", date=dt.datetime.now(),
+            files="['pic.jpg']", send_post=False, preview=False,
+        )
+        campaign_ids.append(campaign_id)
+        shard_ids = await CampaignService(uow).plan(campaign_id, user_ids)
+        await uow.commit()
+    return campaign_id, shard_ids
+
+
+@pytest.mark.asyncio
+async def test_attachments_uploaded_once_per_campaign(campaigns, telegram):
+    campaign_id, shard_ids = await _campaign(campaigns, list(range(1, 101)))
+    assert len(shard_ids) == 5
+
+    async def send_shard(shard_id):
+        async with SqlAlchemyUoW() as uow:
+            return await CampaignService(uow).send_shard(bot, shard_id, TokenBucket(1000))
+
+    bot = Bot("1:x", base_url=f"{telegram.api_url}/bot")
+    async with bot:
+        summaries = await asyncio.gather(*(send_shard(shard_id) for shard_id in shard_ids))
+
+    assert sum(summary.sent for summary in summaries) == 100
+    assert telegram.uploaded_bytes == FILE_SIZE
+    calls = telegram.calls["sendPhoto"]
+    assert calls[0]["chat_id"] == str(UPLOAD_CHAT_ID)
+    assert len(calls) == 101
+    async with SqlAlchemyUoW() as uow:
+        file_ids = await uow.session.scalar(
+            select(SendMessageCampaign.file_ids).where(SendMessageCampaign.id == campaign_id)
+        )
+    assert len(json.loads(file_ids)) == 1
+
+
+@pytest.mark.asyncio
+async def test_attachments_require_upload_chat(campaigns, telegram, monkeypatch):
+    monkeypatch.setattr(services, "CAMPAIGN_UPLOAD_CHAT_ID", None)
+
+    with pytest.raises(ValueError, match="CAMPAIGN_UPLOAD_CHAT_ID"):
+        await _campaign(campaigns, [1, 2, 3])
@@ -0,0 +1,124 @@
+import datetime as dt
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, func, insert, select
+
+from common.models.campaigns_models import CampaignShard
+from common.models.users_models import SendMessageCampaign, User, user_campaign
+from core.database.database import engine
+from core.database.uow import SqlAlchemyUoW
+from modules.campaign import services
+from modules.campaign.services import CampaignService
+
+
+USER_BASE = 9_400_000_000
+
+@pytest_asyncio.fixture
+async def campaigns():
+    try:
+        async with engine.connect():
+            pass
+    except Exception as exc:
+        pytest.skip(f"database is not available: {exc}")
+    campaign_ids = []
+    yield campaign_ids
+    async with SqlAlchemyUoW() as uow:
+        await uow.session.execute(
+            delete(SendMessageCampaign).where(SendMessageCampaign.id.in_(campaign_ids))
+        )
+        await uow.commit()
+    await engine.dispose()
+
+
+async def _campaign(uow, campaign_ids: list[int]) -> int:
+    campaign_id = await uow.campaign_repo.add(
+        name="plan", text="hi", status="Новая", date=dt.datetime.now(),
+        send_post=False, preview=False,
+    )
+    campaign_ids.append(campaign_id)
+    return campaign_id
+
+
+@pytest.mark.asyncio
+async def test_plan_inserts_shards_beyond_bind_parameter_limit(campaigns, monkeypatch):
+    # 10 000 шардов по 6 колонок — больше 32767 параметров в одном INSERT
+    monkeypatch.setattr(services, "CAMPAIGN_SHARD_SIZE", 1)
+    user_ids = list(range(1, 10_001))
+
+    async with SqlAlchemyUoW() as uow:
+        campaign_id = await _campaign(uow, campaigns)
+        shard_ids = await CampaignService(uow).plan(campaign_id, user_ids)
+        await uow.commit()
+
+    assert len(shard_ids) == len(user_ids)
+    async with SqlAlchemyUoW() as uow:
+        count = await uow.session.scalar(
+            select(func.count()).where(CampaignShard.campaign_id == campaign_id)
+        )
+    assert count == len(user_ids)
+
+
+@pytest.mark.asyncio
+async def test_plan_skips_blocked_in_large_user_list(campaigns):
+    # 40 000 id — больше 32767 параметров, если бы каждый id был отдельным параметром
+    user_ids = list(range(USER_BASE, USER_BASE + 40_000))
+    blocked = user_ids[::1000]
+    now = dt.datetime.now(dt.timezone.utc)
+    try:
+        async with SqlAlchemyUoW() as uow:
+            await uow.session.execute(
+                insert(User), [{"user_id": uid, "first_name": "plan"} for uid in blocked]
+            )
+            assert await uow.user_repo.mark_blocked(blocked, now=now) == len(blocked)
+            campaign_id = await _campaign(uow, campaigns)
+            await CampaignService(uow).plan(campaign_id, user_ids)
+            await uow.commit()
+
+        async with SqlAlchemyUoW() as uow:
+            recipients = await uow.session.scalar(
+                select(func.sum(CampaignShard.recipients))
+                .where(CampaignShard.campaign_id == campaign_id)
+            )
+            planned = await uow.session.scalar(
+                select(func.sum(func.cardinality(CampaignShard.user_ids)))
+                .where(CampaignShard.campaign_id == campaign_id)
+            )
+        assert recipients == planned == len(user_ids) - len(blocked)
+    finally:
+        async with SqlAlchemyUoW() as uow:
+            await uow.session.execute(delete(User).where(User.user_id.in_(blocked)))
+            await uow.commit()
+
+
+@pytest.mark.asyncio
+async def test_resume_plans_campaign_without_shards(campaigns):
+    # campaign.send не дошло до бота: кампания есть, шардов нет
+    user_ids = list(range(USER_BASE, USER_BASE + 3))
+    try:
+        async with SqlAlchemyUoW() as uow:
+            await uow.session.execute(
+                insert(User), [{"user_id": uid, "first_name": "plan"} for uid in user_ids]
+            )
+            campaign_id = await _campaign(uow, campaigns)
+            await uow.session.execute(
+                insert(user_campaign),
+                [{"user_id": uid, "campaign_id": campaign_id} for uid in user_ids],
+            )
+            await uow.commit()
+
+        async with SqlAlchemyUoW() as uow:
+            shard_ids = await CampaignService(uow).resume(campaign_id)
+            await uow.commit()
+
+        assert len(shard_ids) == 1
+        async with SqlAlchemyUoW() as uow:
+            shard = await uow.session.get(CampaignShard, shard_ids[0])
+        assert (shard.audience, shard.recipients) == ("send_to", len(user_ids))
+    finally:
+        async with SqlAlchemyUoW() as uow:
+            await uow.session.execute(
+                delete(user_campaign).where(user_campaign.c.user_id.in_(user_ids))
+            )
+            await uow.session.execute(delete(User).where(User.user_id.in_(user_ids)))
+            await uow.commit()
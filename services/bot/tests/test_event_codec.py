@@ -0,0 +1,116 @@
+import datetime as dt
+import json
+
+import pytest
+
+from common import event_codec
+from common.event_codec import (
+    CT_JSON,
+    CT_PACKED,
+    H_CHUNK_COUNT,
+    H_CHUNK_INDEX,
+    H_CONTENT_TYPE,
+    H_EVENT_ID,
+    EventDecodeError,
+    decode_event,
+    encode_event,
+    pack_ids,
+    unpack_ids,
+)
+from common.events import PaymentSucceededEvent, SendCampaignEvent
+
+
+def _roundtrip(event, max_bytes=event_codec.MAX_PAYLOAD_BYTES):
+    return [decode_event("campaign.send", data, headers)
+            for data, headers in encode_event(event, max_bytes=max_bytes)]
+
+
+@pytest.fixture
+def packed(monkeypatch):
+    """Упаковывать списки любой длины, чтобы проверять packed-формат на коротких списках."""
+    monkeypatch.setattr(event_codec, "PACK_THRESHOLD", 0)
+
+
+@pytest.mark.parametrize("ids", [
+    [],
+    [42],
+    [7, 3, 3, 10, -5, 7],
+    [2 ** 63 - 1, 0, -(2 ** 63)],
+])
+def test_pack_ids_roundtrip(ids):
+    assert unpack_ids(pack_ids(ids)) == ids
+
+
+@pytest.mark.parametrize("ids", [[], [42], [900, 5, 5, 17, 5]])
+def test_json_roundtrip(ids):
+    event = SendCampaignEvent(campaign_id=1, user_ids=ids)
+
+    [(data, headers)] = encode_event(event)
+
+    assert headers[H_CONTENT_TYPE] == CT_JSON
+    assert decode_event("campaign.send", data, headers) == event
+
+
+@pytest.mark.parametrize("ids", [[], [42], [900, 5, 5, 17, 5]])
+def test_packed_roundtrip(packed, ids):
+    event = SendCampaignEvent(campaign_id=1, action="retry", user_ids=ids, text="привет")
+
+    [(data, headers)] = encode_event(event)
+
+    assert headers[H_CONTENT_TYPE] == CT_PACKED
+    assert decode_event("campaign.send", data, headers) == event
+
+
+def test_payload_at_limit_is_not_chunked(packed):
+    event = SendCampaignEvent(campaign_id=1, user_ids=list(range(0, 30_000, 3)))
+    [(data, headers)] = encode_event(event)
+
+    [(same, same_headers)] = encode_event(event, max_bytes=len(data))
+
+    assert same == data
+    assert H_CHUNK_COUNT not in same_headers
+
+
+def test_chunks_roundtrip(packed):
+    ids = [(i * 7919) % 100_003 for i in range(50_000)]
+    event = SendCampaignEvent(campaign_id=5, action="resume", user_ids=ids)
+    [(data, _)] = encode_event(event)
+    max_bytes = len(data) - 1
+
+    chunks = encode_event(event, max_bytes=max_bytes)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= max_bytes for chunk, _ in chunks)
+    assert len({headers[H_EVENT_ID] for _, headers in chunks}) == 1
+    assert [headers[H_CHUNK_INDEX] for _, headers in chunks] == [
+        str(i) for i in range(len(chunks))
+    ]
+    assert {headers[H_CHUNK_COUNT] for _, headers in chunks} == {str(len(chunks))}
+
+    decoded = _roundtrip(event, max_bytes=max_bytes)
+    assert [part for chunk in decoded for part in chunk.user_ids] == ids
+    assert {(chunk.campaign_id, chunk.action) for chunk in decoded} == {(5, "resume")}
+
+
+def test_legacy_campaign_without_headers():
+    data = json.dumps({"campaign_id": 3, "user_ids": [5, 1, 5]}).encode()
+
+    event = decode_event("campaign.send", data, None)
+
+    assert event == SendCampaignEvent(campaign_id=3, user_ids=[5, 1, 5])
+
+
+def test_legacy_partitioned_payment_without_headers():
+    paid_at = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    legacy = PaymentSucceededEvent(
+        payment_id=1, user_id=2, provider="robokassa", amount="5000", currency="RUB",
+        paid_at=paid_at,
+    )
+
+    assert decode_event("payment.succeeded.3", legacy.model_dump_json().encode(), {}) == legacy
+    assert decode_event("payment.succeeded", legacy.model_dump_json().encode()) == legacy
+
+
+def test_unknown_subject_without_headers():
+    with pytest.raises(EventDecodeError):
+        decode_event("unknown.subject", b"{}")
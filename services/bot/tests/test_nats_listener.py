@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from nats.errors import TimeoutError as NatsTimeoutError
+
+import main
+from modules.nats_listener import PullConsumer
+
+
+class FakePullSubscription:
+    def __init__(self, msgs: list[str]) -> None:
+        self.msgs = msgs
+
+    async def fetch(self, batch: int, timeout: float) -> list[str]:
+        if not self.msgs:
+            await asyncio.sleep(timeout)
+            raise NatsTimeoutError
+        taken, self.msgs = self.msgs[:batch], self.msgs[batch:]
+        return taken
+
+
+def _listener(consumer: PullConsumer, timeout: float) -> asyncio.Task:
+    """Как nats_listener: при отмене дренирует consumer."""
+    async def listener():
+        try:
+            await consumer.run()
+        except asyncio.CancelledError:
+            await consumer.drain(timeout=timeout)
+            raise
+
+    return asyncio.create_task(listener())
+
+
+@pytest.mark.asyncio
+async def test_stop_listener_waits_for_in_flight_messages():
+    started, acked = [], []
+
+    async def handler(msg):
+        started.append(msg)
+        await asyncio.sleep(0.2)
+        acked.append(msg)
+
+    consumer = PullConsumer(
+        FakePullSubscription(["a", "b", "c"]), handler, concurrency=2, batch=2, fetch_timeout=0.05
+    )
+    listener = _listener(consumer, timeout=5)
+    while len(started) < 2:
+        await asyncio.sleep(0.01)
+
+    await main.stop_listener(listener)
+
+    assert listener.cancelled()
+    assert acked == ["a", "b"]
+    # Новые сообщения после остановки не забираются.
+    assert started == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_stop_listener_cancels_handlers_after_timeout():
+    started = []
+
+    async def handler(msg):
+        started.append(msg)
+        await asyncio.sleep(10)
+
+    consumer = PullConsumer(
+        FakePullSubscription(["a"]), handler, concurrency=1, batch=1, fetch_timeout=0.05
+    )
+    listener = _listener(consumer, timeout=0.1)
+    while not started:
+        await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(main.stop_listener(listener), timeout=2)
+
+    assert not consumer._tasks
@@ -0,0 +1,43 @@
+import datetime as dt
+import gzip
+import json
+import logging
+
+import pytest
+
+from common.models.payments_models import PaymentCallback
+from modules.tasks import tasks
+
+
+def test_write_callbacks_archive(tmp_path):
+    created_at = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    rows = [
+        PaymentCallback(id=i, payment_id=10 + i, source="robokassa_result",
+                        payload={"OutSum": "5000.00", "comment": "оплата"}, created_at=created_at)
+        for i in (1, 2)
+    ]
+    path = tmp_path / "payment_callbacks" / "payment_callbacks_1-2.jsonl.gz"
+
+    tasks._write_callbacks_archive(str(path), rows)
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["id"] for line in lines] == [1, 2]
+    assert lines[0]["payload"] == {"OutSum": "5000.00", "comment": "оплата"}
+    assert lines[0]["created_at"] == created_at.isoformat()
+    assert [p.name for p in path.parent.iterdir()] == [path.name]
+
+
+@pytest.mark.asyncio
+async def test_archive_skipped_without_dir(monkeypatch, caplog):
+    monkeypatch.delenv("PAYMENT_CALLBACKS_ARCHIVE_DIR", raising=False)
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("database must not be touched")
+
+    monkeypatch.setattr(tasks, "SqlAlchemyUoW", forbidden)
+
+    with caplog.at_level(logging.WARNING):
+        await tasks.payment_callbacks_archive()
+
+    assert "PAYMENT_CALLBACKS_ARCHIVE_DIR is not set" in caplog.text
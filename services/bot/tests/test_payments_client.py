@@ -0,0 +1,134 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from common.nats_client import NatsManager
+from modules.payments import client as payments_client_module
+from modules.payments.client import CircuitBreaker, PaymentsClient
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeWeb:
+    """web с эндпойнтом /payments/<provider>/create."""
+
+    def __init__(self) -> None:
+        self.requests: list[dict] = []
+        requests = self.requests
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                requests.append({"path": self.path, "body": body})
+                payload = json.dumps({"url": "https://pay.example/1"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self) -> "FakeWeb":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_create_falls_back_to_http_without_nats(monkeypatch):
+    # NATS не слушает: первое подключение не должно съесть весь бюджет запроса
+    manager = NatsManager(url=f"nats://127.0.0.1:{_free_port()}")
+    monkeypatch.setattr(payments_client_module, "nats_manager", manager)
+    monkeypatch.setenv("PAYMENTS_RPC_TIMEOUT", "2")
+
+    with FakeWeb() as web:
+        monkeypatch.setenv("WEB_BASE_URL", web.url)
+        client = PaymentsClient()
+        started = time.monotonic()
+
+        # без ограничения первого подключения create() повис бы навсегда
+        status, body = await asyncio.wait_for(client.create("robokassa", 42, "token"), 10)
+
+    assert (status, body) == (200, {"url": "https://pay.example/1"})
+    assert web.requests == [{"path": "/payments/robokassa/create", "body": {"user_id": 42}}]
+    assert time.monotonic() - started < 2
+    assert client.breaker.failures == 0
+
+
+def test_breaker_half_open_lets_one_probe_through(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(payments_client_module.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] += 31
+    assert breaker.is_half_open
+    assert [breaker.allow() for _ in range(3)] == [True, False, False]
+
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+
+    now[0] += 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert [breaker.allow() for _ in range(3)] == [True, True, True]
+
+
+def test_breaker_lost_probe_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(payments_client_module.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    now[0] += 31
+    assert breaker.allow()
+
+    now[0] += 31
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_half_open_callers_skip_nats_while_probing(monkeypatch):
+    with FakeWeb() as web:
+        monkeypatch.setenv("WEB_BASE_URL", web.url)
+        client = PaymentsClient()
+        client.breaker.opened_at = time.monotonic() - client.breaker.reset_timeout - 1
+        client.breaker.failures = client.breaker.failure_threshold
+        probe_started = asyncio.Event()
+        release_probe = asyncio.Event()
+
+        async def via_nats(*args):
+            probe_started.set()
+            await release_probe.wait()
+            return 200, {"url": "https://pay.example/nats"}
+
+        monkeypatch.setattr(client, "_via_nats", via_nats)
+        probe = asyncio.create_task(client.create("robokassa", 1, "token"))
+        await probe_started.wait()
+
+        others = await asyncio.gather(*(client.create("robokassa", uid, "token")
+                                        for uid in (2, 3)))
+        release_probe.set()
+
+        assert await probe == (200, {"url": "https://pay.example/nats"})
+    assert others == [(200, {"url": "https://pay.example/1"})] * 2
+    assert [r["body"]["user_id"] for r in web.requests] == [2, 3]
+    assert not client.breaker.is_open and client.breaker.allow()
@@ -0,0 +1,273 @@
+import datetime as dt
+import itertools
+import time
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select
+
+from common.models.payments_models import Payment, PaymentCallback
+from common.models.users_models import User
+from core.database.database import engine
+from core.database.uow import SqlAlchemyUoW
+from modules.payments.robokassa import (
+    RESULT_INVOICE_NOT_FOUND,
+    RESULT_OK,
+    STATE_INITIATED,
+    STATE_PAID,
+    parse_opstate,
+)
+from modules.tasks import tasks
+from tests.fakes.robokassa import NAMESPACE, FakeRobokassa
+
+
+MERCHANT_LOGIN = "shop"
+PASSWORD2 = "pass2"
+AMOUNT = Decimal("5000.00")
+
+_user_ids = itertools.count(9_600_000_000 + int(time.time()) % 1_000_000 * 100)
+
+
+def _response(state_code: int, out_sum: str = "5000.00", shp_user_id: int = None) -> str:
+    user_field = ""
+    if shp_user_id is not None:
+        user_field = (
+            "<UserField><Field><Name>shp_user_id</Name>"
+            f"<Value>{shp_user_id}</Value></Field></UserField>"
+        )
+    return (
+        f'<OperationStateResponse xmlns="{NAMESPACE}">'
+        f"<Result><Code>{RESULT_OK}</Code></Result>"
+        f"<State><Code>{state_code}</Code>"
+        "<StateDate>2024-01-01T00:00:00+03:00</StateDate></State>"
+        f"<Info><IncCurrLabel>BankCard</IncCurrLabel><OutSum>{out_sum}</OutSum></Info>"
+        f"{user_field}"
+        "</OperationStateResponse>"
+    )
+
+
+def test_parse_opstate_paid():
+    state = parse_opstate(42, _response(STATE_PAID, shp_user_id=7))
+
+    assert state.inv_id == 42
+    assert state.is_paid
+    assert not state.is_in_progress
+    assert state.out_sum == Decimal("5000.00")
+    assert state.user_fields == {"shp_user_id": "7"}
+    assert state.raw["inc_curr_label"] == "BankCard"
+
+
+def test_parse_opstate_pending():
+    state = parse_opstate(42, _response(STATE_INITIATED))
+
+    assert state.state_code == STATE_INITIATED
+    assert not state.is_paid
+    assert not state.is_in_progress
+    assert state.user_fields == {}
+
+
+def test_parse_opstate_unknown_state_code():
+    state = parse_opstate(42, _response(77))
+
+    assert state.state_code == 77
+    assert not state.is_paid
+    assert not state.is_in_progress
+
+
+def test_parse_opstate_invoice_not_found():
+    body = (
+        f'<OperationStateResponse xmlns="{NAMESPACE}">'
+        f"<Result><Code>{RESULT_INVOICE_NOT_FOUND}</Code></Result>"
+        "</OperationStateResponse>"
+    )
+    state = parse_opstate(42, body)
+
+    assert state.is_not_found
+    assert state.state_code is None
+    assert state.out_sum is None
+
+
+def test_parse_opstate_bad_values():
+    body = _response(STATE_PAID, out_sum="n/a").replace(
+        f"<Code>{RESULT_OK}</Code>", "<Code>ok</Code>"
+    )
+    state = parse_opstate(42, body)
+
+    assert state.result_code == -1
+    assert state.out_sum is None
+    assert not state.is_paid
+
+
+def test_parse_opstate_malformed_xml():
+    with pytest.raises(ET.ParseError):
+        parse_opstate(42, "<OperationStateResponse><Result>")
+
+
+@pytest_asyncio.fixture
+async def db():
+    try:
+        async with engine.connect():
+            pass
+    except Exception as exc:
+        pytest.skip(f"database is not available: {exc}")
+    user_ids = []
+    yield user_ids
+    async with SqlAlchemyUoW() as uow:
+        payment_ids = select(Payment.id).where(Payment.user_id.in_(user_ids))
+        await uow.session.execute(
+            delete(PaymentCallback).where(PaymentCallback.payment_id.in_(payment_ids))
+        )
+        await uow.session.execute(delete(Payment).where(Payment.user_id.in_(user_ids)))
+        await uow.session.execute(delete(User).where(User.user_id.in_(user_ids)))
+        await uow.commit()
+    # Engine привязан к циклу событий, а у каждого теста он свой.
+    await engine.dispose()
+
+
+@pytest.fixture
+def robokassa(monkeypatch):
+    with FakeRobokassa(merchant_login=MERCHANT_LOGIN, password2=PASSWORD2) as fake:
+        monkeypatch.setenv("ROBO_MERCHANT_LOGIN", MERCHANT_LOGIN)
+        monkeypatch.setenv("ROBO_PASSWORD_2", PASSWORD2)
+        monkeypatch.setenv("ROBO_OPSTATE_URL", fake.opstate_url)
+        monkeypatch.setenv("ROBO_RECONCILE_MIN_AGE_SECONDS", "60")
+        monkeypatch.setenv("ROBO_PENDING_TTL_SECONDS", "3600")
+        monkeypatch.setenv("ROBO_RECONCILE_LIMIT", "1000")
+        yield fake
+
+
+@pytest.fixture
+def published(monkeypatch):
+    events = []
+
+    async def publish(batch, stamps):
+        events.extend(batch)
+
+    monkeypatch.setattr(tasks, "_publish_payment_succeeded_events", publish)
+    return events
+
+
+async def _pending_payment(user_ids: list[int], age: dt.timedelta,
+                           amount: Decimal = AMOUNT) -> tuple[int, int]:
+    user_id = next(_user_ids)
+    user_ids.append(user_id)
+    created_at = dt.datetime.now(dt.timezone.utc) - age
+    async with SqlAlchemyUoW() as uow:
+        uow.session.add(User(user_id=user_id, first_name="reconcile"))
+        await uow.session.flush()
+        payment = Payment(
+            user_id=user_id, provider="robokassa", amount=amount, currency="RUB",
+            status="pending", created_at=created_at,
+        )
+        uow.session.add(payment)
+        await uow.commit()
+        return payment.id, user_id
+
+
+async def _cancel(payment_id: int) -> None:
+    async with SqlAlchemyUoW() as uow:
+        payment = await uow.session.get(Payment, payment_id)
+        payment.status = "canceled"
+        await uow.commit()
+
+
+async def _status(payment_id: int) -> str:
+    async with SqlAlchemyUoW() as uow:
+        return await uow.session.scalar(select(Payment.status).where(Payment.id == payment_id))
+
+
+@pytest.mark.asyncio
+async def test_reconcile_marks_paid_invoice(db, robokassa, published):
+    payment_id, user_id = await _pending_payment(db, age=dt.timedelta(minutes=5))
+    robokassa.set_state(payment_id, STATE_PAID, "5000.00", shp_user_id=user_id)
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "success"
+    assert [(e.payment_id, e.user_id) for e in published] == [(payment_id, user_id)]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_skips_amount_mismatch(db, robokassa, published):
+    payment_id, user_id = await _pending_payment(db, age=dt.timedelta(minutes=5))
+    robokassa.set_state(payment_id, STATE_PAID, "4999.00", shp_user_id=user_id)
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "pending"
+    assert published == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_skips_user_mismatch(db, robokassa, published):
+    payment_id, user_id = await _pending_payment(db, age=dt.timedelta(minutes=5))
+    robokassa.set_state(payment_id, STATE_PAID, "5000.00", shp_user_id=user_id + 1)
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "pending"
+    assert published == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_cancels_unpaid_after_ttl(db, robokassa, published):
+    expired_id, _ = await _pending_payment(db, age=dt.timedelta(hours=2))
+    fresh_id, _ = await _pending_payment(db, age=dt.timedelta(minutes=5))
+    robokassa.set_state(expired_id, STATE_INITIATED, "5000.00")
+    robokassa.set_state(fresh_id, STATE_INITIATED, "5000.00")
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(expired_id) == "canceled"
+    assert await _status(fresh_id) == "pending"
+    assert published == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_cancels_not_found_after_ttl(db, robokassa, published):
+    payment_id, _ = await _pending_payment(db, age=dt.timedelta(hours=2))
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "canceled"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("code", [1, 2, 1000, "n/a"])
+async def test_reconcile_keeps_pending_on_opstate_error(db, robokassa, published, code):
+    # неверный пароль, сбой Robokassa или неразобранный ответ (result_code -1)
+    # не повод отменять счёт — он мог быть оплачен
+    payment_id, _ = await _pending_payment(db, age=dt.timedelta(hours=2))
+    robokassa.set_result(payment_id, code)
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "pending"
+    assert published == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile_recovers_paid_canceled_invoice(db, robokassa, published):
+    # web отменил счёт, выдавая новый, а пользователь оплатил старую ссылку
+    payment_id, user_id = await _pending_payment(db, age=dt.timedelta(minutes=30))
+    await _cancel(payment_id)
+    robokassa.set_state(payment_id, STATE_PAID, "5000.00", shp_user_id=user_id)
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "success"
+    assert [e.payment_id for e in published] == [payment_id]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_leaves_unpaid_canceled_invoice(db, robokassa, published):
+    payment_id, _ = await _pending_payment(db, age=dt.timedelta(hours=2))
+    await _cancel(payment_id)
+    robokassa.set_state(payment_id, STATE_INITIATED, "5000.00")
+
+    await tasks.payments_reconcile_robokassa_pending()
+
+    assert await _status(payment_id) == "canceled"
+    assert published == []
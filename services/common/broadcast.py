@@ -0,0 +1,296 @@
+"""
+Движок массовой рассылки в Telegram.
+
+Пул из `concurrency` отправителей берёт получателей из общей очереди, перед
+каждым запросом получает токен у ограничителя (лимит Telegram на рассылку —
+около 30 сообщений в секунду на бота; `TokenBucket` — в пределах процесса,
+`SharedRateLimiter` — общий для всех воркеров через NATS KV) и разбирает ошибки:
+
+- `RetryAfter` — весь пул останавливается на указанное Telegram время, затем повтор;
+  такие повторы не расходуют `max_attempts`, у них свой предел `max_flood_waits`;
+- `Forbidden` (бот заблокирован, пользователь удалён) — BLOCKED, без повторов
+  (такие пользователи отмечаются в users.blocked_at, см. `is_unreachable`);
+- `BadRequest: chat not found` — NOT_FOUND, без повторов;
+- таймауты и сетевые ошибки — повтор с паузой, после `max_attempts` попыток — TRANSIENT;
+- прочее — FAILED.
+
+    engine = BroadcastEngine(lambda chat_id: bot.send_message(chat_id, text))
+    summary = await engine.run(user_ids)
+    logger.info("Campaign done: %s", summary.as_dict())
+
+Настройки: CAMPAIGN_RATE (сообщений в секунду, по умолчанию 30),
+CAMPAIGN_CONCURRENCY (по умолчанию 20), CAMPAIGN_MAX_ATTEMPTS (по умолчанию 3),
+CAMPAIGN_MAX_FLOOD_WAITS (RetryAfter подряд на одного получателя, по умолчанию 10).
+"""
+import asyncio
+import datetime as dt
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional
+
+from nats.js.errors import KeyNotFoundError, KeyWrongLastSequenceError
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+
+CAMPAIGN_RATE = float(os.getenv("CAMPAIGN_RATE") or "30")
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY") or "20")
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS") or "3")
+CAMPAIGN_MAX_FLOOD_WAITS = int(os.getenv("CAMPAIGN_MAX_FLOOD_WAITS") or "10")
+
+SENT = "sent"
+BLOCKED = "blocked"
+NOT_FOUND = "not_found"
+TRANSIENT = "transient"
+FAILED = "failed"
+OUTCOMES = (SENT, BLOCKED, NOT_FOUND, TRANSIENT, FAILED)
+
+# Пауза перед повтором после сетевой ошибки: 1, 2, 4 ... секунд, но не больше.
+RETRY_MAX_DELAY = 30.0
+
+# (chat_id, исход, результат отправки или исключение, число попыток)
+ResultCallback = Callable[[int, str, Any, int], Optional[Awaitable[None]]]
+
+
+def classify_error(exc: Exception) -> str:
+    """Исход отправки по исключению; RetryAfter разбирается отдельно."""
+    if isinstance(exc, Forbidden):
+        return BLOCKED
+    # BadRequest — наследник NetworkError, поэтому проверяется раньше.
+    if isinstance(exc, BadRequest):
+        message = str(exc).lower()
+        if "chat not found" in message or "user not found" in message:
+            return NOT_FOUND
+        return FAILED
+    if isinstance(exc, (NetworkError, asyncio.TimeoutError, OSError)):
+        return TRANSIENT
+    return FAILED
+
+
+def is_unreachable(exc: Exception) -> bool:
+    """
+    Пользователь заблокировал бота или удалил аккаунт — писать ему бесполезно,
+    пока он снова не нажмёт /start.
+    """
+    if not isinstance(exc, Forbidden):
+        return False
+    message = str(exc).lower()
+    return "bot was blocked" in message or "user is deactivated" in message
+
+
+def retry_after_seconds(exc: RetryAfter) -> float:
+    retry_after = exc.retry_after
+    if isinstance(retry_after, dt.timedelta):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости в пределах процесса: `rate` токенов в секунду, запас `burst`.
+
+    burst=1 равномерно распределяет запросы по секунде — Telegram считает
+    лимит по коротким окнам, и пачки в начале секунды ловят 429.
+    """
+
+    def __init__(self, rate: float = CAMPAIGN_RATE, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def pause(self, seconds: float) -> None:
+        """Никто не получает токены ближайшие `seconds` секунд (ответ RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SharedRateLimiter:
+    """
+    Лимит скорости, общий для всех процессов: в ключе KV хранится unix-время
+    следующего свободного слота. acquire() через compare-and-set сдвигает его
+    на 1/rate и ждёт своего слота, pause() отодвигает слоты на время RetryAfter.
+
+    Воркеры сравнивают слоты по своим часам — на разных хостах нужен NTP.
+    """
+
+    def __init__(self, kv, key: str = "rate.telegram", rate: float = CAMPAIGN_RATE) -> None:
+        self.kv = kv
+        self.key = key
+        self.rate = rate
+
+    async def _reserve(self, not_before: float, step: float) -> float:
+        while True:
+            try:
+                entry = await self.kv.get(self.key)
+                next_slot, revision = float(entry.value or b"0"), entry.revision
+            except KeyNotFoundError:
+                next_slot, revision = 0.0, None
+            slot = max(time.time(), next_slot, not_before)
+            value = f"{slot + step:.6f}".encode()
+            try:
+                if revision is None:
+                    await self.kv.create(self.key, value)
+                else:
+                    await self.kv.update(self.key, value, last=revision)
+                return slot
+            except KeyWrongLastSequenceError:
+                # Слот успел занять другой отправитель — перечитываем.
+                continue
+
+    async def acquire(self) -> None:
+        slot = await self._reserve(0.0, 1 / self.rate)
+        delay = slot - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def pause(self, seconds: float) -> None:
+        await self._reserve(time.time() + seconds, 0.0)
+
+
+@dataclass
+class BroadcastSummary:
+    sent: int = 0
+    blocked: int = 0
+    not_found: int = 0
+    transient: int = 0
+    failed: int = 0
+    # ответов RetryAfter за рассылку
+    flood_waits: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.blocked + self.not_found + self.transient + self.failed
+
+    @property
+    def msgs_per_second(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def add(self, outcome: str) -> None:
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "not_found": self.not_found,
+            "transient": self.transient,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "msgs_per_second": round(self.msgs_per_second, 2),
+        }
+
+
+class BroadcastEngine:
+    """
+    send(chat_id) отправляет одно сообщение и бросает исключения Telegram как есть.
+    on_result(chat_id, outcome, result, attempts) вызывается после окончательного
+    исхода по каждому получателю (может быть корутиной). Исключение из send вне
+    разобранных выше или из on_result останавливает рассылку и пробрасывается из run().
+    """
+
+    def __init__(self, send: Callable[[int], Awaitable[Any]],
+                 limiter: Optional[TokenBucket | SharedRateLimiter] = None,
+                 concurrency: int = CAMPAIGN_CONCURRENCY,
+                 max_attempts: int = CAMPAIGN_MAX_ATTEMPTS,
+                 on_result: Optional[ResultCallback] = None,
+                 max_flood_waits: int = CAMPAIGN_MAX_FLOOD_WAITS) -> None:
+        self.send = send
+        self.limiter = limiter or TokenBucket()
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.max_flood_waits = max(1, max_flood_waits)
+        self.on_result = on_result
+        self.summary = BroadcastSummary()
+
+    async def run(self, recipients: Iterable[int] | AsyncIterable[int]) -> BroadcastSummary:
+        self.summary = BroadcastSummary()
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        producer = asyncio.create_task(self._produce(recipients, queue, len(workers)))
+        tasks = [producer, *workers]
+        try:
+            # Упавший отправитель не должен оставить производителя ждать места в очереди:
+            # первая ошибка останавливает рассылку и пробрасывается вызывающему.
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.summary.elapsed = time.monotonic() - started
+        return self.summary
+
+    @staticmethod
+    async def _produce(recipients: Iterable[int] | AsyncIterable[int],
+                       queue: asyncio.Queue, workers: int) -> None:
+        if hasattr(recipients, "__aiter__"):
+            async for chat_id in recipients:
+                await queue.put(chat_id)
+        else:
+            for chat_id in recipients:
+                await queue.put(chat_id)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            outcome, result, attempts = await self._deliver(chat_id)
+            self.summary.add(outcome)
+            if self.on_result is not None:
+                callback = self.on_result(chat_id, outcome, result, attempts)
+                if callback is not None:
+                    await callback
+
+    async def _deliver(self, chat_id: int) -> tuple[str, Any, int]:
+        # attempt — все запросы к Telegram; failures и flood_waits считаются раздельно:
+        # RetryAfter — ограничение бота, а не ошибка получателя.
+        attempt = failures = flood_waits = 0
+        while True:
+            attempt += 1
+            await self.limiter.acquire()
+            try:
+                return SENT, await self.send(chat_id), attempt
+            except RetryAfter as exc:
+                self.summary.flood_waits += 1
+                flood_waits += 1
+                await self.limiter.pause(retry_after_seconds(exc))
+                if flood_waits >= self.max_flood_waits:
+                    return TRANSIENT, exc, attempt
+                continue
+            except Exception as exc:
+                outcome = classify_error(exc)
+                error = exc
+                if outcome == FAILED:
+                    logger.warning("Broadcast to %s failed: %s", chat_id, exc)
+
+            failures += 1
+            if outcome != TRANSIENT or failures >= self.max_attempts:
+                return outcome, error, attempt
+            await asyncio.sleep(min(RETRY_MAX_DELAY, 2 ** (failures - 1)))
@@ -0,0 +1,154 @@
+"""
+Прогресс рассылок в NATS KV: бакет campaigns, ключ progress.<campaign_id>.
+
+Шарды кампании пишут в один ключ через compare-and-set: после каждой пачки
+журнала доставки (DeliveryLedger) добавляют свои sent/blocked/... Запись идёт
+в фоновой задаче — отправители её не ждут, а если NATS недоступен, теряется
+только счётчик, не рассылка.
+
+Админка читает ключи кампаний страницы списка параллельными kv.get (по запросу
+на кампанию, ожидание — как у одного запроса), не трогая campaign_deliveries.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Iterable, Optional
+
+from nats.js.errors import KeyNotFoundError, KeyWrongLastSequenceError
+
+from common.broadcast import OUTCOMES
+
+
+logger = logging.getLogger(__name__)
+
+# Сглаживание текущей скорости: доля последнего замера.
+RATE_SMOOTHING = 0.3
+# После такой паузы (например, до повтора ошибок) скорость считается заново.
+RATE_IDLE_SECONDS = 60.0
+
+
+def progress_key(campaign_id: int) -> str:
+    return f"progress.{campaign_id}"
+
+
+@dataclass
+class CampaignProgress:
+    # получателей во всех шардах кампании
+    total: int = 0
+    sent: int = 0
+    blocked: int = 0
+    not_found: int = 0
+    transient: int = 0
+    failed: int = 0
+    # unix-время
+    started_at: float = 0.0
+    updated_at: float = 0.0
+    # текущая скорость, сообщений в секунду
+    rate: float = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.not_found + self.transient + self.failed
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.total - self.processed)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if not self.remaining:
+            return 0.0
+        return self.remaining / self.rate if self.rate else None
+
+    def apply(self, counts: dict[str, int], total: int, now: float) -> None:
+        processed = self.processed
+        for outcome in OUTCOMES:
+            setattr(self, outcome, getattr(self, outcome) + counts.get(outcome, 0))
+        self.total = max(self.total, total)
+        if not self.started_at:
+            self.started_at = now
+        elif now - self.updated_at > RATE_IDLE_SECONDS:
+            self.rate = 0.0
+        elif now > self.updated_at:
+            current = (self.processed - processed) / (now - self.updated_at)
+            self.rate = (
+                current if not self.rate
+                else RATE_SMOOTHING * current + (1 - RATE_SMOOTHING) * self.rate
+            )
+        self.updated_at = now
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(asdict(self)).encode()
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "CampaignProgress":
+        return cls(**json.loads(data)) if data else cls()
+
+
+class ProgressCounter:
+    """
+    Счётчик прогресса одного шарда: add() только копит, отправкой в KV
+    занимается фоновая задача; close() дожидается последней записи.
+    """
+
+    def __init__(self, kv, campaign_id: int, total: int) -> None:
+        self.kv = kv
+        self.key = progress_key(campaign_id)
+        self.total = total
+        self._pending: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, counts: dict[str, int]) -> None:
+        self._pending.update(counts)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._push())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            await self._task
+
+    async def _push(self) -> None:
+        while any(self._pending.values()):
+            counts, self._pending = dict(self._pending), Counter()
+            try:
+                await self._apply(counts)
+            except Exception as exc:
+                # Прогресс — справочный, рассылку из-за него не останавливаем.
+                logger.warning("Failed to update %s: %s", self.key, exc)
+                return
+
+    async def _apply(self, counts: dict[str, int]) -> None:
+        while True:
+            try:
+                entry = await self.kv.get(self.key)
+                progress, revision = CampaignProgress.from_bytes(entry.value), entry.revision
+            except KeyNotFoundError:
+                progress, revision = CampaignProgress(), None
+            progress.apply(counts, self.total, time.time())
+            try:
+                if revision is None:
+                    await self.kv.create(self.key, progress.to_bytes())
+                else:
+                    await self.kv.update(self.key, progress.to_bytes(), last=revision)
+                return
+            except KeyWrongLastSequenceError:
+                # Ключ успел обновить другой шард — перечитываем.
+                continue
+
+
+async def read_progress(kv, campaign_ids: Iterable[int]) -> dict[int, CampaignProgress]:
+    """Прогресс кампаний, у которых он есть: по kv.get на кампанию, все параллельно."""
+    async def _get(campaign_id: int) -> Optional[CampaignProgress]:
+        try:
+            entry = await kv.get(progress_key(campaign_id))
+        except KeyNotFoundError:
+            return None
+        return CampaignProgress.from_bytes(entry.value)
+
+    ids = list(campaign_ids)
+    results = await asyncio.gather(*(_get(campaign_id) for campaign_id in ids))
+    return {cid: progress for cid, progress in zip(ids, results) if progress is not None}
+
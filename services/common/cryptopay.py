@@ -0,0 +1,18 @@
+"""
+Клиент Crypto Pay API (aiosend) для web и бота.
+
+CRYPTOBOT_API_URL направляет запросы на другой адрес — например, на заглушку
+tests/fakes/cryptopay.py: методы вызываются как `<CRYPTOBOT_API_URL>/<method>`.
+"""
+import os
+
+
+def crypto_pay(token: str):
+    # aiosend импортируется здесь: вызывающий код сам решает, что делать без него.
+    from aiosend import CryptoPay
+    from aiosend.client import Network
+
+    api_url = (os.getenv("CRYPTOBOT_API_URL") or "").strip().rstrip("/")
+    if not api_url:
+        return CryptoPay(token=token)
+    return CryptoPay(token=token, network=Network(name="CUSTOM", base=f"{api_url}/{{method}}"))
@@ -0,0 +1,207 @@
+"""
+Dead-letter очередь для событий NATS и политика повторных доставок.
+
+- `redelivery_delay` — экспоненциальная задержка для `msg.nak(delay=...)`;
+- `dead_letter` — кладёт исходное сообщение (payload + заголовки) в стрим DLQ
+  (`dlq.<исходный стрим>`) вместе с причиной ошибки и подтверждает оригинал;
+- `list_entries` / `replay` / `drop` — для просмотра и повторной отправки из админки.
+
+Настройки: NATS_RETRY_BASE_DELAY (сек, по умолчанию 2), NATS_RETRY_MAX_DELAY (по умолчанию 300).
+"""
+import datetime as dt
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from nats.aio.msg import Msg
+from nats.js.errors import NotFoundError
+
+from .nats_client import DLQ_STREAM, NatsManager
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_BASE_DELAY = float(os.getenv("NATS_RETRY_BASE_DELAY") or "2")
+RETRY_MAX_DELAY = float(os.getenv("NATS_RETRY_MAX_DELAY") or "300")
+
+# Заголовки, которые добавляет DLQ (при replay они отбрасываются).
+H_SUBJECT = "Dlq-Original-Subject"
+H_STREAM = "Dlq-Original-Stream"
+H_CONSUMER = "Dlq-Consumer"
+H_SEQUENCE = "Dlq-Original-Sequence"
+H_DELIVERIES = "Dlq-Deliveries"
+H_ERROR = "Dlq-Error"
+H_FAILED_AT = "Dlq-Failed-At"
+DLQ_HEADERS = (H_SUBJECT, H_STREAM, H_CONSUMER, H_SEQUENCE, H_DELIVERIES, H_ERROR, H_FAILED_AT)
+
+
+def redelivery_delay(num_delivered: int, base: float = RETRY_BASE_DELAY,
+                     max_delay: float = RETRY_MAX_DELAY) -> float:
+    """base, 2*base, 4*base, ... но не больше max_delay."""
+    return min(max_delay, base * (2 ** max(0, num_delivered - 1)))
+
+
+@dataclass
+class DlqEntry:
+    seq: int
+    subject: str
+    stream: str
+    consumer: str
+    deliveries: int
+    error: str
+    failed_at: str
+    data: bytes
+    headers: dict[str, str]
+
+
+def _dlq_subject(stream: str) -> str:
+    return f"{DLQ_STREAM}.{stream or 'unknown'}"
+
+
+async def publish_dead_letter(manager: NatsManager, *, subject: str, stream: str,
+                              consumer: str, sequence: int, deliveries: int,
+                              data: bytes, headers: Optional[dict[str, str]],
+                              error: str) -> None:
+    dlq_headers = dict(headers or {})
+    dlq_headers.update({
+        H_SUBJECT: subject,
+        H_STREAM: stream,
+        H_CONSUMER: consumer,
+        H_SEQUENCE: str(sequence),
+        H_DELIVERIES: str(deliveries),
+        # Заголовки NATS однострочные, длинные трейсы не нужны.
+        H_ERROR: " ".join(error.split())[:500],
+        H_FAILED_AT: dt.datetime.now(dt.timezone.utc).isoformat(),
+    })
+    await manager.publish(_dlq_subject(stream), data, headers=dlq_headers)
+
+
+async def dead_letter(manager: NatsManager, msg: Msg, error: str) -> None:
+    """Переносит сообщение в DLQ и снимает его с исходного consumer'а."""
+    meta = msg.metadata
+    await publish_dead_letter(
+        manager,
+        subject=msg.subject,
+        stream=meta.stream,
+        consumer=meta.consumer,
+        sequence=meta.sequence.stream,
+        deliveries=meta.num_delivered,
+        data=msg.data,
+        headers=msg.headers,
+        error=error,
+    )
+    await msg.term()
+    logger.warning(
+        "Message %s/%s moved to DLQ after %s deliveries: %s",
+        meta.stream, meta.sequence.stream, meta.num_delivered, error,
+    )
+
+
+async def nak_or_dead_letter(manager: NatsManager, msg: Msg, error: str,
+                             max_deliver: int) -> None:
+    """Повтор с экспоненциальной задержкой; после max_deliver доставок — в DLQ."""
+    num_delivered = msg.metadata.num_delivered
+    if max_deliver > 0 and num_delivered >= max_deliver:
+        await dead_letter(manager, msg, error)
+        return
+    await msg.nak(delay=redelivery_delay(num_delivered))
+
+
+def _entry(seq: int, raw) -> DlqEntry:
+    headers = dict(raw.headers or {})
+    return DlqEntry(
+        seq=seq,
+        subject=headers.get(H_SUBJECT, ""),
+        stream=headers.get(H_STREAM, ""),
+        consumer=headers.get(H_CONSUMER, ""),
+        deliveries=int(headers.get(H_DELIVERIES) or 0),
+        error=headers.get(H_ERROR, ""),
+        failed_at=headers.get(H_FAILED_AT, ""),
+        data=raw.data or b"",
+        headers={k: v for k, v in headers.items() if k not in DLQ_HEADERS},
+    )
+
+
+async def get_entry(manager: NatsManager, seq: int) -> Optional[DlqEntry]:
+    js = await manager.jetstream()
+    try:
+        raw = await js.get_msg(DLQ_STREAM, seq)
+    except NotFoundError:
+        return None
+    return _entry(seq, raw)
+
+
+async def list_entries(manager: NatsManager, limit: int = 20) -> tuple[int, list[DlqEntry]]:
+    """(всего сообщений в DLQ, последние `limit` записей — от новых к старым)."""
+    js = await manager.jetstream()
+    info = await js.stream_info(DLQ_STREAM)
+    entries: list[DlqEntry] = []
+    seq = info.state.last_seq
+    while seq >= info.state.first_seq and seq > 0 and len(entries) < limit:
+        entry = await get_entry(manager, seq)
+        if entry is not None:
+            entries.append(entry)
+        seq -= 1
+    return info.state.messages, entries
+
+
+async def replay(manager: NatsManager, seq: int) -> Optional[DlqEntry]:
+    """Публикует исходный payload в исходный subject и удаляет запись из DLQ."""
+    entry = await get_entry(manager, seq)
+    if entry is None or not entry.subject:
+        return None
+    await manager.publish(entry.subject, entry.data, headers=entry.headers or None)
+    js = await manager.jetstream()
+    await js.delete_msg(DLQ_STREAM, seq)
+    return entry
+
+
+async def drop(manager: NatsManager, seq: int) -> bool:
+    js = await manager.jetstream()
+    try:
+        return await js.delete_msg(DLQ_STREAM, seq)
+    except NotFoundError:
+        return False
+
+
+MAX_DELIVERIES_ADVISORY = "$JS.EVENT.ADVISORY.CONSUMER.MAX_DELIVERIES.>"
+
+
+async def watch_max_deliveries(manager: NatsManager):
+    """
+    Сообщения, которые исчерпали max_deliver по таймауту ack (обработчик завис/упал
+    и не успел сделать nak), сервер больше не доставляет — переносим их в DLQ
+    по advisory-событию.
+    """
+    async def on_advisory(adv: Msg) -> None:
+        try:
+            info = json.loads(adv.data.decode())
+            stream, seq = info["stream"], int(info["stream_seq"])
+            if stream == DLQ_STREAM:
+                return
+            js = await manager.jetstream()
+            try:
+                raw = await js.get_msg(stream, seq)
+            except NotFoundError:
+                return  # уже подтверждено/перенесено обработчиком
+            await publish_dead_letter(
+                manager,
+                subject=raw.subject,
+                stream=stream,
+                consumer=info.get("consumer", ""),
+                sequence=seq,
+                deliveries=int(info.get("deliveries") or 0),
+                data=raw.data or b"",
+                headers=raw.headers,
+                error="max deliveries reached without ack",
+            )
+            await js.delete_msg(stream, seq)
+            logger.warning("Message %s/%s moved to DLQ by max deliveries advisory", stream, seq)
+        except Exception as exc:
+            logger.error("Failed to handle max deliveries advisory: %s", exc)
+
+    nc = await manager.connect()
+    return await nc.subscribe(MAX_DELIVERIES_ADVISORY, queue="dlq-advisory", cb=on_advisory)
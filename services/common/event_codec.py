@@ -0,0 +1,175 @@
+"""
+Конверт для событий между сервисами.
+
+Каждое сообщение публикуется с заголовками:
+- Event-Type     — имя модели из common.events (PaymentSucceededEvent, ...);
+- Schema-Version — версия схемы события;
+- Content-Type   — `application/json` или `application/vnd.event-packed`.
+
+Packed-формат для событий с длинными списками id (SendCampaignEvent.user_ids):
+    [u32 BE: длина meta][meta: JSON остальных полей][zlib(int64 LE массив дельт id)]
+Такой payload в разы меньше JSON-массива и декодируется без json.loads на миллион чисел.
+
+Если событие не помещается в EVENT_MAX_PAYLOAD_BYTES, список id делится на несколько
+самостоятельных событий (заголовки Event-Id/Chunk-Index/Chunk-Count) — каждый кусок
+можно обрабатывать независимо.
+
+Сообщения без заголовков (старые публикации, DLQ до обновления) декодируются как JSON
+по subject'у.
+"""
+import json
+import operator
+import os
+import struct
+import sys
+import uuid
+import zlib
+from array import array
+from itertools import accumulate
+from typing import Optional
+
+from pydantic import BaseModel
+
+from .events import PaymentSucceededEvent, SendCampaignEvent
+
+
+CT_JSON = "application/json"
+CT_PACKED = "application/vnd.event-packed"
+
+H_EVENT_TYPE = "Event-Type"
+H_SCHEMA_VERSION = "Schema-Version"
+H_CONTENT_TYPE = "Content-Type"
+H_EVENT_ID = "Event-Id"
+H_CHUNK_INDEX = "Chunk-Index"
+H_CHUNK_COUNT = "Chunk-Count"
+
+SCHEMA_VERSION = 1
+
+# Списки длиннее порога упаковываются; размер сообщения держим ниже max_payload NATS (1 МБ).
+PACK_THRESHOLD = int(os.getenv("EVENT_PACK_THRESHOLD") or "1000")
+MAX_PAYLOAD_BYTES = int(os.getenv("EVENT_MAX_PAYLOAD_BYTES") or str(512 * 1024))
+
+EVENT_TYPES: dict[str, type[BaseModel]] = {
+    "PaymentSucceededEvent": PaymentSucceededEvent,
+    "SendCampaignEvent": SendCampaignEvent,
+}
+
+# subject -> модель для сообщений без заголовков (legacy JSON)
+SUBJECT_TYPES: dict[str, type[BaseModel]] = {
+    "payment.succeeded": PaymentSucceededEvent,
+    "campaign.send": SendCampaignEvent,
+}
+
+# Поля-списки int, которые имеет смысл упаковывать.
+PACKED_FIELDS: dict[type[BaseModel], str] = {
+    SendCampaignEvent: "user_ids",
+}
+
+
+class EventDecodeError(ValueError):
+    pass
+
+
+def pack_ids(ids: list[int]) -> bytes:
+    # Дельты вместо самих id: получатели обычно выбираются по порядку user_id,
+    # и маленькие разности zlib сжимает намного лучше.
+    packed = array("q", map(operator.sub, ids, [0, *ids[:-1]]))
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return zlib.compress(packed.tobytes(), 1)
+
+
+def unpack_ids(data: bytes) -> list[int]:
+    packed = array("q")
+    packed.frombytes(zlib.decompress(data))
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return list(accumulate(packed))
+
+
+def _headers(event: BaseModel, content_type: str) -> dict[str, str]:
+    return {
+        H_EVENT_TYPE: type(event).__name__,
+        H_SCHEMA_VERSION: str(SCHEMA_VERSION),
+        H_CONTENT_TYPE: content_type,
+    }
+
+
+def _encode_one(event: BaseModel) -> tuple[bytes, dict[str, str]]:
+    field = PACKED_FIELDS.get(type(event))
+    ids = getattr(event, field) if field else None
+    if ids is None or len(ids) < PACK_THRESHOLD:
+        return event.model_dump_json().encode("utf-8"), _headers(event, CT_JSON)
+
+    meta = event.model_dump_json(exclude={field}).encode("utf-8")
+    payload = struct.pack(">I", len(meta)) + meta + pack_ids(ids)
+    return payload, _headers(event, CT_PACKED)
+
+
+def encode_event(event: BaseModel,
+                 max_bytes: int = MAX_PAYLOAD_BYTES) -> list[tuple[bytes, dict[str, str]]]:
+    """Возвращает [(payload, headers)] — одно сообщение или несколько кусков."""
+    payload, headers = _encode_one(event)
+    field = PACKED_FIELDS.get(type(event))
+    if len(payload) <= max_bytes or not field:
+        return [(payload, headers)]
+
+    ids = getattr(event, field)
+    # Оценка по фактическому размеру: сколько id помещается в max_bytes, с запасом.
+    per_chunk = max(1, int(len(ids) * max_bytes / len(payload) * 0.9))
+    parts = [ids[i:i + per_chunk] for i in range(0, len(ids), per_chunk)]
+    event_id = uuid.uuid4().hex
+    chunks = []
+    for index, part in enumerate(parts):
+        chunk_payload, chunk_headers = _encode_one(event.model_copy(update={field: part}))
+        chunk_headers.update({
+            H_EVENT_ID: event_id,
+            H_CHUNK_INDEX: str(index),
+            H_CHUNK_COUNT: str(len(parts)),
+        })
+        chunks.append((chunk_payload, chunk_headers))
+    return chunks
+
+
+def decode_event(subject: str, data: bytes,
+                 headers: Optional[dict[str, str]] = None) -> BaseModel:
+    headers = headers or {}
+    event_type = headers.get(H_EVENT_TYPE)
+    if event_type:
+        model = EVENT_TYPES.get(event_type)
+    else:
+        # payment.succeeded.<партиция> → payment.succeeded
+        model = SUBJECT_TYPES.get(subject) or SUBJECT_TYPES.get(subject.rsplit(".", 1)[0])
+    if model is None:
+        raise EventDecodeError(f"unknown event type: {event_type or subject}")
+
+    version = int(headers.get(H_SCHEMA_VERSION) or SCHEMA_VERSION)
+    if version > SCHEMA_VERSION:
+        raise EventDecodeError(f"unsupported schema version {version} for {model.__name__}")
+
+    content_type = headers.get(H_CONTENT_TYPE) or CT_JSON
+    if content_type == CT_JSON:
+        return model.model_validate_json(data)
+    if content_type == CT_PACKED:
+        field = PACKED_FIELDS.get(model)
+        if not field or len(data) < 4:
+            raise EventDecodeError(f"packed payload is not supported for {model.__name__}")
+        (meta_len,) = struct.unpack(">I", data[:4])
+        fields = json.loads(data[4:4 + meta_len])
+        try:
+            fields[field] = unpack_ids(data[4 + meta_len:])
+        except zlib.error as exc:
+            raise EventDecodeError(f"corrupted packed payload: {exc}") from exc
+        return model.model_validate(fields)
+    raise EventDecodeError(f"unsupported content type: {content_type}")
+
+
+def describe_event(event: BaseModel) -> str:
+    """Короткое описание для логов: длинные списки заменяются их длиной."""
+    field = PACKED_FIELDS.get(type(event))
+    if field:
+        data = event.model_dump(exclude={field})
+        data[field] = f"<{len(getattr(event, field))} ids>"
+    else:
+        data = event.model_dump()
+    return f"{type(event).__name__}({', '.join(f'{k}={v}' for k, v in data.items())})"
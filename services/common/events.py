@@ -1,13 +1,17 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal
 import datetime as dt
 
 
 class SendCampaignEvent(BaseModel):
     campaign_id: int
-    user_ids: List[int]
-    text: str
-    # можно добавить другие поля (например, files, menu и т.д.)
+    # send — новая рассылка; resume — продолжить прерванную;
+    # retry — повторить только получателям с временной ошибкой.
+    action: Literal["send", "resume", "retry"] = "send"
+    # Пустой список — получатели берутся из кампании (send_to или все пользователи).
+    user_ids: List[int] = []
+    # Текст, файлы и меню бот читает из send_message_campaign; поле оставлено для совместимости.
+    text: str = ''
 
 
 class PaymentSucceededEvent(BaseModel):
@@ -0,0 +1,72 @@
+"""
+Этапы пути «callback провайдера → инвайт у пользователя» (основной SLO).
+
+Отметки времени (unix-время, секунды) передаются в заголовках события
+payment.succeeded как `Stage-<этап>` и дополняются consumer'ом бота:
+
+    callback_received → payment_committed → event_published     (web / reconcile)
+    → event_consumed → invite_created → subscription_granted → message_sent   (bot)
+
+Web и бот пишут время по своим часам — на разных хостах нужен NTP,
+иначе длительность event_consumed будет смещена на расхождение часов.
+"""
+import time
+from typing import Mapping, Optional
+
+
+STAGES = (
+    "callback_received",
+    "payment_committed",
+    "event_published",
+    "event_consumed",
+    "invite_created",
+    "subscription_granted",
+    "message_sent",
+)
+
+HEADER_PREFIX = "Stage-"
+
+
+def stamp(stamps: dict[str, float], stage: str, at: Optional[float] = None) -> dict[str, float]:
+    if stage not in STAGES:
+        raise ValueError(f"unknown latency stage: {stage}")
+    stamps[stage] = time.time() if at is None else at
+    return stamps
+
+
+def to_headers(stamps: Mapping[str, float]) -> dict[str, str]:
+    return {f"{HEADER_PREFIX}{stage}": f"{at:.6f}" for stage, at in stamps.items()}
+
+
+def from_headers(headers: Optional[Mapping[str, str]]) -> dict[str, float]:
+    stamps: dict[str, float] = {}
+    for stage in STAGES:
+        value = (headers or {}).get(f"{HEADER_PREFIX}{stage}")
+        if value is None:
+            continue
+        try:
+            stamps[stage] = float(value)
+        except ValueError:
+            continue
+    return stamps
+
+
+def stage_durations(stamps: Mapping[str, float]) -> dict[str, float]:
+    """Секунды от предыдущего известного этапа до каждого следующего."""
+    durations: dict[str, float] = {}
+    previous: Optional[float] = None
+    for stage in STAGES:
+        at = stamps.get(stage)
+        if at is None:
+            continue
+        if previous is not None:
+            durations[stage] = max(0.0, at - previous)
+        previous = at
+    return durations
+
+
+def total_seconds(stamps: Mapping[str, float]) -> Optional[float]:
+    present = [stamps[stage] for stage in STAGES if stage in stamps]
+    if len(present) < 2:
+        return None
+    return max(0.0, present[-1] - present[0])
@@ -4,3 +4,5 @@ from .interface_models import *
 from .models import *
 from .subscriptions_models import *
 from .payments_models import *
+from .stats_models import *
+from .campaigns_models import *
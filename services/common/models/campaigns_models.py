@@ -0,0 +1,132 @@
+import datetime as dt
+from typing import List, Optional
+
+from sqlalchemy import (
+    ARRAY,
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    String,
+    Table,
+    UniqueConstraint,
+    func,
+    text,
+)
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class CampaignSegment(Base):
+    """
+    Именованный сегмент аудитории: вид (common.segments.SEGMENT_KINDS) и параметр.
+    Материализованный сегмент хранит состав в campaign_segment_members.
+    """
+    __tablename__ = "campaign_segments"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(128), unique=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    param: Mapped[Optional[str]] = mapped_column(String(128))
+    materialized: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
+    # состав на момент последнего обновления материализованного сегмента
+    member_count: Mapped[Optional[int]]
+    refreshed_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self) -> str:
+        return f"<{self.name}>"
+
+
+campaign_segment_members = Table(
+    "campaign_segment_members",
+    Base.metadata,
+    Column(
+        "segment_id",
+        ForeignKey("campaign_segments.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column("user_id", BigInteger, primary_key=True),
+)
+
+
+class CampaignShard(Base):
+    """
+    Часть получателей рассылки, которую отправляет одна задача taskiq:
+    user_id в диапазоне [first_user_id, last_user_id] из аудитории кампании
+    (audience: all — все пользователи, send_to — выбранные в админке,
+    segment — сегмент кампании, list — явный список user_ids из события campaign.send).
+    Получатели, уже записанные в campaign_deliveries, при повторном запуске
+    шарда пропускаются; retry — повтор только временных ошибок шарда.
+    """
+    __tablename__ = "campaign_shards"
+    __table_args__ = (
+        UniqueConstraint("campaign_id", "first_user_id", name="uq_campaign_shards_first_user"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    campaign_id: Mapped[int] = mapped_column(
+        ForeignKey("send_message_campaign.id", ondelete="CASCADE"), index=True
+    )
+    audience: Mapped[str] = mapped_column(String(16))
+    first_user_id: Mapped[int] = mapped_column(BigInteger)
+    last_user_id: Mapped[int] = mapped_column(BigInteger)
+    user_ids: Mapped[Optional[List[int]]] = mapped_column(ARRAY(BigInteger))
+    recipients: Mapped[int] = mapped_column(default=0)
+
+    # pending → running → done
+    status: Mapped[str] = mapped_column(String(16), default="pending", server_default="pending")
+    retry: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
+    sent: Mapped[int] = mapped_column(default=0)
+    blocked: Mapped[int] = mapped_column(default=0)
+    not_found: Mapped[int] = mapped_column(default=0)
+    transient: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+
+    created_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now()
+    )
+    started_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    finished_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    # последняя запись в журнал доставки; давно не обновлялся у running — воркер умер
+    checkpoint_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self) -> str:
+        return (
+            f"<CampaignShard {self.id} campaign={self.campaign_id} "
+            f"{self.first_user_id}..{self.last_user_id} {self.status}>"
+        )
+
+
+class CampaignDelivery(Base):
+    """
+    Журнал доставки: итог отправки рассылки каждому получателю.
+    Пишется пачками во время отправки шарда (DeliveryLedger).
+    """
+    __tablename__ = "campaign_deliveries"
+    __table_args__ = (
+        # Повтор временных ошибок выбирает только их.
+        Index(
+            "ix_campaign_deliveries_transient", "campaign_id", "user_id",
+            postgresql_where=text("status = 'transient'"),
+        ),
+    )
+
+    campaign_id: Mapped[int] = mapped_column(
+        ForeignKey("send_message_campaign.id", ondelete="CASCADE"), primary_key=True
+    )
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # sent / blocked / not_found / transient / failed (common.broadcast)
+    status: Mapped[str] = mapped_column(String(16))
+    message_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    error: Mapped[Optional[str]] = mapped_column(String(255))
+    # попыток отправки за все запуски
+    attempts: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"<CampaignDelivery campaign={self.campaign_id} user={self.user_id} {self.status}>"
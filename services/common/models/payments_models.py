@@ -3,15 +3,18 @@ from decimal import Decimal
 from typing import Any, Optional
 
 from sqlalchemy import (
-    JSON,
     BigInteger,
     Boolean,
     DateTime,
     ForeignKey,
+    Index,
+    Integer,
     Numeric,
     String,
     func,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base
@@ -19,6 +22,32 @@ from .base import Base
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Не больше одного открытого (pending) счёта на пользователя/провайдера/сумму:
+        # повторные нажатия «Оплатить» переиспользуют его, а гонку ловит БД.
+        Index(
+            "uq_payments_open_invoice",
+            "user_id",
+            "provider",
+            "amount",
+            unique=True,
+            postgresql_where=text("status = 'pending'"),
+        ),
+        # Вместо отдельных индексов на provider/status: reconcile и админка фильтруют
+        # по провайдеру и статусу и сортируют по created_at.
+        Index("ix_payments_provider_status_created", "provider", "status", "created_at"),
+        # У Robokassa-платежей эти поля пустые — индексируем только заполненные.
+        Index(
+            "ix_payments_provider_invoice_id_partial",
+            "provider_invoice_id",
+            postgresql_where=text("provider_invoice_id IS NOT NULL"),
+        ),
+        Index(
+            "ix_payments_provider_payload_partial",
+            "provider_payload",
+            postgresql_where=text("provider_payload IS NOT NULL"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
@@ -27,7 +56,7 @@ class Payment(Base):
     )
 
     # robokassa | cryptobot (пока используем robokassa)
-    provider: Mapped[str] = mapped_column(String(32), index=True, nullable=False)
+    provider: Mapped[str] = mapped_column(String(32), nullable=False)
 
     # Для RUB достаточно 2 знаков после запятой, но для TON нужны дробные значения.
     # Поэтому храним с повышенной точностью (на уровне БД).
@@ -35,43 +64,48 @@ class Payment(Base):
     currency: Mapped[str] = mapped_column(String(8), nullable=False)
 
     # pending | success | failed | canceled
-    status: Mapped[str] = mapped_column(String(16), index=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False)
 
     # Идентификаторы/метаданные у провайдера (для CryptoBot/CryptoPay API и идемпотентности).
     provider_payment_id: Mapped[Optional[str]] = mapped_column(
-        String(128), nullable=True, index=True
+        String(128), nullable=True
     )
     provider_invoice_id: Mapped[Optional[str]] = mapped_column(
-        String(128), nullable=True, index=True
+        String(128), nullable=True
     )
     provider_payload: Mapped[Optional[str]] = mapped_column(
-        String(256), nullable=True, index=True
+        String(256), nullable=True
+    )
+
+    # Ссылка на оплату, выданная пользователю, и до какого момента её можно переиспользовать.
+    payment_url: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)
+    expires_at: Mapped[Optional[dt.datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
     )
 
     signature_verified: Mapped[bool] = mapped_column(
         Boolean, nullable=False, default=False, server_default="false"
     )
 
-    # Для аудита/отладки: входящие параметры callback'а (ResultURL)
-    raw_callback: Mapped[Optional[dict[str, Any]]] = mapped_column(JSON, nullable=True)
-
+    # created_at/updated_at/paid_at индексируются для инкрементальных роллапов статистики.
     created_at: Mapped[dt.datetime] = mapped_column(
-        DateTime(timezone=True), default=func.now(), server_default=func.now()
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), index=True
     )
     updated_at: Mapped[dt.datetime] = mapped_column(
         DateTime(timezone=True),
         default=func.now(),
         server_default=func.now(),
         onupdate=func.now(),
+        index=True,
     )
 
     paid_at: Mapped[Optional[dt.datetime]] = mapped_column(
-        DateTime(timezone=True), nullable=True
+        DateTime(timezone=True), nullable=True, index=True
     )
 
     # Идемпотентность на стороне bot-consumer (обработка payment.succeeded)
     processed_at: Mapped[Optional[dt.datetime]] = mapped_column(
-        DateTime(timezone=True), nullable=True, index=True
+        DateTime(timezone=True), nullable=True
     )
 
     def __repr__(self) -> str:
@@ -81,3 +115,53 @@ class Payment(Base):
             f"status={self.status} amount={self.amount} {self.currency}{inv}>"
         )
 
+
+class PaymentCallback(Base):
+    """
+    Append-only журнал входящих callback'ов/ответов провайдеров (для аудита/отладки).
+    Старые записи выгружает в архив задача payment_callbacks_archive.
+    """
+    __tablename__ = "payment_callbacks"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    payment_id: Mapped[int] = mapped_column(ForeignKey("payments.id"), index=True)
+
+    # robokassa_result | cryptobot_webhook | cryptobot_create_error | reconcile | legacy
+    source: Mapped[str] = mapped_column(String(32))
+    payload: Mapped[dict[str, Any]] = mapped_column(JSONB)
+
+    created_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), index=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<PaymentCallback {self.id} payment={self.payment_id} source={self.source}>"
+
+
+class PaymentLatency(Base):
+    """
+    Отметки этапов «callback → инвайт у пользователя» по каждому платежу (common.latency).
+    Пишет consumer payment.succeeded после отправки сообщения пользователю.
+    """
+    __tablename__ = "payment_latency"
+
+    payment_id: Mapped[int] = mapped_column(ForeignKey("payments.id"), primary_key=True)
+    provider: Mapped[str] = mapped_column(String(32))
+
+    callback_received_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    payment_committed_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    event_published_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    event_consumed_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    invite_created_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    subscription_granted_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+    message_sent_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
+
+    # От первого до последнего известного этапа.
+    total_ms: Mapped[Optional[int]] = mapped_column(Integer)
+
+    created_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), index=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<PaymentLatency payment={self.payment_id} total={self.total_ms}ms>"
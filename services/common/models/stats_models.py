@@ -0,0 +1,71 @@
+import datetime as dt
+from decimal import Decimal
+
+from sqlalchemy import BigInteger, Date, DateTime, Numeric, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class DailyPaymentStats(Base):
+    """Дневной срез платежей: количество и сумма по провайдеру/валюте/статусу (день — по created_at, UTC)."""
+    __tablename__ = "stats_daily_payments"
+
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    provider: Mapped[str] = mapped_column(String(32), primary_key=True)
+    currency: Mapped[str] = mapped_column(String(8), primary_key=True)
+    status: Mapped[str] = mapped_column(String(16), primary_key=True)
+
+    count: Mapped[int] = mapped_column(default=0)
+    amount: Mapped[Decimal] = mapped_column(Numeric(18, 9), default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailyPaymentStats {self.day} {self.provider} {self.status} {self.count}>"
+
+
+class DailySubscriptionStats(Base):
+    """
+    Дневной срез подписок по каналу:
+    new — созданные за день, renewed — оплаты пользователей с уже существовавшей подпиской,
+    expired — истёкшие (по end_at), revoked — отозванные (по revoked_at).
+    """
+    __tablename__ = "stats_daily_subscriptions"
+
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    channel_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+    new: Mapped[int] = mapped_column(default=0)
+    renewed: Mapped[int] = mapped_column(default=0)
+    expired: Mapped[int] = mapped_column(default=0)
+    revoked: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailySubscriptionStats {self.day} channel={self.channel_id}>"
+
+
+class DailyUserStats(Base):
+    """Новые пользователи за день в разрезе source (пустой source хранится как '')."""
+    __tablename__ = "stats_daily_users"
+
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    source: Mapped[str] = mapped_column(String(256), primary_key=True)
+
+    new: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self) -> str:
+        return f"<DailyUserStats {self.day} source={self.source} new={self.new}>"
+
+
+class StatsWatermark(Base):
+    """До какого момента (updated_at/created_at исходных строк) обработан каждый роллап."""
+    __tablename__ = "stats_watermarks"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True))
+    refreshed_at: Mapped[dt.datetime] = mapped_column(
+        DateTime(timezone=True), default=func.now(), server_default=func.now(),
+        onupdate=func.now(),
+    )
+
+    def __repr__(self) -> str:
+        return f"<StatsWatermark {self.name}={self.value}>"
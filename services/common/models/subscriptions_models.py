@@ -27,18 +27,20 @@ class Subscription(Base):
     # active | expired | revoked
     status: Mapped[str] = mapped_column(String(16), default="active", index=True)
 
+    # created_at/updated_at/revoked_at индексируются для инкрементальных роллапов статистики.
     created_at: Mapped[dt.datetime] = mapped_column(
-        DateTime(timezone=True), default=func.now(), server_default=func.now()
+        DateTime(timezone=True), default=func.now(), server_default=func.now(), index=True
     )
     updated_at: Mapped[dt.datetime] = mapped_column(
         DateTime(timezone=True),
         default=func.now(),
         server_default=func.now(),
         onupdate=func.now(),
+        index=True,
     )
 
     revoked_at: Mapped[Optional[dt.datetime]] = mapped_column(
-        DateTime(timezone=True), nullable=True
+        DateTime(timezone=True), nullable=True, index=True
     )
     revoked_reason: Mapped[Optional[str]]
 
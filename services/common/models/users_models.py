@@ -7,8 +7,10 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     func,
+    Index,
     Integer,
-    Table
+    Table,
+    text
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -25,6 +27,22 @@ user_campaign = Table(
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Недоступных немного — частичный индекс по ним дёшев и ускоряет
+        # исключение их из рассылок (NOT EXISTS, get_blocked_ids).
+        Index(
+            'ix_users_blocked',
+            'user_id',
+            postgresql_where=text('blocked_at IS NOT NULL'),
+        ),
+        # Рассылка по всем: диапазоны user_id среди доступных (plan_ranges,
+        # stream_shard_recipients) читаются index-only scan без проверки blocked_at в heap.
+        Index(
+            'ix_users_reachable',
+            'user_id',
+            postgresql_where=text('blocked_at IS NULL'),
+        ),
+    )
 
     user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     first_name: Mapped[str]
@@ -36,9 +54,13 @@ class User(Base):
     created_at: Mapped[dt.datetime] = mapped_column(
         DateTime(timezone=True),
         default=func.now(),
-        server_default=func.now()
+        server_default=func.now(),
+        index=True
     )
     source: Mapped[Optional[str]]
+    # Когда Telegram ответил «bot was blocked» / «user is deactivated»;
+    # такие пользователи не получают рассылок, сбрасывается по /start.
+    blocked_at: Mapped[Optional[dt.datetime]] = mapped_column(DateTime(timezone=True))
 
     campaign_list: Mapped[List['SendMessageCampaign']] = relationship(
         back_populates='send_to',
@@ -77,6 +99,10 @@ class SendMessageCampaign(Base):
     preview: Mapped[bool] = mapped_column(default=False)
     send_post: Mapped[bool] = mapped_column(default=False)
     menu_id: Mapped[Optional[int]] = mapped_column(ForeignKey('kb_menu.id'))
+    # Сегмент аудитории; если задан, send_to не используется.
+    segment_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey('campaign_segments.id', ondelete='SET NULL')
+    )
     date: Mapped[dt.datetime] = mapped_column(
         DateTime(timezone=True),
         default=func.now(),
@@ -84,6 +110,10 @@ class SendMessageCampaign(Base):
     )
     status: Mapped[str] = mapped_column(default='Выполняется')
     files: Mapped[Optional[str]]
+    # JSON-список file_id загруженных вложений (в порядке files), общий для всех шардов
+    file_ids: Mapped[Optional[str]]
+    # send_post: JSON-список message_id поста в канале, который копируется получателям
+    post_message_ids: Mapped[Optional[str]]
 
     send_to: Mapped[User] = relationship(
         back_populates='campaign_list',
@@ -91,6 +121,7 @@ class SendMessageCampaign(Base):
     )
 
     menu: Mapped['Menu'] = relationship(cascade='save-update')
+    segment: Mapped[Optional['CampaignSegment']] = relationship()
 
     def __repr__(self):
         return f'<{self.name}>'
@@ -0,0 +1,393 @@
+"""
+Общее подключение к NATS для всех процессов (бот, consumer, воркеры taskiq, web).
+
+- одно соединение на процесс (`nats_manager`), переподключения считаются и пишутся в лог;
+- стримы, durable-consumer'ы и KV-бакеты описаны декларативно в STREAMS/CONSUMERS/
+  KV_BUCKETS; создаёт и обновляет их только NATS listener бота
+  (`connect(ensure_topology=True)`), остальные процессы (web, web-rpc, воркеры taskiq)
+  только подключаются — иначе процессы с разными PAYMENT_PARTITIONS/PAYMENTS_* перетирали
+  бы настройки друг друга, а ошибка топологии ломала бы публикацию;
+- для синхронного кода (Flask) есть `publish_sync`, который выполняет публикацию
+  в фоновом event loop'е процесса, не создавая соединение на каждый вызов.
+
+Настройки: NATS_URL (по умолчанию nats://nats:4222), NATS_CONNECT_TIMEOUT — сколько
+секунд ждать первого подключения (по умолчанию 5).
+"""
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from nats.aio.client import Client as NATS
+from nats.errors import NoServersError
+from nats.js.api import (
+    AckPolicy,
+    ConsumerConfig,
+    KeyValueConfig,
+    RetentionPolicy,
+    StreamConfig,
+)
+from nats.js.errors import BucketNotFoundError, NotFoundError
+from pydantic import BaseModel
+
+from .event_codec import encode_event
+
+
+logger = logging.getLogger(__name__)
+
+
+NATS_URL = os.getenv("NATS_URL") or "nats://nats:4222"
+# max_reconnect_attempts=-1 в nats-py распространяется и на первое подключение:
+# без ограничения connect() при недоступном NATS ждал бы вечно, держа блокировку.
+NATS_CONNECT_TIMEOUT = float(os.getenv("NATS_CONNECT_TIMEOUT") or "5")
+DLQ_STREAM = "dlq"
+
+
+@dataclass(frozen=True)
+class StreamSpec:
+    name: str
+    subjects: list[str]
+    retention: RetentionPolicy = RetentionPolicy.WORK_QUEUE
+    max_msgs: int = -1
+    max_age: Optional[float] = None  # секунды
+
+    def config(self) -> StreamConfig:
+        return StreamConfig(
+            name=self.name,
+            subjects=list(self.subjects),
+            retention=self.retention,
+            max_msgs=self.max_msgs,
+            max_age=self.max_age,
+        )
+
+
+@dataclass(frozen=True)
+class ConsumerSpec:
+    """Durable pull-consumer."""
+    stream: str
+    durable: str
+    filter_subject: str
+    ack_wait: float = 60
+    max_ack_pending: int = 1000
+    max_deliver: int = -1
+
+    def config(self) -> ConsumerConfig:
+        return ConsumerConfig(
+            durable_name=self.durable,
+            filter_subject=self.filter_subject,
+            ack_policy=AckPolicy.EXPLICIT,
+            ack_wait=self.ack_wait,
+            max_ack_pending=self.max_ack_pending,
+            max_deliver=self.max_deliver,
+        )
+
+
+STREAMS: tuple[StreamSpec, ...] = (
+    StreamSpec(
+        name="payments", subjects=["payment.succeeded", "payment.succeeded.*"], max_msgs=100_000
+    ),
+    StreamSpec(name="campaigns", subjects=["campaign.send"], max_msgs=10_000),
+    # Dead-letter: хранится до ручного replay/удаления или до истечения max_age.
+    StreamSpec(
+        name=DLQ_STREAM,
+        subjects=[f"{DLQ_STREAM}.>"],
+        retention=RetentionPolicy.LIMITS,
+        max_msgs=100_000,
+        max_age=float(os.getenv("NATS_DLQ_MAX_AGE_DAYS") or "30") * 86400,
+    ),
+)
+
+# payment.succeeded публикуется в payment.succeeded.<user_id % PAYMENT_PARTITIONS>:
+# у каждой партиции свой durable-consumer с max_ack_pending=1 — события одного
+# пользователя обрабатываются строго по порядку, разные партиции — параллельно.
+# Увеличивать число партиций можно в любой момент; уменьшать — только после того,
+# как лишние партиции опустеют (пустые consumer'ы удаляются при старте).
+PAYMENT_PARTITIONS = int(os.getenv("PAYMENT_PARTITIONS") or "8")
+PAYMENTS_DURABLE = "payment_processor"
+
+
+def payment_partition(user_id: int) -> int:
+    return user_id % PAYMENT_PARTITIONS
+
+
+def payment_subject(user_id: int) -> str:
+    return f"payment.succeeded.{payment_partition(user_id)}"
+
+
+def payment_durable(partition: int) -> str:
+    return f"{PAYMENTS_DURABLE}_{partition}"
+
+
+def _payment_consumer(durable: str, filter_subject: str) -> ConsumerSpec:
+    return ConsumerSpec(
+        stream="payments",
+        durable=durable,
+        filter_subject=filter_subject,
+        ack_wait=float(os.getenv("PAYMENTS_ACK_WAIT_SECONDS") or "60"),
+        max_ack_pending=1,
+        max_deliver=int(os.getenv("PAYMENTS_MAX_DELIVER") or "8"),
+    )
+
+
+CONSUMERS: tuple[ConsumerSpec, ...] = (
+    # События, опубликованные без партиции (до перехода на payment.succeeded.<n>).
+    _payment_consumer(PAYMENTS_DURABLE, "payment.succeeded"),
+    *(
+        _payment_consumer(payment_durable(partition), f"payment.succeeded.{partition}")
+        for partition in range(PAYMENT_PARTITIONS)
+    ),
+    ConsumerSpec(
+        stream="campaigns",
+        durable="campaign_processor",
+        filter_subject="campaign.send",
+        ack_wait=60,
+        max_ack_pending=100,
+        max_deliver=int(os.getenv("CAMPAIGNS_MAX_DELIVER") or "5"),
+    ),
+)
+
+
+@dataclass(frozen=True)
+class KvSpec:
+    bucket: str
+    history: int = 1
+    ttl: Optional[float] = None  # секунды
+
+    def config(self) -> KeyValueConfig:
+        return KeyValueConfig(bucket=self.bucket, history=self.history, ttl=self.ttl)
+
+
+# Состояние рассылок, общее для всех воркеров: лимит скорости Telegram и т.п.
+CAMPAIGNS_KV = "campaigns"
+
+KV_BUCKETS: tuple[KvSpec, ...] = (
+    KvSpec(bucket=CAMPAIGNS_KV),
+)
+
+
+def get_consumer_spec(durable: str) -> ConsumerSpec:
+    for spec in CONSUMERS:
+        if spec.durable == durable:
+            return spec
+    raise KeyError(durable)
+
+
+class NatsManager:
+    def __init__(self, url: str = NATS_URL) -> None:
+        self.url = url
+        self.nc = None
+        self.js = None
+        self.reconnects = 0
+        self.disconnects = 0
+        self._topology_ready = False
+        self._closing = False
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop_thread: Optional["_LoopThread"] = None
+
+    # --- соединение ---
+
+    async def _on_disconnected(self) -> None:
+        if self._closing:
+            return
+        self.disconnects += 1
+        logger.warning("NATS disconnected (%s times)", self.disconnects)
+
+    async def _on_reconnected(self) -> None:
+        self.reconnects += 1
+        logger.warning(
+            "NATS reconnected to %s (%s reconnects)",
+            self.nc.connected_url.netloc if self.nc and self.nc.connected_url else self.url,
+            self.reconnects,
+        )
+
+    async def _on_error(self, exc: Exception) -> None:
+        logger.error("NATS error: %s", exc)
+
+    async def _on_closed(self) -> None:
+        logger.info("NATS connection closed")
+
+    async def connect(self, ensure_topology: bool = False,
+                      timeout: Optional[float] = NATS_CONNECT_TIMEOUT):
+        """
+        Возвращает соединение процесса, при первом вызове подключается.
+        ensure_topology=True дополнительно создаёт/обновляет стримы, consumer'ы и KV-бакеты
+        (один раз на соединение) — это делает только владелец топологии, NATS listener бота.
+        Первое подключение ждёт не дольше timeout секунд (None — без ограничения),
+        затем NoServersError; после подключения переподключения бесконечны.
+        """
+        connected = self.nc is not None and not self.nc.is_closed
+        if connected and (self._topology_ready or not ensure_topology):
+            return self.nc
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.nc is None or self.nc.is_closed:
+                self._closing = False
+                nc = NATS()
+                try:
+                    await asyncio.wait_for(nc.connect(
+                        self.url,
+                        max_reconnect_attempts=-1,
+                        disconnected_cb=self._on_disconnected,
+                        reconnected_cb=self._on_reconnected,
+                        error_cb=self._on_error,
+                        closed_cb=self._on_closed,
+                    ), timeout)
+                except asyncio.TimeoutError:
+                    self._closing = True
+                    try:
+                        await nc.close()
+                    except Exception:
+                        # Транспорт так и не открылся — закрывать нечего.
+                        pass
+                    logger.warning("NATS %s is not reachable within %ss", self.url, timeout)
+                    raise NoServersError() from None
+                self.nc = nc
+                self.js = self.nc.jetstream()
+                self._topology_ready = False
+            if ensure_topology and not self._topology_ready:
+                await self._ensure_topology()
+                self._topology_ready = True
+        return self.nc
+
+    async def jetstream(self):
+        await self.connect()
+        return self.js
+
+    async def close(self) -> None:
+        if self.nc is not None and not self.nc.is_closed:
+            self._closing = True
+            await self.nc.drain()
+
+    def stats(self) -> dict:
+        return {
+            "connected": bool(self.nc and self.nc.is_connected),
+            "reconnects": self.reconnects,
+            "disconnects": self.disconnects,
+        }
+
+    # --- топология ---
+
+    async def _ensure_stream(self, spec: StreamSpec) -> None:
+        config = spec.config()
+        try:
+            info = await self.js.stream_info(spec.name)
+        except NotFoundError:
+            await self.js.add_stream(config=config)
+            logger.info("NATS stream %s created", spec.name)
+            return
+        current = info.config
+        if (sorted(current.subjects or []) != sorted(spec.subjects)
+                or current.max_msgs != spec.max_msgs
+                or (current.max_age or 0) != (spec.max_age or 0)):
+            await self.js.update_stream(config=config)
+            logger.info("NATS stream %s updated", spec.name)
+
+    async def _ensure_consumer(self, spec: ConsumerSpec) -> None:
+        try:
+            info = await self.js.consumer_info(spec.stream, spec.durable)
+        except NotFoundError:
+            info = None
+        if info is not None and info.config.deliver_subject:
+            # Раньше consumer'ы были push; в workqueue-стриме два consumer'а
+            # на один subject недопустимы, поэтому старый удаляем.
+            logger.info("Replacing push consumer %s with a pull consumer", spec.durable)
+            await self.js.delete_consumer(spec.stream, spec.durable)
+        await self.js.add_consumer(spec.stream, config=spec.config())
+
+    async def _ensure_key_value(self, spec: KvSpec) -> None:
+        try:
+            await self.js.key_value(spec.bucket)
+        except BucketNotFoundError:
+            await self.js.create_key_value(config=spec.config())
+            logger.info("NATS KV bucket %s created", spec.bucket)
+
+    async def _drop_stale_partitions(self) -> None:
+        """Удаляет consumer'ы партиций сверх PAYMENT_PARTITIONS, если в них ничего не осталось."""
+        configured = {spec.durable for spec in CONSUMERS}
+        for info in await self.js.consumers_info("payments"):
+            if not info.name.startswith(f"{PAYMENTS_DURABLE}_") or info.name in configured:
+                continue
+            if info.num_pending or info.num_ack_pending:
+                logger.warning(
+                    "Partition consumer %s is outside PAYMENT_PARTITIONS=%s but still has "
+                    "%s pending messages; keep the old partition count until it drains",
+                    info.name, PAYMENT_PARTITIONS, info.num_pending + info.num_ack_pending,
+                )
+                continue
+            await self.js.delete_consumer("payments", info.name)
+            logger.info(
+                "NATS consumer %s removed (PAYMENT_PARTITIONS=%s)", info.name, PAYMENT_PARTITIONS
+            )
+
+    async def _ensure_topology(self) -> None:
+        for stream in STREAMS:
+            await self._ensure_stream(stream)
+        for consumer in CONSUMERS:
+            await self._ensure_consumer(consumer)
+        for bucket in KV_BUCKETS:
+            await self._ensure_key_value(bucket)
+        await self._drop_stale_partitions()
+
+    # --- публикация/подписка ---
+
+    async def publish(self, subject: str, payload: bytes | BaseModel,
+                      headers: Optional[dict[str, str]] = None):
+        """
+        bytes публикуются как есть; события (pydantic-модели) — через конверт
+        common.event_codec, при необходимости несколькими сообщениями.
+        """
+        js = await self.jetstream()
+        if not isinstance(payload, BaseModel):
+            return await js.publish(subject, payload, headers=headers)
+        ack = None
+        for data, event_headers in encode_event(payload):
+            ack = await js.publish(subject, data, headers={**event_headers, **(headers or {})})
+        return ack
+
+    async def key_value(self, bucket: str):
+        js = await self.jetstream()
+        return await js.key_value(bucket)
+
+    async def pull_subscription(self, durable: str):
+        spec = get_consumer_spec(durable)
+        js = await self.jetstream()
+        return await js.pull_subscribe_bind(durable=spec.durable, stream=spec.stream)
+
+    def run_sync(self, coro, timeout: float = 10):
+        """Выполняет корутину с NATS из синхронного кода в фоновом event loop процесса."""
+        if self._loop_thread is None:
+            self._loop_thread = _LoopThread()
+        return self._loop_thread.run(coro, timeout)
+
+    def publish_sync(self, subject: str, payload: bytes | BaseModel,
+                     headers: Optional[dict[str, str]] = None, timeout: float = 10):
+        """Публикация из синхронного кода через фоновый event loop процесса."""
+        return self.run_sync(self.publish(subject, payload, headers), timeout)
+
+
+class _LoopThread:
+    """Event loop в отдельном потоке, в котором живёт NATS-соединение синхронного процесса."""
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._loop.run_forever, name="nats-loop", daemon=True
+                )
+                thread.start()
+            return self._loop
+
+    def run(self, coro, timeout: float):
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+nats_manager = NatsManager()
@@ -0,0 +1,104 @@
+"""
+Сегменты аудитории рассылок: именованные условия над users, subscriptions и payments.
+
+Определение сегмента (campaign_segments: kind + param) компилируется в SQL:
+`segment_query` — SELECT user_id для выборки получателей, `segment_count_query` —
+COUNT(*) по тому же условию для предпросмотра в админке (строки не читаются).
+Материализованный сегмент берёт получателей из campaign_segment_members, которую
+периодически обновляет `refresh_campaign_segments` в боте. Заблокировавшие бота
+(users.blocked_at) в сегменты не входят.
+
+Запросы — SQLAlchemy Core, поэтому одинаково выполняются в sync-сессии админки
+и в async-сессии бота.
+"""
+import datetime as dt
+from typing import Optional
+
+from sqlalchemy import ColumnElement, exists, func, select
+from sqlalchemy.sql import Select
+
+from common.models.campaigns_models import CampaignSegment, campaign_segment_members
+from common.models.payments_models import Payment
+from common.models.subscriptions_models import Subscription
+from common.models.users_models import User
+
+
+SEGMENT_ACTIVE = "active_subscribers"
+SEGMENT_EXPIRED = "expired_recently"
+SEGMENT_NEVER_PAID = "never_paid"
+SEGMENT_SOURCE = "source"
+
+SEGMENT_KINDS = {
+    SEGMENT_ACTIVE: "Активные подписчики",
+    SEGMENT_EXPIRED: "Подписка истекла за последние N дней (по умолчанию 30)",
+    SEGMENT_NEVER_PAID: "Ни разу не оплачивали",
+    SEGMENT_SOURCE: "Пришли из источника (параметр — значение source)",
+}
+
+EXPIRED_DEFAULT_DAYS = 30
+
+
+class SegmentError(ValueError):
+    pass
+
+
+def _has_active_subscription(now: dt.datetime) -> ColumnElement[bool]:
+    return exists().where(
+        Subscription.user_id == User.user_id,
+        Subscription.status == "active",
+        Subscription.end_at > now,
+    )
+
+
+def segment_condition(kind: str, param: Optional[str] = None,
+                      now: Optional[dt.datetime] = None) -> ColumnElement[bool]:
+    """Условие на строку users для сегмента; SegmentError — неизвестный вид или параметр."""
+    now = now or dt.datetime.now(dt.timezone.utc)
+    if kind == SEGMENT_ACTIVE:
+        return _has_active_subscription(now)
+    if kind == SEGMENT_EXPIRED:
+        try:
+            days = int(param) if param else EXPIRED_DEFAULT_DAYS
+        except ValueError:
+            raise SegmentError(f"Число дней должно быть целым: {param!r}")
+        expired = exists().where(
+            Subscription.user_id == User.user_id,
+            Subscription.status == "expired",
+            Subscription.end_at >= now - dt.timedelta(days=days),
+        )
+        # Продлившие подписку — уже активные, им «вернитесь» не нужно.
+        return expired & ~_has_active_subscription(now)
+    if kind == SEGMENT_NEVER_PAID:
+        return ~exists().where(Payment.user_id == User.user_id, Payment.status == "success")
+    if kind == SEGMENT_SOURCE:
+        if not param:
+            raise SegmentError("Для сегмента source нужен параметр — значение source")
+        return User.source == param
+    raise SegmentError(f"Неизвестный сегмент: {kind!r}")
+
+
+def segment_definition(segment: CampaignSegment, now: Optional[dt.datetime] = None) -> Select:
+    """user_id пользователей, подходящих под определение сегмента сейчас."""
+    return (
+        select(User.user_id.label("user_id"))
+        .where(segment_condition(segment.kind, segment.param, now), User.blocked_at.is_(None))
+    )
+
+
+def segment_query(segment: CampaignSegment, now: Optional[dt.datetime] = None) -> Select:
+    """user_id получателей сегмента: из материализованной таблицы или по определению."""
+    if segment.materialized:
+        return (
+            select(campaign_segment_members.c.user_id.label("user_id"))
+            .where(campaign_segment_members.c.segment_id == segment.id)
+        )
+    return segment_definition(segment, now)
+
+
+def segment_count_query(segment: CampaignSegment, now: Optional[dt.datetime] = None) -> Select:
+    """COUNT(*) по определению сегмента — для предпросмотра, без чтения строк."""
+    return (
+        select(func.count())
+        .select_from(User)
+        .where(segment_condition(segment.kind, segment.param, now), User.blocked_at.is_(None))
+    )
@@ -0,0 +1,162 @@
+"""
+Здоровье JetStream: стримы, durable-consumer'ы и очередь taskiq в метриках (common.metrics).
+
+Раз в NATS_HEALTH_INTERVAL секунд на каждый стрим — один stream_info, на каждый
+consumer — один consumer_info. Возраст самого старого необработанного сообщения
+запрашивается (STREAM.MSG.GET next_by_subj) только у consumer'ов с хвостом.
+
+Пороги алертов (NATS_ALERT_*) выставляют gauge nats_health_alert{target,check}=1
+и пишут WARNING при срабатывании / INFO при восстановлении.
+"""
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from nats.js.errors import NotFoundError
+
+from . import metrics
+from .nats_client import NatsManager
+
+
+logger = logging.getLogger(__name__)
+
+
+HEALTH_INTERVAL = float(os.getenv("NATS_HEALTH_INTERVAL") or "10")
+ALERT_LAG_SECONDS = float(os.getenv("NATS_ALERT_LAG_SECONDS") or "30")
+ALERT_PENDING = int(os.getenv("NATS_ALERT_PENDING") or "1000")
+ALERT_REDELIVERED = int(os.getenv("NATS_ALERT_REDELIVERED") or "50")
+ALERT_STORAGE_RATIO = float(os.getenv("NATS_ALERT_STORAGE_RATIO") or "0.8")
+
+STREAM_MESSAGES = metrics.gauge("nats_stream_messages", "Сообщений в стриме", ("stream",))
+STREAM_BYTES = metrics.gauge("nats_stream_bytes", "Размер стрима в байтах", ("stream",))
+STREAM_USAGE = metrics.gauge(
+    "nats_stream_usage_ratio", "Заполненность стрима относительно max_msgs/max_bytes", ("stream",)
+)
+CONSUMER_PENDING = metrics.gauge(
+    "nats_consumer_pending", "Сообщений ещё не доставлено consumer'у", ("consumer",)
+)
+CONSUMER_ACK_PENDING = metrics.gauge(
+    "nats_consumer_ack_pending", "Доставлено, но не подтверждено", ("consumer",)
+)
+CONSUMER_REDELIVERED = metrics.gauge(
+    "nats_consumer_redelivered", "Сообщений доставлено повторно", ("consumer",)
+)
+CONSUMER_LAG = metrics.gauge(
+    "nats_consumer_lag_seconds", "Возраст самого старого необработанного сообщения", ("consumer",)
+)
+HEALTH_ALERT = metrics.gauge(
+    "nats_health_alert", "1 — сработал порог NATS_ALERT_*", ("target", "check")
+)
+HEALTH_UP = metrics.gauge("nats_health_up", "1 — последний опрос JetStream успешен")
+
+
+@dataclass(frozen=True)
+class WatchedConsumer:
+    stream: str
+    durable: str
+
+
+def _parse_time(value: str) -> dt.datetime:
+    # RFC3339 с наносекундами: 2024-01-01T00:00:00.123456789Z
+    value = value.rstrip("Z")
+    if "." in value:
+        head, fraction = value.split(".", 1)
+        value = f"{head}.{fraction[:6]}"
+    return dt.datetime.fromisoformat(value).replace(tzinfo=dt.timezone.utc)
+
+
+class StreamHealth:
+    def __init__(self, manager: NatsManager, streams: list[str],
+                 consumers: list[WatchedConsumer]) -> None:
+        self.manager = manager
+        self.streams = streams
+        self.consumers = consumers
+        self._alerts: set[tuple[str, str]] = set()
+
+    def _check(self, target: str, check: str, failed: bool, details: str) -> None:
+        key = (target, check)
+        HEALTH_ALERT.set(1 if failed else 0, target=target, check=check)
+        if failed and key not in self._alerts:
+            self._alerts.add(key)
+            logger.warning("JetStream alert %s/%s: %s", target, check, details)
+        elif not failed and key in self._alerts:
+            self._alerts.discard(key)
+            logger.info("JetStream alert %s/%s resolved: %s", target, check, details)
+
+    async def _oldest_age(self, stream: str, filter_subject: Optional[str],
+                          from_seq: int) -> float:
+        nc = await self.manager.connect()
+        request = {"seq": from_seq, "next_by_subj": filter_subject or ">"}
+        resp = await nc.request(
+            f"$JS.API.STREAM.MSG.GET.{stream}", json.dumps(request).encode(), timeout=2
+        )
+        message = json.loads(resp.data).get("message")
+        if not message:
+            return 0.0
+        age = dt.datetime.now(dt.timezone.utc) - _parse_time(message["time"])
+        return max(0.0, age.total_seconds())
+
+    async def poll_stream(self, name: str) -> None:
+        js = await self.manager.jetstream()
+        info = await js.stream_info(name)
+        state, config = info.state, info.config
+        STREAM_MESSAGES.set(state.messages, stream=name)
+        STREAM_BYTES.set(state.bytes, stream=name)
+
+        ratios = [0.0]
+        if config.max_msgs and config.max_msgs > 0:
+            ratios.append(state.messages / config.max_msgs)
+        if config.max_bytes and config.max_bytes > 0:
+            ratios.append(state.bytes / config.max_bytes)
+        usage = max(ratios)
+        STREAM_USAGE.set(usage, stream=name)
+        self._check(name, "storage", usage >= ALERT_STORAGE_RATIO, f"usage={usage:.0%}")
+
+    async def poll_consumer(self, consumer: WatchedConsumer) -> None:
+        js = await self.manager.jetstream()
+        info = await js.consumer_info(consumer.stream, consumer.durable)
+        name = consumer.durable
+        pending = info.num_pending or 0
+        ack_pending = info.num_ack_pending or 0
+        redelivered = info.num_redelivered or 0
+        CONSUMER_PENDING.set(pending, consumer=name)
+        CONSUMER_ACK_PENDING.set(ack_pending, consumer=name)
+        CONSUMER_REDELIVERED.set(redelivered, consumer=name)
+
+        lag = 0.0
+        if pending or ack_pending:
+            floor = info.ack_floor.stream_seq if info.ack_floor else 0
+            lag = await self._oldest_age(
+                consumer.stream, info.config.filter_subject, (floor or 0) + 1
+            )
+        CONSUMER_LAG.set(lag, consumer=name)
+
+        self._check(name, "lag", lag >= ALERT_LAG_SECONDS, f"oldest message {lag:.0f}s")
+        self._check(name, "pending", pending >= ALERT_PENDING, f"pending={pending}")
+        self._check(
+            name, "redelivered", redelivered >= ALERT_REDELIVERED, f"redelivered={redelivered}"
+        )
+
+    async def poll(self) -> None:
+        results = await asyncio.gather(
+            *(self.poll_stream(name) for name in self.streams),
+            *(self.poll_consumer(consumer) for consumer in self.consumers),
+            return_exceptions=True,
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors:
+            if isinstance(error, NotFoundError):
+                # Стрим taskiq создаётся брокером позже, consumer — при первом воркере.
+                logger.debug("JetStream health: %s", error)
+            else:
+                logger.warning("JetStream health poll failed: %s", error)
+        HEALTH_UP.set(0 if any(not isinstance(e, NotFoundError) for e in errors) else 1)
+
+    async def run(self, interval: float = HEALTH_INTERVAL) -> None:
+        while True:
+            await self.poll()
+            await asyncio.sleep(interval)
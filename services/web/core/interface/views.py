@@ -7,6 +7,7 @@ from flask_admin.form import FileUploadField, ImageUploadField
 from flask_admin.menu import MenuLink
 from flask_admin.menu import MenuView as AdminMenuView
 from flask_login import current_user, login_user, logout_user
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from wtforms import BooleanField, TextAreaField
 from wtforms.validators import ValidationError
@@ -17,6 +18,7 @@ from core.database.database import db
 import forms
 from common.models.admin_models import AdminModel
 from common.models.interface_models import Button, Menu, Message
+from common.models.stats_models import DailyUserStats
 
 from core.interface.services import ButtonRepository, MenuRepository, MessageRepository
 
@@ -394,12 +396,8 @@ class MyMenuView(AdminMenuView):
 
     @property
     def users_count(self):
-        # return (
-        #     self.session.query(User)
-        #     .filter(User.status == UserStatus.REGISTERED.name)
-        #     .count()
-        # )
-        return 0
+        # Сумма по дневному роллапу, а не count(*) по users на каждой отрисовке меню.
+        return db.session.query(func.coalesce(func.sum(DailyUserStats.new), 0)).scalar()
 
 
 class MyFileAdmin(FileAdmin):
@@ -9,6 +9,7 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 
 from core.database.database import db
 from common.models.admin_models import AdminModel
+from common.models.campaigns_models import CampaignSegment
 from common.models.interface_models import Button, Menu, Message
 from common.models.models import Settings
 from common.models.users_models import SendMessageCampaign, User
@@ -48,9 +49,10 @@ def create_app() -> Flask:
         MyMenuView,
         SettingsView
     )
-    from modules.campaign.views import CampaignView
+    from modules.campaign.views import CampaignView, SegmentView
     from modules.user.views import AdminView, UserView
     from modules.subscriptions.views import SubscriptionView, SubscriptionAccessView
+    from modules.stats.views import PaymentLatencyView, StatsView
 
     class MyAdmin(Admin):
         """
@@ -69,10 +71,13 @@ def create_app() -> Flask:
     admin.add_view(UserView(User, db.session, name='Пользователи'))
     admin.add_view(SubscriptionView(Subscription, db.session, name='Подписки', category='Подписки'))
     admin.add_view(SubscriptionAccessView(SubscriptionAccess, db.session, name='Доступы', category='Подписки'))
+    admin.add_view(StatsView(name='Статистика', endpoint='stats'))
+    admin.add_view(PaymentLatencyView(name='Оплата → доступ', endpoint='payment_latency'))
     admin.add_view(MessageView(Message, db.session, name='Сообщения'))
     admin.add_view(MenuView(Menu, db.session, name='Меню'))
     admin.add_view(ButtonView(Button, db.session, name='Кнопки'))
     admin.add_view(CampaignView(SendMessageCampaign, db.session, name='Рассылка'))
+    admin.add_view(SegmentView(CampaignSegment, db.session, name='Сегменты рассылок'))
     admin.add_view(SettingsView(Settings, db.session, name='Настройки'))
     admin.add_view(AdminView(AdminModel, db.session, name='Админ'))
 
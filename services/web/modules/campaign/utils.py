@@ -1,11 +1,11 @@
 import logging
 
-import nats
-from nats.js.api import StreamConfig
 from sqlalchemy import and_
 
 from core.database.database import db
+from common.campaign_progress import CampaignProgress, read_progress
 from common.events import SendCampaignEvent
+from common.nats_client import CAMPAIGNS_KV, nats_manager
 from common.models.interface_models import Button, Menu
 
 
@@ -35,32 +35,39 @@ def get_menus_without_variable_buttons():
     return query.all()
 
 
-async def publish_send_campaign_event(event: SendCampaignEvent):
+def publish_send_campaign_event(event: SendCampaignEvent):
     try:
-        nc = await nats.connect("nats://nats:4222")
-        js = nc.jetstream()
-
-        # Создаем стрим, если он еще не существует
-        stream_config = StreamConfig(
-            name="campaigns",
-            subjects=["campaign.send"],
-            retention="workqueue",
-            max_msgs=10000
-        )
+        nats_manager.publish_sync("campaign.send", event)
+    except Exception as e:
+        logger.error(f"Ошибка при публикации события: {e}")
+        raise
 
-        try:
-            # Пробуем создать стрим
-            await js.add_stream(config=stream_config)
-        except nats.js.errors.APIError as e:
-            # Игнорируем ошибку, если стрим уже существует
-            if not "stream name already in use" in str(e):
-                raise
 
-        # Публикуем событие
-        payload = event.model_dump_json().encode()
-        await js.publish("campaign.send", payload)
+def get_campaigns_progress(campaign_ids) -> dict[int, CampaignProgress]:
+    """Прогресс кампаний из NATS KV; если NATS недоступен — пусто, список всё равно открывается."""
+    async def _read():
+        kv = await nats_manager.key_value(CAMPAIGNS_KV)
+        return await read_progress(kv, campaign_ids)
 
-        await nc.close()
+    try:
+        return nats_manager.run_sync(_read(), timeout=3)
     except Exception as e:
-        logger.error(f"Ошибка при публикации события: {e}")
-        raise
+        logger.warning(f"Не удалось получить прогресс рассылок: {e}")
+        return {}
+
+
+def format_progress(progress: CampaignProgress) -> str:
+    parts = [f'{progress.sent} из {progress.total}']
+    if progress.blocked or progress.not_found:
+        parts.append(f'заблокировали {progress.blocked + progress.not_found}')
+    if progress.transient or progress.failed:
+        parts.append(f'ошибки {progress.transient + progress.failed}')
+    if progress.remaining:
+        parts.append(f'осталось {progress.remaining}')
+        parts.append(f'{progress.rate:.1f} сообщ./с')
+        eta = progress.eta_seconds
+        if eta is not None:
+            hours, rest = divmod(int(eta), 3600)
+            parts.append(f'≈ {hours} ч {rest // 60} мин' if hours
+                         else f'≈ {rest // 60} мин {rest % 60} с')
+    return ', '.join(parts)
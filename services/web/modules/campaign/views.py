@@ -1,21 +1,24 @@
-from asgiref.sync import async_to_sync
-import ast
 import datetime as dt
 import logging
-import threading
 
+from flask import flash, g
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
 from flask_login import current_user
+from markupsafe import Markup
 from wtforms import TextAreaField
-
-from .message_campaign import MessageCampaign, TelegramMessageSender
-from .utils import get_menus_without_variable_buttons
+from wtforms.validators import ValidationError
+
+from .utils import (
+    format_progress,
+    get_campaigns_progress,
+    get_menus_without_variable_buttons,
+    publish_send_campaign_event,
+)
 import core.constants.config as config
-from core.database.database import db
 import forms
-from core.interface.services import BotInterfaceService
-from common.models.users_models import SendMessageCampaign, User
-from core.utils.mq_bot import get_mq_bot
+from common.events import SendCampaignEvent
+from common.segments import SEGMENT_KINDS, SegmentError, segment_condition, segment_count_query
 
 
 logging.basicConfig(
@@ -34,24 +37,31 @@ class CampaignView(ModelView):
 
     column_display_pk = True
     column_default_sort = ('date', True)
-    column_list = ('id', 'name', 'date', 'status')
+    column_list = ('id', 'name', 'date', 'status', 'progress')
     create_modal_template = 'admin/campaign/create-modal.html'
 
     column_labels = dict(name='Название',
                          date='Время',
                          status='Статус',
+                         progress='Прогресс',
                          send_to='Кому',
+                         segment='Сегмент',
                          text='Текст',
+                         preview='Превью ссылок',
+                         send_post='Отправить постом',
                          button_text='Текст кнопки',
                          button_url='Ссылка кнопки')
 
     column_descriptions = dict(
         send_to='Список юзеров, которым отправлять рассылку. Если пусто, то отправляет по всем юзерам.',
-        send_post='Если стоит галка, то отправляется пост. Если галки нет, то отправляется сообщение из бота юзерам',
+        send_post='Если стоит галка, то пост публикуется в канале и его копия отправляется юзерам. '
+                  'Если галки нет, то отправляется сообщение из бота юзерам',
+        preview='Показывать превью ссылок в тексте рассылки',
+        segment='Сегмент аудитории (раздел «Сегменты рассылок»). Если задан, поле «Кому» не используется.',
         files='Список файлов')
 
-    form_columns = ('name', 'send_to', 'text',
-                    'menu', 'files')
+    form_columns = ('name', 'segment', 'send_to', 'text',
+                    'menu', 'files', 'preview', 'send_post')
 
     form_overrides = dict(text=TextAreaField,
                           files=forms.MultipleFileUploadField)
@@ -68,56 +78,107 @@ class CampaignView(ModelView):
                      menu=dict(query_factory=lambda: get_menus_without_variable_buttons())
                     )
 
-    def on_model_change(self, form, model, is_created):
-        model.date = dt.datetime.now()
+    column_formatters = dict(
+        progress=lambda v, c, m, p: v._format_progress(m),
+    )
 
-    def get_recipients_list(self, model):
-        if model.send_to:
-            return (user.user_id for user in model.send_to)
-        return (user.user_id for user in self.session.query(User))
-
-    def _get_markup(self, menu):
-        if not menu:
-            return
-        bi = BotInterfaceService(db.session)
-        return bi.get_keyboard(menu=menu)
-
-    def _send_campaign(self, sender, session, app, campaign_id):
-        with app.app_context():
-            logging.info('Начало отправления рассылки...')
-
-            # заново отбираем, т.к. если передавать
-            # модель сразу, то возникают ошибки сессии
-            campaign = (
-                session.query(SendMessageCampaign)
-                .get(campaign_id)
-            )
-            camp = MessageCampaign(sender, campaign, session=session)
-            async_to_sync(camp.send)()
+    def get_list(self, *args, **kwargs):
+        count, data = super().get_list(*args, **kwargs)
+        # Прогресс страницы — параллельными kv.get по кампаниям за один вызов run_sync,
+        # без запросов к журналу доставки.
+        g.campaigns_progress = get_campaigns_progress([model.id for model in data])
+        return count, data
 
-            logging.info('Конец отправления рассылки...')
-            session.commit()
+    def _format_progress(self, model):
+        progress = getattr(g, 'campaigns_progress', {}).get(model.id)
+        return format_progress(progress) if progress else ''
+
+    def on_model_change(self, form, model, is_created):
+        model.date = dt.datetime.now()
 
     def after_model_change(self, form, model, is_created):
-        sender = TelegramMessageSender(
-            name=model.name,
-            text=model.text,
-            preview=model.preview,
-            send_post=model.send_post,
-            reply_markup=self._get_markup(model.menu),
-            files_list=ast.literal_eval(model.files),
-            recipients=self.get_recipients_list(model),
-            bot=get_mq_bot()
-        )
-
-        t = threading.Thread(
-            None, self._send_campaign,
-            args=[sender, self.session, self.admin.app, model.id]
-        )
-        t.start()
+        # Рассылку делят на шарды и отправляют воркеры taskiq бота;
+        # кампанию отмечает завершённой задача, закончившая последний шард.
+        try:
+            publish_send_campaign_event(
+                SendCampaignEvent(campaign_id=model.id, text=model.text or '')
+            )
+        except Exception:
+            logger.exception('Не удалось поставить рассылку %s в очередь', model.id)
+            # Шардов ещё нет — действие «Продолжить» спланирует рассылку заново.
+            flash('Не удалось поставить рассылку в очередь, '
+                  'запустите её действием «Продолжить»', 'error')
+
+    def _publish_action(self, ids, action_name: str, done_message: str):
+        failed = []
+        for campaign_id in ids:
+            try:
+                publish_send_campaign_event(
+                    SendCampaignEvent(campaign_id=int(campaign_id), action=action_name)
+                )
+            except Exception:
+                logger.exception('Не удалось отправить %s для рассылки %s',
+                                 action_name, campaign_id)
+                failed.append(str(campaign_id))
+        if failed:
+            flash(f'Не удалось поставить в очередь рассылки: {", ".join(failed)}', 'error')
+        else:
+            flash(done_message, 'success')
+
+    @action('resume', 'Продолжить', 'Продолжить отправку выбранных рассылок с места остановки?')
+    def action_resume(self, ids):
+        # Получатели из журнала доставки повторно сообщение не получат.
+        self._publish_action(ids, 'resume', 'Рассылки продолжатся')
+
+    @action('retry', 'Повторить ошибки',
+            'Повторить отправку получателям, которым не ушло из-за временных ошибок?')
+    def action_retry(self, ids):
+        self._publish_action(ids, 'retry', 'Повтор временных ошибок поставлен в очередь')
 
     def is_visible(self):
         return False
 
     def is_accessible(self):
         return current_user.is_authenticated
+
+
+class SegmentView(ModelView):
+    column_display_pk = True
+    column_list = ('id', 'name', 'kind', 'param', 'preview', 'materialized',
+                   'member_count', 'refreshed_at')
+
+    column_labels = dict(name='Название',
+                         kind='Вид',
+                         param='Параметр',
+                         preview='Сейчас в сегменте',
+                         materialized='Материализован',
+                         member_count='В таблице',
+                         refreshed_at='Обновлён')
+
+    column_descriptions = dict(
+        param='Для «истекла за N дней» — число дней, для source — значение source',
+        materialized='Состав хранится в таблице и обновляется ботом раз в 15 минут',
+        preview='COUNT по определению сегмента на текущий момент')
+
+    form_columns = ('name', 'kind', 'param', 'materialized')
+    form_choices = dict(kind=list(SEGMENT_KINDS.items()))
+
+    column_formatters = dict(
+        kind=lambda v, c, m, p: SEGMENT_KINDS.get(m.kind, m.kind),
+        preview=lambda v, c, m, p: v._preview_count(m),
+    )
+
+    def _preview_count(self, model):
+        try:
+            return self.session.execute(segment_count_query(model)).scalar()
+        except SegmentError as e:
+            return Markup('<span class="text-danger">{}</span>').format(str(e))
+
+    def on_model_change(self, form, model, is_created):
+        try:
+            segment_condition(model.kind, model.param)
+        except SegmentError as e:
+            raise ValidationError(str(e))
+
+    def is_accessible(self):
+        return current_user.is_authenticated
@@ -1,30 +1,19 @@
 import logging
 
-import nats
-from nats.js.api import StreamConfig
+from typing import Optional
 
+from common import latency
 from common.events import PaymentSucceededEvent
+from common.nats_client import nats_manager, payment_subject
 
 logger = logging.getLogger(__name__)
 
 
-async def publish_payment_succeeded_event(event: PaymentSucceededEvent) -> None:
-    nc = await nats.connect("nats://nats:4222")
-    js = nc.jetstream()
-
-    stream_config = StreamConfig(
-        name="payments",
-        subjects=["payment.succeeded"],
-        retention="workqueue",
-        max_msgs=100000,
+def publish_payment_succeeded_event(event: PaymentSucceededEvent,
+                                    stamps: Optional[dict[str, float]] = None) -> None:
+    # Соединение и стрим общие на процесс (common.nats_client), здесь — только publish.
+    # Отметки этапов (common.latency) едут в заголовках до consumer'а бота.
+    stamps = latency.stamp(dict(stamps or {}), "event_published")
+    nats_manager.publish_sync(
+        payment_subject(event.user_id), event, headers=latency.to_headers(stamps)
     )
-    try:
-        await js.add_stream(config=stream_config)
-    except nats.js.errors.APIError as exc:
-        if "stream name already in use" not in str(exc):
-            raise
-
-    payload = event.model_dump_json().encode("utf-8")
-    await js.publish("payment.succeeded", payload)
-    await nc.close()
-
@@ -1,4 +1,3 @@
-import asyncio
 import datetime as dt
 import hashlib
 import hmac
@@ -9,11 +8,14 @@ from decimal import Decimal
 from typing import Any
 
 from flask import Blueprint, Response, jsonify, request
+from sqlalchemy.exc import IntegrityError
 
 logger = logging.getLogger(__name__)
 
+from common import latency
+from common.cryptopay import crypto_pay
 from common.models.models import Settings
-from common.models.payments_models import Payment
+from common.models.payments_models import Payment, PaymentCallback
 from core.database.database import db
 
 from .nats_publish import publish_payment_succeeded_event
@@ -74,6 +76,65 @@ def _tariff_amount_kzt() -> Any:
     )
     return parse_decimal(val_str)
 
+def _idempotency_window() -> dt.timedelta:
+    """Сколько времени повторные нажатия «Оплатить» получают тот же открытый счёт."""
+    seconds = int(os.getenv("PAYMENT_IDEMPOTENCY_WINDOW_SECONDS") or "900")
+    return dt.timedelta(seconds=seconds)
+
+
+def _find_open_payment(user_id: int, provider: str, amount: Decimal) -> Payment | None:
+    # Попадает в частичный уникальный индекс uq_payments_open_invoice.
+    return (
+        db.session.query(Payment)
+        .filter(Payment.user_id == user_id)
+        .filter(Payment.provider == provider)
+        .filter(Payment.amount == amount)
+        .filter(Payment.status == "pending")
+        .one_or_none()
+    )
+
+
+def _open_payment(
+    user_id: int, provider: str, amount: Decimal, currency: str
+) -> tuple[Payment, bool]:
+    """
+    Возвращает (payment, created): открытый неистёкший pending-платёж пользователя
+    или новый, если такого нет. Новый платёж только добавляется во flush —
+    коммит делает вызывающий код, когда ссылка на оплату готова.
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    existing = _find_open_payment(user_id, provider, amount)
+    if existing and existing.expires_at and existing.expires_at > now:
+        return existing, False
+
+    if existing:
+        # Окно переиспользования прошло — закрываем старый счёт, чтобы освободить индекс.
+        # Ссылка у провайдера остаётся рабочей: оплату по ней без ResultURL находит
+        # payments_reconcile_robokassa_pending, проверяя и недавно отменённые счета.
+        existing.status = "canceled"
+        db.session.flush()
+
+    payment = Payment(
+        user_id=user_id,
+        provider=provider,
+        amount=amount,
+        currency=currency,
+        status="pending",
+        expires_at=now + _idempotency_window(),
+    )
+    db.session.add(payment)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Параллельный запрос того же пользователя успел создать счёт первым.
+        db.session.rollback()
+        existing = _find_open_payment(user_id, provider, amount)
+        if existing is None:
+            raise
+        return existing, False
+    return payment, True
+
+
 def _verify_cryptobot_signature(raw_body: bytes, signature_hex: str, token: str) -> bool:
     """
     Верификация webhook Crypto Pay API:
@@ -89,36 +150,24 @@ def _verify_cryptobot_signature(raw_body: bytes, signature_hex: str, token: str)
     return hmac.compare_digest(digest, signature_hex.strip().lower())
 
 
-@payments_bp.post("/payments/robokassa/create")
-def robokassa_create():
+def create_robokassa_payment(user_id: int) -> tuple[dict[str, Any], int]:
     """
-    Внутренний эндпойнт. Бот вызывает его, чтобы получить ссылку оплаты.
+    Создаёт (или переиспользует) платёж Robokassa и ссылку оплаты.
+    Возвращает (тело ответа, HTTP-статус): используется и HTTP-эндпойнтом, и NATS RPC.
     """
-    _require_internal_token()
-
-    data = request.get_json(silent=True) or {}
-    user_id_raw = data.get("user_id")
-    try:
-        user_id = int(user_id_raw)
-    except (TypeError, ValueError):
-        return jsonify({"error": "invalid_user_id"}), 400
-
     merchant_login = (os.getenv("ROBO_MERCHANT_LOGIN") or "").strip()
     password1 = (os.getenv("ROBO_PASSWORD_1") or "").strip()
     if not merchant_login or not password1:
-        return jsonify({"error": "robokassa_not_configured"}), 500
+        return {"error": "robokassa_not_configured"}, 500
 
     amount = _tariff_amount_kzt()
 
-    payment = Payment(
-        user_id=user_id,
-        provider="robokassa",
-        amount=amount,
-        currency="KZT",
-        status="pending",
-    )
-    db.session.add(payment)
-    db.session.commit()
+    payment, created = _open_payment(user_id, "robokassa", amount, "KZT")
+    if not created and payment.payment_url:
+        logger.info(
+            "Robokassa payment reused: inv_id=%s, user_id=%s", payment.id, user_id
+        )
+        return {"inv_id": payment.id, "payment_url": payment.payment_url}, 200
 
     logger.info(
         "Robokassa payment created in DB: inv_id=%s, user_id=%s, amount=%s",
@@ -141,10 +190,30 @@ def robokassa_create():
         description=description,
         shp=shp,
     )
+    payment.payment_url = payment_url
+    db.session.commit()
 
     logger.info("Robokassa payment link generated: inv_id=%s, url=%s", inv_id, payment_url)
 
-    return jsonify({"inv_id": inv_id, "payment_url": payment_url})
+    return {"inv_id": inv_id, "payment_url": payment_url}, 200
+
+
+@payments_bp.post("/payments/robokassa/create")
+def robokassa_create():
+    """
+    Внутренний эндпойнт. Бот вызывает его, чтобы получить ссылку оплаты.
+    """
+    _require_internal_token()
+
+    data = request.get_json(silent=True) or {}
+    user_id_raw = data.get("user_id")
+    try:
+        user_id = int(user_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid_user_id"}), 400
+
+    body, status = create_robokassa_payment(user_id)
+    return jsonify(body), status
 
 
 @payments_bp.post("/payments/robokassa/result")
@@ -153,6 +222,7 @@ def robokassa_result():
     ResultURL callback. Подтверждение оплаты делаем только по нему.
     Должны ответить Robokassa текстом: OK{InvId}.
     """
+    stamps = latency.stamp({}, "callback_received")
     _enforce_robokassa_ip_allowlist()
 
     # Robokassa шлёт параметры как form (обычно POST).
@@ -235,8 +305,11 @@ def robokassa_result():
     payment.status = "success"
     payment.signature_verified = True
     payment.paid_at = now
-    payment.raw_callback = {k: v for k, v in form.items()}
+    db.session.add(PaymentCallback(
+        payment_id=payment.id, source="robokassa_result", payload={k: v for k, v in form.items()}
+    ))
     db.session.commit()
+    latency.stamp(stamps, "payment_committed")
 
     event = PaymentSucceededEvent(
         payment_id=payment.id,
@@ -246,30 +319,21 @@ def robokassa_result():
         currency=payment.currency,
         paid_at=now,
     )
-    asyncio.run(publish_payment_succeeded_event(event))
+    publish_payment_succeeded_event(event, stamps)
 
     logger.info("Robokassa payment successful: inv_id=%s", inv_id)
 
     return Response(f"OK{inv_id}", mimetype="text/plain")
 
 
-@payments_bp.post("/payments/cryptobot/create")
-def cryptobot_create():
+def create_cryptobot_payment(user_id: int) -> tuple[dict[str, Any], int]:
     """
-    Внутренний эндпойнт. Бот вызывает его, чтобы получить ссылку оплаты в TON через CryptoBot.
+    Создаёт (или переиспользует) платёж и invoice CryptoBot.
+    Возвращает (тело ответа, HTTP-статус): используется и HTTP-эндпойнтом, и NATS RPC.
     """
-    _require_internal_token()
-
-    data = request.get_json(silent=True) or {}
-    user_id_raw = data.get("user_id")
-    try:
-        user_id = int(user_id_raw)
-    except (TypeError, ValueError):
-        return jsonify({"error": "invalid_user_id"}), 400
-
     token = (os.getenv("CRYPTOBOT_TOKEN") or "").strip()
     if not token:
-        return jsonify({"error": "cryptobot_not_configured"}), 500
+        return {"error": "cryptobot_not_configured"}, 500
 
     amount = _tariff_amount_kzt()
     description = _get_setting_value(
@@ -277,27 +341,34 @@ def cryptobot_create():
         os.getenv("CRYPTOBOT_DESCRIPTION", "Подписка на 30 дней"),
     )
 
-    # 1) Создаём запись Payment в KZT.
-    payment = Payment(
-        user_id=user_id,
-        provider="cryptobot",
-        amount=amount,
-        currency="KZT",
-        status="pending",
-    )
-    db.session.add(payment)
+    # 1) Создаём запись Payment в KZT (или переиспользуем открытый счёт без запроса к CryptoBot).
+    payment, created = _open_payment(user_id, "cryptobot", amount, "KZT")
+    if not created:
+        if not payment.payment_url:
+            # Счёт создаётся параллельным запросом прямо сейчас.
+            return {"error": "payment_in_progress"}, 409
+        return (
+            {
+                "payment_id": payment.id,
+                "invoice_id": payment.provider_invoice_id,
+                "pay_url": payment.payment_url,
+                "bot_invoice_url": None,
+                "web_app_invoice_url": None,
+            },
+            200,
+        )
     db.session.commit()
 
     payload = f"pay:{payment.id}"
 
     # 2) Создаём invoice в CryptoBot в фиате (KZT), оплата в TON по курсу.
     try:
-        from aiosend import CryptoPay
+        import aiosend  # noqa: F401
     except Exception as exc:
-        return jsonify({"error": f"aiosend_not_available:{exc}"}), 500
+        return {"error": f"aiosend_not_available:{exc}"}, 500
 
     try:
-        cp = CryptoPay(token=token)
+        cp = crypto_pay(token)
         # Метод create_invoice возвращает готовый объект Invoice, а не корутину.
         invoice = cp.create_invoice(
             amount=float(amount),
@@ -306,29 +377,53 @@ def cryptobot_create():
             accepted_assets=["TON"],
             description=description,
             payload=payload,
+            # Инвойс живёт ровно столько, сколько мы готовы его переиспользовать.
+            expires_in=int(_idempotency_window().total_seconds()),
         )
     except Exception as exc:
         # Если invoice не создался — помечаем payment как failed (чтобы не оставлять вечные pending).
         payment.status = "failed"
-        payment.raw_callback = {"error": str(exc)}
+        db.session.add(PaymentCallback(
+            payment_id=payment.id, source="cryptobot_create_error", payload={"error": str(exc)}
+        ))
         db.session.commit()
-        return jsonify({"error": f"cryptobot_create_invoice_failed:{exc}"}), 502
+        return {"error": f"cryptobot_create_invoice_failed:{exc}"}, 502
 
     payment.provider_invoice_id = str(invoice.invoice_id)
     payment.provider_payload = payload
+    payment.payment_url = invoice.mini_app_invoice_url
     db.session.commit()
 
-    return jsonify(
+    return (
         {
             "payment_id": payment.id,
             "invoice_id": invoice.invoice_id,
             "pay_url": invoice.mini_app_invoice_url,
             "bot_invoice_url": invoice.bot_invoice_url,
             "web_app_invoice_url": invoice.web_app_invoice_url,
-        }
+        },
+        200,
     )
 
 
+@payments_bp.post("/payments/cryptobot/create")
+def cryptobot_create():
+    """
+    Внутренний эндпойнт. Бот вызывает его, чтобы получить ссылку оплаты в TON через CryptoBot.
+    """
+    _require_internal_token()
+
+    data = request.get_json(silent=True) or {}
+    user_id_raw = data.get("user_id")
+    try:
+        user_id = int(user_id_raw)
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid_user_id"}), 400
+
+    body, status = create_cryptobot_payment(user_id)
+    return jsonify(body), status
+
+
 @payments_bp.post("/payments/cryptobot/webhook")
 def cryptobot_webhook():
     """
@@ -338,6 +433,7 @@ def cryptobot_webhook():
     - update_type == invoice_paid
     - payload содержит Invoice
     """
+    stamps = latency.stamp({}, "callback_received")
     token = (os.getenv("CRYPTOBOT_TOKEN") or "").strip()
     if not token:
         return jsonify({"error": "cryptobot_not_configured"}), 500
@@ -440,9 +536,7 @@ def cryptobot_webhook():
     # Доп. верификация через API: подтягиваем invoice и убеждаемся, что он реально PAID.
     # Если API CryptoBot недоступен, но подпись вебхука верна — засчитываем оплату (fail-safe).
     try:
-        from aiosend import CryptoPay
-
-        cp = CryptoPay(token=token)
+        cp = crypto_pay(token)
         # Метод get_invoices синхронный.
         invoices = cp.get_invoices(invoice_ids=[invoice_id_int])
         inv = invoices[0] if invoices else None
@@ -462,8 +556,11 @@ def cryptobot_webhook():
     payment.provider_payload = payment.provider_payload or (
         invoice_payload if isinstance(invoice_payload, str) else None
     )
-    payment.raw_callback = {"update": data}
+    db.session.add(PaymentCallback(
+        payment_id=payment.id, source="cryptobot_webhook", payload={"update": data}
+    ))
     db.session.commit()
+    latency.stamp(stamps, "payment_committed")
 
     event = PaymentSucceededEvent(
         payment_id=payment.id,
@@ -474,7 +571,7 @@ def cryptobot_webhook():
         paid_at=now,
     )
     try:
-        asyncio.run(publish_payment_succeeded_event(event))
+        publish_payment_succeeded_event(event, stamps)
     except Exception as exc:
         logger.error(
             "CryptoBot webhook: payment saved but NATS publish failed (payment_id=%s): %s",
@@ -0,0 +1,136 @@
+import datetime as dt
+
+from flask import request
+from flask_admin import BaseView, expose
+from flask_login import current_user
+from sqlalchemy import func
+
+from core.database.database import db
+from common import latency
+from common.models.payments_models import PaymentLatency
+from common.models.stats_models import (
+    DailyPaymentStats,
+    DailySubscriptionStats,
+    DailyUserStats,
+    StatsWatermark,
+)
+
+
+class StatsView(BaseView):
+    """
+    Статистика по дневным роллапам (stats_daily_*), которые обновляет задача бота
+    stats_rollups_refresh. Исходные таблицы здесь не читаются.
+    """
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    @expose('/')
+    def index(self):
+        days = 30
+        since_day = dt.datetime.now(dt.timezone.utc).date() - dt.timedelta(days=days - 1)
+
+        payments = (
+            db.session.query(
+                DailyPaymentStats.day,
+                DailyPaymentStats.provider,
+                DailyPaymentStats.currency,
+                func.sum(DailyPaymentStats.count),
+                func.sum(DailyPaymentStats.amount),
+            )
+            .filter(DailyPaymentStats.day >= since_day, DailyPaymentStats.status == 'success')
+            .group_by(DailyPaymentStats.day, DailyPaymentStats.provider, DailyPaymentStats.currency)
+            .order_by(DailyPaymentStats.day.desc())
+            .all()
+        )
+        subscriptions = (
+            db.session.query(
+                DailySubscriptionStats.day,
+                func.sum(DailySubscriptionStats.new),
+                func.sum(DailySubscriptionStats.renewed),
+                func.sum(DailySubscriptionStats.expired),
+                func.sum(DailySubscriptionStats.revoked),
+            )
+            .filter(DailySubscriptionStats.day >= since_day)
+            .group_by(DailySubscriptionStats.day)
+            .order_by(DailySubscriptionStats.day.desc())
+            .all()
+        )
+        users_total = func.sum(DailyUserStats.new)
+        sources = (
+            db.session.query(DailyUserStats.source, users_total)
+            .filter(DailyUserStats.day >= since_day)
+            .group_by(DailyUserStats.source)
+            .order_by(users_total.desc())
+            .all()
+        )
+        watermarks = db.session.query(StatsWatermark).order_by(StatsWatermark.name).all()
+
+        return self.render(
+            'admin/stats/index.html',
+            days=days,
+            payments=payments,
+            subscriptions=subscriptions,
+            sources=sources,
+            watermarks=watermarks,
+        )
+
+
+class PaymentLatencyView(BaseView):
+    """
+    Самые медленные платежи за последние дни: от callback провайдера до отправки
+    инвайта, с разбивкой по этапам (payment_latency пишет consumer бота).
+    """
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    @expose('/')
+    def index(self):
+        days = request.args.get('days', 7, type=int)
+        since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=days)
+
+        rows = (
+            db.session.query(PaymentLatency)
+            .filter(PaymentLatency.created_at >= since, PaymentLatency.total_ms.is_not(None))
+            .order_by(PaymentLatency.total_ms.desc())
+            .limit(50)
+            .all()
+        )
+        count, p50, p95, p99 = (
+            db.session.query(
+                func.count(PaymentLatency.total_ms),
+                func.percentile_cont(0.5).within_group(PaymentLatency.total_ms),
+                func.percentile_cont(0.95).within_group(PaymentLatency.total_ms),
+                func.percentile_cont(0.99).within_group(PaymentLatency.total_ms),
+            )
+            .filter(PaymentLatency.created_at >= since)
+            .one()
+        )
+        payments = [
+            (row, {
+                stage: round(seconds * 1000)
+                for stage, seconds in latency.stage_durations(_stamps(row)).items()
+            })
+            for row in rows
+        ]
+
+        return self.render(
+            'admin/stats/latency.html',
+            days=days,
+            stages=latency.STAGES[1:],
+            payments=payments,
+            count=count,
+            p50=p50,
+            p95=p95,
+            p99=p99,
+        )
+
+
+def _stamps(row: PaymentLatency) -> dict[str, float]:
+    stamps = {}
+    for stage in latency.STAGES:
+        at = getattr(row, f'{stage}_at')
+        if at is not None:
+            stamps[stage] = at.timestamp()
+    return stamps
@@ -0,0 +1,104 @@
+"""
+NATS request–reply сервер для создания платежей.
+
+Бот отправляет запрос в `rpc.payments.<provider>.create` и ждёт ответ
+вместо HTTP-похода в Flask. Запросы обрабатываются в пуле потоков
+(Flask-SQLAlchemy синхронный), по одному app_context на запрос.
+
+Запуск: python rpc.py
+"""
+import asyncio
+import json
+import logging
+import os
+
+from nats.aio.msg import Msg
+
+from common.nats_client import nats_manager
+from flaskapp import app
+from core.database.database import db
+from modules.payments.views import create_cryptobot_payment, create_robokassa_payment
+
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s',
+    level=logging.INFO
+    )
+logger = logging.getLogger(__name__)
+
+
+QUEUE_GROUP = "payments-rpc"
+
+HANDLERS = {
+    "rpc.payments.robokassa.create": create_robokassa_payment,
+    "rpc.payments.cryptobot.create": create_cryptobot_payment,
+}
+
+
+def _call(handler, user_id: int) -> tuple[dict, int]:
+    with app.app_context():
+        try:
+            return handler(user_id)
+        except Exception as exc:
+            db.session.rollback()
+            logger.exception("RPC handler %s failed: %s", handler.__name__, exc)
+            return {"error": "internal_error"}, 500
+        finally:
+            db.session.remove()
+
+
+def _check_token(msg: Msg) -> bool:
+    expected = os.getenv("INTERNAL_API_TOKEN") or ""
+    if not expected:
+        return False
+    provided = (msg.headers or {}).get("X-Internal-Token") or ""
+    return provided == expected
+
+
+async def _respond(msg: Msg, body: dict, status: int) -> None:
+    await msg.respond(json.dumps({"status": status, "body": body}).encode("utf-8"))
+
+
+async def handle_request(msg: Msg, sem: asyncio.Semaphore) -> None:
+    async with sem:
+        if not _check_token(msg):
+            await _respond(msg, {"error": "invalid_internal_token"}, 403)
+            return
+        try:
+            user_id = int(json.loads(msg.data.decode()).get("user_id"))
+        except (TypeError, ValueError, AttributeError):
+            await _respond(msg, {"error": "invalid_user_id"}, 400)
+            return
+
+        handler = HANDLERS[msg.subject]
+        body, status = await asyncio.to_thread(_call, handler, user_id)
+        await _respond(msg, body, status)
+
+
+async def main() -> None:
+    concurrency = int(os.getenv("PAYMENTS_RPC_CONCURRENCY") or "8")
+    sem = asyncio.Semaphore(concurrency)
+    tasks: set[asyncio.Task] = set()
+
+    async def on_message(msg: Msg) -> None:
+        # Колбэки одной подписки nats-py вызывает последовательно —
+        # выносим обработку в задачу, чтобы запросы не ждали друг друга.
+        task = asyncio.create_task(handle_request(msg, sem))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    # Долгоживущий процесс: ждём, пока NATS станет доступен.
+    nc = await nats_manager.connect(timeout=None)
+    for subject in HANDLERS:
+        await nc.subscribe(subject, queue=QUEUE_GROUP, cb=on_message)
+    logger.info("Payments RPC is listening on %s", ", ".join(HANDLERS))
+
+    try:
+        while True:
+            await asyncio.sleep(1)
+    finally:
+        await nats_manager.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())